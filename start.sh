@@ -22,18 +22,23 @@ DEFAULT_PORT=8999
 DEFAULT_DEPLOYMENT_DIR=deploys
 DEFAULT_PID_FILE=${DEFAULT_DEPLOYMENT_DIR}/current.pid
 DEFAULT_LOG_FILE=${DEFAULT_DEPLOYMENT_DIR}/current.log
+DEFAULT_WORKERS_LOG_FILE=${DEFAULT_DEPLOYMENT_DIR}/workers.log
+DEFAULT_MAINTENANCE_LOG_FILE=${DEFAULT_DEPLOYMENT_DIR}/maintenance.log
+DEFAULT_MAINTENANCE_INTERVAL=600
 CV_DIR=$(pwd)
 
 host=${DEFAULT_HOST}
 port=${DEFAULT_PORT}
 log=${DEFAULT_LOG_FILE}
+workers=
 
 usage()
 {
-    echo "Usage: $0 [--host host] [--port port] [--log log-file]"
+    echo "Usage: $0 [--host host] [--port port] [--log log-file] [--workers number]"
     echo -e "\t--host change host name (default is ${DEFAULT_HOST})"
     echo -e "\t--port change port number (default is ${DEFAULT_PORT})"
     echo -e "\t--log change server log file (default is ${DEFAULT_LOG_FILE})"
+    echo -e "\t--workers change number of workers of the launch queue (default is MAX_PROCESSING_JOBS)"
     exit 1
 }
 
@@ -42,6 +47,7 @@ while [[ "$1" != "" ]]; do
         --host )        shift; host="$1" ;;
         --port )        shift; port="$1" ;;
         --log )         shift; log="$1" ;;
+        --workers )     shift; workers="$1" ;;
         -h | --help )   usage ;;
         * )             usage ;;
     esac
@@ -54,6 +60,19 @@ fi
 
 echo $$ > ${DEFAULT_PID_FILE}
 
+# Launches of jobs are queued by the web-interface and processed by these workers (they are stopped by stop.sh)
+echo "Starting workers of the launch queue"
+nohup python3 ${CV_DIR}/web/manage.py LaunchWorkers ${workers:+--workers ${workers}} &> ${DEFAULT_WORKERS_LOG_FILE} &
+
+# Caches of reports, which were changed by uploads and marks, are recalculated and files of deleted reports
+# are removed periodically (stopped by stop.sh)
+echo "Starting periodic maintenance"
+nohup bash -c "while true; do
+    python3 ${CV_DIR}/web/manage.py RecalculateCaches --type dirty
+    python3 ${CV_DIR}/web/manage.py CollectFiles
+    sleep ${DEFAULT_MAINTENANCE_INTERVAL}
+done" &> ${DEFAULT_MAINTENANCE_LOG_FILE} &
+
 echo "Starting CV web-interface on ${host}:${port}"
 nohup python3 ${CV_DIR}/web/manage.py runserver ${host}:${port} &> ${DEFAULT_LOG_FILE}
 
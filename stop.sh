@@ -27,4 +27,5 @@ PID=$(cat ${DEFAULT_PID_FILE})
 
 rm ${DEFAULT_PID_FILE}
 
+# The web-interface, workers of the launch queue and periodic maintenance are started by start.sh
 pkill -P $PID
@@ -38,19 +38,23 @@ from jobs.configuration import GetConfiguration
 from jobs.jobForm import LoadFilesTree, JobForm
 from jobs.models import Job, RunHistory, JobFile
 from jobs.utils import change_job_status, remove_jobs_by_id
-from reports.UploadReport import UploadReport
-from reports.models import Report, ReportRoot, ReportSafe, ReportUnsafe, ReportUnknown, ReportComponent, \
-    Component, Computer, ReportAttr, ComponentResource, CoverageArchive, AttrFile, ErrorTraceSource
+from reports.UploadReport import UploadReport, UploadReportsBatch, bulk_create_reports, get_computer
+from reports.models import ReportRoot, ReportSafe, ReportUnsafe, ReportUnknown, ReportComponent, \
+    Component, ReportAttr, ComponentResource, CoverageArchive, AttrFile, ErrorTraceSource
 from reports.utils import AttrData
 from service.models import SolvingProgress, JobProgress
 from service.utils import StartJobDecision
 from tools.utils import Recalculation
-from web.ZipGenerator import ZipStream, CHUNK_SIZE
-from web.utils import logger, file_get_or_create, unique_id, BridgeException, OpenFiles
+from web.ZipGenerator import ZipStream, join_chunks
+from web.utils import logger, file_get_or_create, unique_id, BridgeException, OpenFiles, iter_json_list, \
+    save_file_from_path
 from web.vars import FORMAT, JOB_STATUS, REPORT_ARCHIVE, JOB_WEIGHT
 
 ARCHIVE_FORMAT = 12
 
+# Number of reports, which are loaded and exported or imported at once
+REPORTS_BATCH_SIZE = 1000
+
 
 class AttrDataArchive:
     def __init__(self, job):
@@ -58,17 +62,12 @@ class AttrDataArchive:
         self.stream = ZipStream()
 
     def __iter__(self):
-        for afile in AttrFile.objects.filter(root__job=self._job):
-            file_name = os.path.join(settings.MEDIA_ROOT, afile.file.name)
-            arc_name = os.path.join('{0}{1}'.format(afile.id, os.path.splitext(afile.file.name)[-1]))
-            buf = b''
-            for data in self.stream.compress_file(file_name, arc_name):
-                buf += data
-                if len(buf) > CHUNK_SIZE:
-                    yield buf
-                    buf = b''
-            if len(buf) > 0:
-                yield buf
+        files = list((
+            os.path.join(settings.MEDIA_ROOT, afile.file.name),
+            os.path.join('{0}{1}'.format(afile.id, os.path.splitext(afile.file.name)[-1]))
+        ) for afile in AttrFile.objects.filter(root__job=self._job))
+        for data in join_chunks(self.stream.compress_files(files)):
+            yield data
         yield self.stream.close_stream()
 
 
@@ -87,8 +86,7 @@ class JobArchiveGenerator:
             yield data
 
         reportsdata = ReportsData(self.job)
-        for data in self.stream.compress_string('reports.json', json.dumps(
-                reportsdata.reports, ensure_ascii=False, sort_keys=True, indent=4).encode('utf-8')):
+        for data in self.stream.compress_stream('reports.json', join_chunks(reportsdata)):
             yield data
         for data in self.stream.compress_string('computers.json', json.dumps(
                 reportsdata.computers, ensure_ascii=False, sort_keys=True, indent=4).encode('utf-8')):
@@ -102,9 +100,8 @@ class JobArchiveGenerator:
 
         self.__add_reports_files()
         self.__add_coverage_files(reportsdata.coverage_arch_names)
-        for file_path, arcname in self.files_to_add:
-            for data in self.stream.compress_file(file_path, arcname):
-                yield data
+        for data in self.stream.compress_files(self.files_to_add):
+            yield data
         if AttrFile.objects.filter(root__job=self.job).count() > 0:
             for data in self.stream.compress_stream('AttrData.zip', AttrDataArchive(self.job)):
                 yield data
@@ -223,14 +220,8 @@ class JobsArchivesGen:
     def __iter__(self):
         for job in self.jobs:
             jobgen = JobArchiveGenerator(job)
-            buf = b''
-            for data in self.stream.compress_stream(jobgen.arcname, jobgen):
-                buf += data
-                if len(buf) > CHUNK_SIZE:
-                    yield buf
-                    buf = b''
-            if len(buf) > 0:
-                yield buf
+            for data in join_chunks(self.stream.compress_stream(jobgen.arcname, jobgen)):
+                yield data
         yield self.stream.close_stream()
 
 
@@ -243,14 +234,8 @@ class JobsTreesGen:
     def __iter__(self):
         for job in self.jobs:
             jobgen = JobArchiveGenerator(job)
-            buf = b''
-            for data in self.stream.compress_stream(jobgen.arcname, jobgen):
-                buf += data
-                if len(buf) > CHUNK_SIZE:
-                    yield buf
-                    buf = b''
-            if len(buf) > 0:
-                yield buf
+            for data in join_chunks(self.stream.compress_stream(jobgen.arcname, jobgen)):
+                yield data
         for data in self.stream.compress_string('tree.json', json.dumps(self._tree, sort_keys=True, indent=2)):
             yield data
         yield self.stream.close_stream()
@@ -281,19 +266,28 @@ class ReportsData:
         try:
             self.root = ReportRoot.objects.get(job=job)
         except ObjectDoesNotExist:
-            self.reports = []
+            self.root = None
             self.resources = []
         else:
-            self.reports = self.__reports_data()
             self.__get_coverage_data()
             self.resources = self.__get_resources_data()
 
+    def __iter__(self):
+        # Encoded JSON list of reports, it is the same as json.dumps(<reports>, indent=4) result
+        has_reports = False
+        for report in self.__reports_data():
+            yield b',\n    ' if has_reports else b'[\n    '
+            yield json.dumps(report, ensure_ascii=False, sort_keys=True, indent=4) \
+                .replace('\n', '\n    ').encode('utf-8')
+            has_reports = True
+        yield b'\n]' if has_reports else b'[]'
+
     def __report_component_data(self, report):
         data = None
         if report.data:
             with report.data as fp:
                 data = fp.read().decode('utf8')
-        if report.computer_id not in self.computers:
+        if str(report.computer_id) not in self.computers:
             self.computers[str(report.computer_id)] = report.computer.description
         self._parents[report.id] = report.identifier
         return {
@@ -334,41 +328,45 @@ class ReportsData:
             data['source'] = report.source_id
         return data
 
-    def __reports_data(self):
-        reports = []
-        report_index = {}
-        i = 0
-        for rc in ReportComponent.objects.filter(root=self.root).select_related('component').order_by('id'):
-            report_index[rc.pk] = i
-            reports.append(self.__report_component_data(rc))
-            i += 1
-        reports.append(ReportSafe.__name__)
-        i += 1
-        for safe in ReportSafe.objects.filter(root=self.root):
-            report_index[safe.pk] = i
-            reports.append(self.__report_leaf_data(safe))
-            i += 1
-        reports.append(ReportUnsafe.__name__)
-        i += 1
-        for unsafe in ReportUnsafe.objects.filter(root=self.root):
-            report_index[unsafe.pk] = i
-            reports.append(self.__report_leaf_data(unsafe))
-            i += 1
-        reports.append(ReportUnknown.__name__)
-        i += 1
-        for unknown in ReportUnknown.objects.filter(root=self.root).select_related('component'):
-            report_index[unknown.pk] = i
-            reports.append(self.__report_leaf_data(unknown))
-            i += 1
-        for ra in ReportAttr.objects.filter(report__root=self.root).select_related('attr', 'attr__name', 'data') \
-                .order_by('id'):
+    def __add_attrs(self, reports):
+        # Attributes are collected for the batch of reports {<report id>: <report data>}
+        for ra in ReportAttr.objects.filter(report_id__in=list(reports)) \
+                .select_related('attr', 'attr__name', 'data').order_by('id'):
             ra_data = None
             if ra.data is not None:
                 ra_data = os.path.join('{0}{1}'.format(ra.data_id, os.path.splitext(ra.data.file.name)[-1]))
-            reports[report_index[ra.report_id]]['attrs'].append([
+            reports[ra.report_id]['attrs'].append([
                 ra.attr.name.name, ra.attr.value, ra.compare, ra.associate, ra_data
             ])
-        return reports
+
+    def __reports_batches(self, queryset, get_data):
+        reports = {}
+        for report in queryset.iterator(chunk_size=REPORTS_BATCH_SIZE):
+            reports[report.pk] = get_data(report)
+            if len(reports) >= REPORTS_BATCH_SIZE:
+                self.__add_attrs(reports)
+                yield from reports.values()
+                reports = {}
+        if reports:
+            self.__add_attrs(reports)
+            yield from reports.values()
+
+    def __reports_data(self):
+        # Reports are loaded and encoded by batches, so all reports are never kept in memory
+        if self.root is None:
+            return
+        yield from self.__reports_batches(
+            ReportComponent.objects.filter(root=self.root).select_related('component', 'computer').order_by('id'),
+            self.__report_component_data
+        )
+        yield ReportSafe.__name__
+        yield from self.__reports_batches(ReportSafe.objects.filter(root=self.root), self.__report_leaf_data)
+        yield ReportUnsafe.__name__
+        yield from self.__reports_batches(ReportUnsafe.objects.filter(root=self.root), self.__report_leaf_data)
+        yield ReportUnknown.__name__
+        yield from self.__reports_batches(
+            ReportUnknown.objects.filter(root=self.root).select_related('component'), self.__report_leaf_data
+        )
 
     def __get_coverage_data(self):
         for carch in CoverageArchive.objects.filter(report__root=self.root):
@@ -632,7 +630,7 @@ class UploadJob:
         ReportRoot.objects.create(user=self._user, job=self.job)
         try:
             UploadReports(
-                self.job, self.__read_json_file('reports.json'), self.__get_reports_files(),
+                self.job, os.path.join(self._jobdir, 'reports.json'), self.__get_reports_files(),
                 self.__read_json_file('computers.json'), self.__read_json_file('Resources.json'),
                 self.__read_json_file('coverage_archives.json'), self.__get_coverage_files(), self.__attr_data()
             )
@@ -676,178 +674,181 @@ class UploadJob:
 
 
 class UploadReports:
-    def __init__(self, job, data, files, computers, resources, coverage, cov_archives, attr_data):
-        self.data = data
+    def __init__(self, job, reports_file, files, computers, resources, coverage, cov_archives, attr_data):
         self._job = job
+        self._root = job.reportroot
         self._files = files
         self._computers = self.__upload_computers(computers)
-        self._parents = {None: None}
-        self._indexes = {}
-        self._tree = []
-        self._safes = []
-        self._unsafes = []
-        self._unknowns = []
+        self._attrs = AttrData(self._root.id, attr_data)
+        # Identifier: ReportComponent (created parents of other reports)
+        self._parents = {}
+        # Data of component reports, which parents were not created yet
+        self._pending = []
         self._components = {}
+        self._sources = {}
         self._rc_id_map = {}
 
-        if isinstance(self.data, list):
-            self.__upload_reports()
-            self.__upload_attrs(attr_data)
+        if os.path.isfile(reports_file):
+            self.__upload_reports(reports_file)
             # TODO: fix this
             # self.__upload_coverage(coverage, cov_archives)
             self.__upload_resources_cache(resources)
             Recalculation('for_uploaded', json.dumps([self._job.pk], ensure_ascii=False))
 
-    def __fix_identifer(self, i):
-        m = re.match('.*?(/.*)', self.data[i]['identifier'])
+    def __fix_identifer(self, data):
+        m = re.match('.*?(/.*)', data['identifier'])
         if m is None:
-            self.data[i]['identifier'] = self._job.identifier
+            data['identifier'] = self._job.identifier
         else:
-            self.data[i]['identifier'] = self._job.identifier + m.group(1)
-        if self.data[i]['parent'] is not None:
-            m = re.match('.*?(/.*)', self.data[i]['parent'])
+            data['identifier'] = self._job.identifier + m.group(1)
+        if data['parent'] is not None:
+            m = re.match('.*?(/.*)', data['parent'])
             if m is None:
-                self.data[i]['parent'] = self._job.identifier
+                data['parent'] = self._job.identifier
             else:
-                self.data[i]['parent'] = self._job.identifier + m.group(1)
+                data['parent'] = self._job.identifier + m.group(1)
 
     def __upload_computers(self, computers):
         db_computers = {}
         if isinstance(computers, dict):
             for c_id in computers:
-                computer = Computer.objects.get_or_create(description=computers[c_id])[0]
-                db_computers[c_id] = computer.id
+                db_computers[c_id] = get_computer(computers[c_id]).id
         return db_computers
 
-    def __upload_attrs(self, attr_data):
-        attrs = AttrData(self._job.reportroot.id, attr_data)
-        for report in Report.objects.filter(root=self._job.reportroot).only('id', 'identifier'):
-            i = self._indexes[report.identifier]
-            for attr in self.data[i]['attrs']:
-                attrs.add(report.id, *attr)
-        attrs.upload()
-
-    def __upload_reports(self):
-        curr_func = self.__add_report_component
-        for i in range(len(self.data)):
-            if isinstance(self.data[i], dict):
-                self.__fix_identifer(i)
-                curr_func(i)
-            elif isinstance(self.data[i], str) and self.data[i] == ReportSafe.__name__:
-                def curr_func(x):
-                    self._safes.append(x)
-                    self._indexes[self.data[x]['identifier']] = x
-            elif isinstance(self.data[i], str) and self.data[i] == ReportUnsafe.__name__:
-                def curr_func(x):
-                    self._unsafes.append(x)
-                    self._indexes[self.data[x]['identifier']] = x
-            elif isinstance(self.data[i], str) and self.data[i] == ReportUnknown.__name__:
-                def curr_func(x):
-                    self._unknowns.append(x)
-                    self._indexes[self.data[x]['identifier']] = x
-        for lvl in range(len(self._tree)):
-            self.__upload_report_components(lvl)
-            for report in ReportComponent.objects.filter(root=self._job.reportroot):
-                self._parents[report.identifier] = report.id
-        self.__upload_safe_reports()
-        self.__upload_unsafe_reports()
-        self.__upload_unknown_reports()
-
-    @transaction.atomic
-    def __upload_report_components(self, lvl):
-        for identifier in self._tree[lvl]:
-            i = self._indexes[identifier]
-            report = ReportComponent(
-                identifier=identifier, root=self._job.reportroot, covnum=self.data[i]['covnum'],
-                parent_id=self._parents[self.data[i].get('parent')],
-                computer_id=self._computers[self.data[i]['computer']],
-                component_id=self.__get_component(self.data[i]['component']),
-                verification=self.data[i]['verification'],
-                start_date=datetime.fromtimestamp(self.data[i]['start_date'], pytz.timezone('UTC')),
-                finish_date=datetime.fromtimestamp(self.data[i]['finish_date'], pytz.timezone('UTC'))
-                if self.data[i]['finish_date'] is not None else None
-            )
-            if self.data[i]['resource'] is not None:
-                report.cpu_time = self.data[i]['resource']['cpu_time']
-                report.wall_time = self.data[i]['resource']['wall_time']
-                report.memory = self.data[i]['resource']['memory']
-
-            log_id = (ReportComponent.__name__, 'log', self.data[i]['pk'])
-            if log_id in self._files:
-                with open(self._files[log_id], mode='rb') as fp:
-                    report.add_log(REPORT_ARCHIVE['log'], fp)
-
-            verifier_input_id = (ReportComponent.__name__, 'verifier_input', self.data[i]['pk'])
-            if verifier_input_id in self._files:
-                with open(self._files[verifier_input_id], mode='rb') as fp:
-                    report.add_verifier_input(REPORT_ARCHIVE['verifier input'], fp)
-
-            if self.data[i]['data'] is not None:
-                report.new_data('report-data.json', BytesIO(self.data[i]['data'].encode('utf8')))
-
-            report.save()
-            self._rc_id_map[self.data[i]['pk']] = report.id
-
-    @transaction.atomic
-    def __upload_safe_reports(self):
-        sources = {}
-        for i in self._safes:
-            if self.data[i]['source'] not in sources:
-                source_arch_id = (ErrorTraceSource.__name__, 'source', self.data[i]['source'])
-                new_source = ErrorTraceSource(root=self._job.reportroot)
-                with open(self._files[source_arch_id], mode='rb') as fp:
-                    new_source.add_sources(REPORT_ARCHIVE['sources'], fp, True)
-                sources[self.data[i]['source']] = new_source.id
-            report = ReportSafe(
-                root=self._job.reportroot, identifier=self.data[i]['identifier'],
-                parent_id=self._parents[self.data[i]['parent']], source_id=sources[self.data[i]['source']],
-                cpu_time=self.data[i]['cpu_time'], wall_time=self.data[i]['wall_time'], memory=self.data[i]['memory']
-            )
-            proof_id = (ReportSafe.__name__, 'proof', self.data[i]['pk'])
-            if proof_id in self._files:
-                with open(self._files[proof_id], mode='rb') as fp:
-                    report.add_proof(REPORT_ARCHIVE['proof'], fp)
-            report.save()
+    def __upload_reports(self, reports_file):
+        # Reports are read one by one and created by batches. Component reports go first and each of them
+        # goes after its parent, then leaves of each type go after the name of their model.
+        leaf_models = {ReportSafe.__name__: ReportSafe, ReportUnsafe.__name__: ReportUnsafe,
+                       ReportUnknown.__name__: ReportUnknown}
+        model = ReportComponent
+        batch = []
+        with open(reports_file, encoding='utf8') as fp:
+            for data in iter_json_list(fp):
+                if isinstance(data, dict):
+                    self.__fix_identifer(data)
+                    batch.append(data)
+                    if len(batch) >= REPORTS_BATCH_SIZE:
+                        self.__upload_batch(model, batch)
+                        batch = []
+                elif isinstance(data, str) and data in leaf_models:
+                    self.__upload_batch(model, batch)
+                    batch = []
+                    model = leaf_models[data]
+        self.__upload_batch(model, batch)
+
+    def __upload_batch(self, model, batch):
+        if model == ReportComponent:
+            self.__upload_report_components(batch)
+        else:
+            if len(self._pending) > 0:
+                raise ValueError('The report parent was not found in data')
+            if len(batch) > 0:
+                self.__upload_leaves(model, batch)
+        self._attrs.upload()
 
     @transaction.atomic
-    def __upload_unsafe_reports(self):
-        sources = {}
-        for i in self._unsafes:
-            # Upload error trace sources if it was not uploaded for already created error traces
-            if self.data[i]['source'] not in sources:
-                source_arch_id = (ErrorTraceSource.__name__, 'source', self.data[i]['source'])
-                new_source = ErrorTraceSource(root=self._job.reportroot)
-                with open(self._files[source_arch_id], mode='rb') as fp:
-                    new_source.add_sources(REPORT_ARCHIVE['sources'], fp, True)
-                sources[self.data[i]['source']] = new_source.id
-
-            # Check if error trace identifier exists and is unique
-            if 'trace_id' not in self.data[i] or \
-                    ReportUnsafe.objects.filter(trace_id=self.data[i]['trace_id']).count() > 0:
-                self.data[i]['trace_id'] = unique_id()
-
-            report = ReportUnsafe(
-                root=self._job.reportroot, identifier=self.data[i]['identifier'], trace_id=self.data[i]['trace_id'],
-                source_id=sources[self.data[i]['source']], parent_id=self._parents[self.data[i]['parent']],
-                cpu_time=self.data[i]['cpu_time'], wall_time=self.data[i]['wall_time'], memory=self.data[i]['memory']
-            )
-            trace_id = (ReportUnsafe.__name__, 'trace', self.data[i]['pk'])
-            with open(self._files[trace_id], mode='rb') as fp:
-                report.add_trace(REPORT_ARCHIVE['error trace'], fp, True)
+    def __upload_report_components(self, batch):
+        # Components are created level by level, children of reports from the batch are created in the same batch
+        self._pending.extend(batch)
+        while True:
+            ready = list(data for data in self._pending if data['parent'] is None or data['parent'] in self._parents)
+            if len(ready) == 0:
+                break
+            self._pending = list(data for data in self._pending
+                                 if data['parent'] is not None and data['parent'] not in self._parents)
+            reports = list(self.__get_report_component(data) for data in ready)
+            bulk_create_reports(ReportComponent, reports)
+            for data, report in zip(ready, reports):
+                self._parents[report.identifier] = report
+                self._rc_id_map[data['pk']] = report.id
+                self.__add_attrs(report.id, data)
+
+    def __get_report_component(self, data):
+        report = ReportComponent(
+            identifier=data['identifier'], root=self._root, covnum=data['covnum'],
+            parent=self._parents[data['parent']] if data['parent'] is not None else None,
+            computer_id=self._computers[data['computer']],
+            component_id=self.__get_component(data['component']),
+            verification=data['verification'],
+            start_date=datetime.fromtimestamp(data['start_date'], pytz.timezone('UTC')),
+            finish_date=datetime.fromtimestamp(data['finish_date'], pytz.timezone('UTC'))
+            if data['finish_date'] is not None else None
+        )
+        if data['resource'] is not None:
+            report.cpu_time = data['resource']['cpu_time']
+            report.wall_time = data['resource']['wall_time']
+            report.memory = data['resource']['memory']
+
+        log_id = (ReportComponent.__name__, 'log', data['pk'])
+        if log_id in self._files:
+            save_file_from_path(report.log, REPORT_ARCHIVE['log'], self._files[log_id])
+
+        verifier_input_id = (ReportComponent.__name__, 'verifier_input', data['pk'])
+        if verifier_input_id in self._files:
+            save_file_from_path(report.verifier_input, REPORT_ARCHIVE['verifier input'],
+                                self._files[verifier_input_id])
+
+        if data['data'] is not None:
+            report.new_data('report-data.json', BytesIO(data['data'].encode('utf8')))
+        return report
 
     @transaction.atomic
-    def __upload_unknown_reports(self):
-        for i in self._unknowns:
-            report = ReportUnknown(
-                root=self._job.reportroot, identifier=self.data[i]['identifier'],
-                parent_id=self._parents[self.data[i]['parent']],
-                component_id=self.__get_component(self.data[i]['component']),
-                cpu_time=self.data[i]['cpu_time'], wall_time=self.data[i]['wall_time'], memory=self.data[i]['memory']
+    def __upload_leaves(self, model, batch):
+        if model == ReportUnsafe:
+            self.__check_trace_ids(batch)
+        reports = []
+        for data in batch:
+            if data['parent'] not in self._parents:
+                raise ValueError('The report parent was not found in data')
+            report = model(
+                root=self._root, identifier=data['identifier'], parent=self._parents[data['parent']],
+                cpu_time=data['cpu_time'], wall_time=data['wall_time'], memory=data['memory']
             )
-            problem_id = (ReportUnknown.__name__, 'problem', self.data[i]['pk'])
-            with open(self._files[problem_id], mode='rb') as fp:
-                report.add_problem_desc(REPORT_ARCHIVE['problem desc'], fp)
-            report.save()
+            if model == ReportSafe:
+                if data.get('source') is not None:
+                    report.source_id = self.__get_source(data['source'])
+                proof_id = (ReportSafe.__name__, 'proof', data['pk'])
+                if proof_id in self._files:
+                    save_file_from_path(report.proof, REPORT_ARCHIVE['proof'], self._files[proof_id])
+            elif model == ReportUnsafe:
+                report.trace_id = data['trace_id']
+                report.source_id = self.__get_source(data['source'])
+                save_file_from_path(report.error_trace, REPORT_ARCHIVE['error trace'],
+                                    self._files[(ReportUnsafe.__name__, 'trace', data['pk'])])
+            else:
+                report.component_id = self.__get_component(data['component'])
+                save_file_from_path(report.problem_description, REPORT_ARCHIVE['problem desc'],
+                                    self._files[(ReportUnknown.__name__, 'problem', data['pk'])])
+            reports.append(report)
+        bulk_create_reports(model, reports)
+        for data, report in zip(batch, reports):
+            self.__add_attrs(report.id, data)
+
+    def __check_trace_ids(self, batch):
+        # Error trace identifiers must be unique, so existing ones are replaced
+        trace_ids = set(ReportUnsafe.objects.filter(
+            trace_id__in=list(data['trace_id'] for data in batch if 'trace_id' in data)
+        ).values_list('trace_id', flat=True))
+        for data in batch:
+            if 'trace_id' not in data or data['trace_id'] in trace_ids:
+                data['trace_id'] = unique_id()
+                while data['trace_id'] in trace_ids or ReportUnsafe.objects.filter(trace_id=data['trace_id']).exists():
+                    data['trace_id'] = unique_id()
+            trace_ids.add(data['trace_id'])
+
+    def __get_source(self, source):
+        # Error trace sources are shared between leaves
+        if source not in self._sources:
+            new_source = ErrorTraceSource(root=self._root)
+            save_file_from_path(new_source.archive, REPORT_ARCHIVE['sources'],
+                                self._files[(ErrorTraceSource.__name__, 'source', source)])
+            new_source.save()
+            self._sources[source] = new_source.id
+        return self._sources[source]
+
+    def __add_attrs(self, report_id, data):
+        for attr in data['attrs']:
+            self._attrs.add(report_id, *attr)
 
     def __get_component(self, name):
         if name not in self._components:
@@ -855,24 +856,6 @@ class UploadReports:
             self._components[name] = component.id
         return self._components[name]
 
-    def __add_report_component(self, i):
-        p_id = self.data[i].get('parent')
-        if p_id is None:
-            self.__add_to_tree(0, i)
-        else:
-            for j in range(len(self._tree)):
-                if p_id in self._tree[j]:
-                    self.__add_to_tree(j + 1, i)
-                    break
-            else:
-                raise ValueError('The report parent was not found in data')
-
-    def __add_to_tree(self, lvl, i):
-        while len(self._tree) <= lvl:
-            self._tree.append(set())
-        self._tree[lvl].add(self.data[i]['identifier'])
-        self._indexes[self.data[i]['identifier']] = i
-
     @transaction.atomic
     def __upload_coverage(self, coverage, archives):
         if not isinstance(coverage, list):
@@ -928,12 +911,16 @@ class UploadReportsWithoutDecision:
         'attr data', 'log', 'coverage', 'input files of static verifiers',
         'proof', 'sources', 'error traces', 'problem desc', 'coverage sources'
     ]
+    # Leaves of verification reports, which are uploaded together with them
+    batch_leaves = {'safe', 'unsafe', 'unknown'}
+    # Number of reports, which are uploaded together (all their files are opened at once)
+    batch_size = 100
 
     def __init__(self, job, user, reports_dir):
         self._job = job
         self._user = user
         self._reports_dir = reports_dir
-        self._data = self.__read_reports_data()
+        self._children = self.__read_reports_data()
         self.source_archives = dict()
         self.__prepare_job()
         try:
@@ -946,14 +933,22 @@ class UploadReportsWithoutDecision:
         change_job_status(self._job, JOB_STATUS[3][0])
 
     def __read_reports_data(self):
+        # Reports are indexed by their parents identifiers in one pass
         reports_file = os.path.join(self._reports_dir, self.reports_file)
         if not os.path.isfile(reports_file):
             raise BridgeException(_("The archive doesn't contain main reports file"))
-        with open(reports_file, encoding='utf8') as fp:
-            data = json.load(fp)
-        if not isinstance(data, list) or len(data) == 0:
+        children = {}
+        try:
+            with open(reports_file, encoding='utf8') as fp:
+                for report in iter_json_list(fp):
+                    if not isinstance(report, dict) or 'parent id' not in report:
+                        raise ValueError('Wrong report data')
+                    children.setdefault(report['parent id'], []).append(report)
+        except ValueError:
             raise BridgeException(_('Wrong format of main reports file'))
-        return data
+        if len(children) == 0:
+            raise BridgeException(_('Wrong format of main reports file'))
+        return children
 
     def __prepare_job(self):
         StartJobDecision(self._user, self._job.id, GetConfiguration().configuration, fake=True)
@@ -966,9 +961,8 @@ class UploadReportsWithoutDecision:
             'safe': self.__upload_leaf, 'unsafe': self.__upload_leaf, 'unknown': self.__upload_leaf,
             'job coverage': self.__upload_leaf
         }
-        for report in self._data:
-            if report['parent id'] == parent_id:
-                actions[report['type']](report)
+        for report in self._children.get(parent_id, []):
+            actions[report['type']](report)
 
     def __upload_component(self, data):
         self.__upload(data, 'start')
@@ -976,14 +970,24 @@ class UploadReportsWithoutDecision:
         self.__upload(data, 'finish')
 
     def __upload_verification(self, data):
-        self.__upload(data, 'verification')
-        self.__upload_children(data['id'])
-        self.__upload(data, 'verification finish')
+        children = self._children.get(data['id'], [])
+        if any(child['type'] not in self.batch_leaves for child in children):
+            self.__upload(data, 'verification')
+            self.__upload_children(data['id'])
+            self.__upload(data, 'verification finish')
+            return
+
+        # Verification report with its leaves are uploaded together
+        reports = [self.__get_report(data, 'verification')] + \
+            list(self.__get_report(child, child['type']) for child in children) + \
+            [self.__get_report(data, 'verification finish')]
+        for i in range(0, len(reports), self.batch_size):
+            self.__upload_batch(reports[i:i + self.batch_size])
 
     def __upload_leaf(self, data):
         self.__upload(data, data['type'])
 
-    def __upload(self, data, report_type):
+    def __get_report(self, data, report_type):
         # Collecting report data
         report = data.copy()
         if 'resources' in self.fields[report_type] and 'resources' not in report:
@@ -1002,6 +1006,10 @@ class UploadReportsWithoutDecision:
                     files.extend(list(os.path.join(self._reports_dir, p) for p in report[f]))
                 elif isinstance(report[f], dict):
                     files.extend(list(os.path.join(self._reports_dir, p) for p in report[f].values()))
+        return report, files
+
+    def __upload(self, data, report_type):
+        report, files = self.__get_report(data, report_type)
 
         # Uploading report
         try:
@@ -1011,3 +1019,17 @@ class UploadReportsWithoutDecision:
                 raise ValueError(res.error)
         except FileNotFoundError:
             logger.error('Files {} were not found'.format(files))
+
+    def __upload_batch(self, reports_data):
+        reports = []
+        files = []
+        for report, report_files in reports_data:
+            if any(not os.path.isfile(p) for p in report_files):
+                logger.error('Files {} were not found'.format(report_files))
+                continue
+            reports.append(report)
+            files.extend(report_files)
+        with OpenFiles(*files, rel_path=self._reports_dir) as archives:
+            res = UploadReportsBatch(self._job, reports, archives=archives, source_archives=self.source_archives)
+        if res.error is not None:
+            raise ValueError(res.error)
@@ -276,23 +276,28 @@ class TableTree:
                 jobs_in_tree.add(parent)
                 parent = tree_struct[parent]
 
-        # Get ordered list of jobs
-        jobs_list = list(j.id for j in Job.objects.filter(id__in=jobs_in_tree).order_by(jobs_order).only('id'))
-
-        # Function collects children tree for specified job id (p_id)
-        def get_job_children(p_id):
-            children = []
-            for oj_id in jobs_list:
-                if tree_struct[oj_id] == p_id:
-                    children.append({'id': oj_id, 'parent': p_id})
-                    children.extend(get_job_children(oj_id))
-            return children
+        # Children of each job in the specified order
+        children = {}
+        for j_id, j_format in Job.objects.filter(id__in=jobs_in_tree).order_by(jobs_order).values_list('id', 'format'):
+            children.setdefault(tree_struct[j_id], []).append((j_id, j_format))
+
+        # Jobs tree in depth-first order
+        tree = []
+        stack = list((j_id, j_format, None, 0) for j_id, j_format in reversed(children.get(None, [])))
+        while stack:
+            j_id, j_format, p_id, level = stack.pop()
+            tree.append({
+                'id': j_id, 'parent': p_id, 'format': j_format, 'level': level,
+                'children': j_id in children,
+                'double_children': any(ch_id in children for ch_id, ch_format in children.get(j_id, []))
+            })
+            stack.extend((ch_id, ch_format, j_id, level + 1) for ch_id, ch_format in reversed(children.get(j_id, [])))
 
         # Get roots' ids for DB reqeusts optimizations
         roots = dict((r_id, j_id) for r_id, j_id in ReportRoot.objects.filter(job_id__in=accessed)
                      .values_list('id', 'job_id'))
 
-        return get_job_children(None), accessed, roots
+        return tree, accessed, roots
 
     def __get_core_reports(self):
         cores = {}
@@ -414,25 +419,6 @@ class TableTree:
         columns.append('problem:total')
         return columns
 
-    def __get_level(self, cur_id: int) -> int:
-        for job in self._tree:
-            if job['id'] == cur_id:
-                return 1 + self.__get_level(job['parent'])
-        return 0
-
-    def __has_children(self, cur_id: int) -> bool:
-        for job in self._tree:
-            if job['parent'] == cur_id:
-                return True
-        return False
-
-    def __has_double_children(self, cur_id: int) -> bool:
-        for job in self._tree:
-            if job['parent'] == cur_id:
-                if self.__has_children(job['id']):
-                    return True
-        return False
-
     def __get_values(self):
         self.__init_values_data()
         self.__collect_jobdata()
@@ -482,12 +468,11 @@ class TableTree:
                 'id': job['id'], 'parent': job['parent'],
                 'black': job['id'] not in self._job_ids,
                 'values': row_values,
-                "type": Job.objects.get(pk=job['id']).format,
-                "level": self.__get_level(job['parent']),
+                "type": job['format'],
+                "level": job['level'],
                 'desc': self._values_data[job['id']].get('desc', ''),
-                "children": self.__has_children(job['id']),
-                "double_children": self.__has_double_children(job['id'])
-
+                "children": job['children'],
+                "double_children": job['double_children']
             })
         return table_rows
 
@@ -509,12 +494,12 @@ class TableTree:
             if j.change_author is not None:
                 self._values_data[j.id]['author'] = (j.change_author.get_full_name(),
                                                      reverse('users:show_profile', args=[j.change_author_id]))
-            try:
-                desc = JobHistory.objects.get(job_id=j.id, version=F('job__version')).description
-            except:
-                desc = None
+
+        # Descriptions of the last versions of jobs
+        for j_id, desc in JobHistory.objects.filter(job_id__in=self._job_ids, version=F('job__version')) \
+                .values_list('job_id', 'description'):
             if desc:
-                self._values_data[j.id]['desc'] = desc
+                self._values_data[j_id]['desc'] = desc
 
     def __get_safes_without_confirmed(self):
         # Collect safes data
@@ -21,17 +21,30 @@
 
 import json
 import os
+import tempfile
+import zipfile
+from io import BytesIO, StringIO
+from unittest import mock
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.timezone import now
 
+from jobs.Download import ReportsData, JobArchiveGenerator, UploadJob, UploadReportsWithoutDecision
 from jobs.jobForm import LoadFilesTree
+from jobs.JobTableProperties import TableTree
 from jobs.models import Job, JobHistory, JobFile, FileSystem, RunHistory
-from users.models import User, View, PreferableView
+from reports.models import ReportAttr, ReportComponent, ReportSafe, ReportUnknown
+from reports.test import create_decided_job, zip_archive
+from reports.UploadReport import UploadReportsBatch
+from users.models import User, Extended, View, PreferableView
 from web.populate import populate_users
-from web.utils import CVTestCase
-from web.vars import JOB_ROLES, JOB_STATUS
+from web.utils import CVTestCase, iter_json_list
+from web.ZipGenerator import join_chunks
+from web.vars import JOB_ROLES, JOB_STATUS, USER_ROLES, FORMAT
 
 
 class TestJobs(CVTestCase):
@@ -591,3 +604,222 @@ class TestJobs(CVTestCase):
         if os.path.exists(os.path.join(settings.MEDIA_ROOT, self.test_conf)):
             os.remove(os.path.join(settings.MEDIA_ROOT, self.test_conf))
         super().tearDown()
+
+
+class TestJobsTree(CVTestCase):
+    def setUp(self):
+        super(TestJobsTree, self).setUp()
+        self.user = User.objects.create(username='tree_manager')
+        Extended.objects.create(user=self.user, role=USER_ROLES[2][0])
+        self.view = {'columns': ['role', 'author', 'date', 'status', 'identifier', 'parent_id'],
+                     'order': ['down', 'title']}
+
+    def __create_job(self, name, parent=None, description=''):
+        job = Job.objects.create(identifier=name, name=name, change_date=now(), status=JOB_STATUS[2][0],
+                                 parent=parent, format=FORMAT, version=1)
+        JobHistory.objects.create(job=job, version=1, change_author=self.user, description=description)
+        return job
+
+    def __tree_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            TableTree(self.user, self.view)
+        return len(ctx.captured_queries)
+
+    def test_tree(self):
+        root_b = self.__create_job('b')
+        root_a = self.__create_job('a', description='First root')
+        child_d = self.__create_job('d', parent=root_a)
+        child_c = self.__create_job('c', parent=root_a)
+        grandchild = self.__create_job('e', parent=child_d, description='Grandchild')
+
+        values = TableTree(self.user, self.view).values
+        self.assertEqual(
+            list((row['id'], row['parent'], row['level'], row['children'], row['double_children'], row['desc'])
+                 for row in values),
+            [
+                (root_a.id, None, 0, True, True, 'First root'),
+                (child_c.id, root_a.id, 1, False, False, ''),
+                (child_d.id, root_a.id, 1, True, False, ''),
+                (grandchild.id, child_d.id, 2, False, False, 'Grandchild'),
+                (root_b.id, None, 0, False, False, '')
+            ]
+        )
+        self.assertTrue(all(row['type'] == FORMAT for row in values))
+
+        self.view['order'] = ['up', 'title']
+        self.assertEqual(list(row['id'] for row in TableTree(self.user, self.view).values),
+                         [root_b.id, root_a.id, child_d.id, grandchild.id, child_c.id])
+
+    def test_queries(self):
+        parent = self.__create_job('job 0')
+        for i in range(1, 5):
+            parent = self.__create_job('job %s' % i, parent=parent, description='Job %s' % i)
+        queries = self.__tree_queries()
+
+        # Number of queries doesn't depend on the number of jobs
+        for i in range(5, 40):
+            self.__create_job('job %s' % i, parent=parent if i % 2 else None, description='Job %s' % i)
+        self.assertEqual(self.__tree_queries(), queries)
+
+
+class TestReportsData(CVTestCase):
+    def setUp(self):
+        super(TestReportsData, self).setUp()
+        self.job, self.root, self.core = create_decided_job('reports_data_job')
+        res = UploadReportsBatch(self.job, [
+            {'type': 'verification', 'id': '/v1', 'parent id': '/', 'name': 'RP',
+             'attrs': [{'name': 'Requirement', 'value': 'мьютекс'}],
+             'resources': {'CPU time': 10, 'wall time': 20, 'memory size': 30}},
+            {'type': 'verification', 'id': '/v2', 'parent id': '/', 'name': 'RP',
+             'attrs': [{'name': 'Requirement', 'value': 'spinlock'}],
+             'resources': {'CPU time': 1, 'wall time': 2, 'memory size': 300}},
+            {'type': 'safe', 'id': '/v1/s', 'parent id': '/v1', 'attrs': [{'name': 'Verdict', 'value': 'safe'}]},
+            {'type': 'unknown', 'id': '/v2/u', 'parent id': '/v2', 'problem desc': 'desc.zip'},
+            {'type': 'verification finish', 'id': '/v1'},
+            {'type': 'verification finish', 'id': '/v2'}
+        ], {'desc.zip': zip_archive('problem desc.txt', b'Fail')})
+        self.assertIsNone(res.error)
+
+    def test_reports_json(self):
+        expected = None
+        for batch_size in (1, 2, 1000):
+            with mock.patch('jobs.Download.REPORTS_BATCH_SIZE', batch_size):
+                reports_data = ReportsData(self.job)
+                data = b''.join(reports_data)
+
+            # Streamed data is the same as the dump of the whole list of reports
+            reports = json.loads(data.decode('utf8'))
+            self.assertEqual(data, json.dumps(reports, ensure_ascii=False, sort_keys=True, indent=4).encode('utf8'))
+            if expected is None:
+                expected = data
+            self.assertEqual(data, expected)
+            self.assertEqual(reports_data.computers, {str(self.core.computer_id): self.core.computer.description})
+
+        self.assertEqual(list(r for r in reports if isinstance(r, str)),
+                         ['ReportSafe', 'ReportUnsafe', 'ReportUnknown'])
+        components = dict((r['identifier'], r) for r in reports[:reports.index('ReportSafe')])
+        self.assertEqual(set(components), {'reports_data_job/', 'reports_data_job/v1', 'reports_data_job/v2'})
+        self.assertEqual(components['reports_data_job/v1']['parent'], 'reports_data_job/')
+        self.assertEqual(list(a[:2] for a in components['reports_data_job/v1']['attrs']),
+                         [['Requirement', 'мьютекс']])
+        safe = reports[reports.index('ReportSafe') + 1]
+        self.assertEqual(safe['parent'], 'reports_data_job/v1')
+        self.assertEqual(list(a[:2] for a in safe['attrs']), [['Requirement', 'мьютекс'], ['Verdict', 'safe']])
+        unknown = reports[reports.index('ReportUnknown') + 1]
+        self.assertEqual(unknown['parent'], 'reports_data_job/v2')
+
+        with zipfile.ZipFile(BytesIO(b''.join(JobArchiveGenerator(self.job)))) as zfp:
+            self.assertEqual(zfp.read('reports.json'), expected)
+
+    def test_without_reports(self):
+        job = Job.objects.create(identifier='job_without_reports', name='job_without_reports', change_date=now(),
+                                 status=JOB_STATUS[0][0])
+        self.assertEqual(b''.join(ReportsData(job)), b'[]')
+
+    def test_join_chunks(self):
+        self.assertEqual(list(join_chunks(iter([b'a', b'bc', b'', b'd']), size=2)), [b'abc', b'd'])
+        self.assertEqual(list(join_chunks(iter([b'', b'']))), [])
+
+
+class TestJobImport(CVTestCase):
+    def setUp(self):
+        super(TestJobImport, self).setUp()
+        User.objects.create_superuser('superuser', '', 'top_secret')
+        populate_users(
+            manager={'username': 'manager', 'password': 'manager'},
+            service={'username': 'service', 'password': 'service'}
+        )
+        self.client.post(reverse('users:login'), {'username': 'manager', 'password': 'manager'})
+        self.client.post(reverse('population'))
+        self.user = User.objects.get(username='manager')
+        self.job = Job.objects.filter(parent=None).first()
+
+    def __create_reports_dir(self, reports_dir):
+        for arcname, fname, content in [('log.zip', 'log.txt', b'log'), ('proof.zip', 'proof.txt', b'proof'),
+                                        ('desc1.zip', 'problem desc.txt', b'Fail 1'),
+                                        ('desc2.zip', 'problem desc.txt', b'Fail 2')]:
+            with zipfile.ZipFile(os.path.join(reports_dir, arcname), mode='w') as zfp:
+                zfp.writestr(fname, content)
+        reports = [
+            {'type': 'component', 'id': '/', 'parent id': None, 'name': 'Core', 'log': 'log.zip',
+             'attrs': [{'name': 'Linux', 'value': '3.5'}], 'comp': [{'node name': 'node'}, {'cpus': 4}],
+             'resources': {'CPU time': 1, 'wall time': 2, 'memory size': 3}},
+            {'type': 'component', 'id': '/sub', 'parent id': '/', 'name': 'Sub', 'attrs': [],
+             'resources': {'CPU time': 5, 'wall time': 6, 'memory size': 7}}
+        ]
+        for i in range(3):
+            reports.append({
+                'type': 'verification', 'id': '/sub/v%s' % i, 'parent id': '/sub', 'name': 'RP',
+                'attrs': [{'name': 'Requirement', 'value': 'req %s' % i}],
+                'resources': {'CPU time': 10 + i, 'wall time': 20, 'memory size': 30 + i}
+            })
+            if i == 0:
+                reports.append({'type': 'safe', 'id': '/sub/v0/safe', 'parent id': '/sub/v0', 'proof': 'proof.zip',
+                                'attrs': [{'name': 'Verdict', 'value': 'safe'}]})
+            else:
+                reports.append({'type': 'unknown', 'id': '/sub/v%s/unknown' % i, 'parent id': '/sub/v%s' % i,
+                                'attrs': [], 'problem desc': 'desc%s.zip' % i})
+        with open(os.path.join(reports_dir, 'reports.json'), mode='w', encoding='utf8') as fp:
+            json.dump(reports, fp)
+
+    def __reports_tree(self, job):
+        # Reports with identifiers relative to the job, their parents, resources and attributes
+        reports = []
+        prefix_len = len(job.identifier)
+        for model in [ReportComponent, ReportSafe, ReportUnknown]:
+            for report in model.objects.filter(root__job=job).select_related('parent'):
+                reports.append((
+                    model.__name__, report.identifier[prefix_len:],
+                    report.parent.identifier[prefix_len:] if report.parent else None,
+                    report.cpu_time, report.wall_time, report.memory,
+                    sorted(ReportAttr.objects.filter(report=report).values_list('attr__name__name', 'attr__value'))
+                ))
+        return sorted(reports, key=str)
+
+    def test_upload_reports(self):
+        with tempfile.TemporaryDirectory() as reports_dir:
+            self.__create_reports_dir(reports_dir)
+            UploadReportsWithoutDecision(self.job, self.user, reports_dir)
+        self.job = Job.objects.get(id=self.job.id)
+        self.assertEqual(self.job.status, JOB_STATUS[3][0])
+        self.assertEqual(self.__reports_tree(self.job), [
+            ('ReportComponent', '/', None, 1, 2, 3, [('Linux', '3.5')]),
+            ('ReportComponent', '/sub', '/', 5, 6, 7, []),
+            ('ReportComponent', '/sub/v0', '/sub', 10, 20, 30, [('Requirement', 'req 0')]),
+            ('ReportComponent', '/sub/v1', '/sub', 11, 20, 31, [('Requirement', 'req 1')]),
+            ('ReportComponent', '/sub/v2', '/sub', 12, 20, 32, [('Requirement', 'req 2')]),
+            ('ReportSafe', '/sub/v0/safe', '/sub/v0', 10, 20, 30,
+             [('Linux', '3.5'), ('Requirement', 'req 0'), ('Verdict', 'safe')]),
+            ('ReportUnknown', '/sub/v1/unknown', '/sub/v1', 11, 20, 31, [('Linux', '3.5'), ('Requirement', 'req 1')]),
+            ('ReportUnknown', '/sub/v2/unknown', '/sub/v2', 12, 20, 32, [('Linux', '3.5'), ('Requirement', 'req 2')])
+        ])
+
+    def test_export_import(self):
+        with tempfile.TemporaryDirectory() as reports_dir:
+            self.__create_reports_dir(reports_dir)
+            UploadReportsWithoutDecision(self.job, self.user, reports_dir)
+        job_archive = b''.join(JobArchiveGenerator(Job.objects.get(id=self.job.id)))
+        expected = self.__reports_tree(self.job)
+
+        # Components are created by several rounds if batches are smaller than the tree levels
+        for batch_size in (2, 1000):
+            with tempfile.TemporaryDirectory() as job_dir:
+                with zipfile.ZipFile(BytesIO(job_archive)) as zfp:
+                    zfp.extractall(job_dir)
+                with mock.patch('jobs.Download.REPORTS_BATCH_SIZE', batch_size):
+                    res = UploadJob('null', self.user, job_dir)
+            self.assertNotEqual(res.job.id, self.job.id)
+            self.assertEqual(self.__reports_tree(res.job), expected)
+            for unknown in ReportUnknown.objects.filter(root__job=res.job):
+                with unknown.problem_description.file as fp:
+                    with zipfile.ZipFile(fp) as zfp:
+                        self.assertIn(zfp.read('problem desc.txt'), {b'Fail 1', b'Fail 2'})
+
+    def test_iter_json_list(self):
+        data = [{'a': [1, 2, {'b': 'c ]'}]}, 12345, 'text, with separators', [], None, -1.5e3]
+        for read_size in (1, 3, 1024):
+            self.assertEqual(list(iter_json_list(StringIO(json.dumps(data, indent=4)), read_size=read_size)), data)
+        self.assertEqual(list(iter_json_list(StringIO(' [ ] '))), [])
+        for wrong_data in ['{}', '[1, 2', '[1 2]', '[1,]']:
+            with self.assertRaises(ValueError):
+                list(iter_json_list(StringIO(wrong_data), read_size=2))
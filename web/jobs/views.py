@@ -410,7 +410,7 @@ class DownloadJobsTreeView(LoggedCallMixin, Bview.StreamingResponsePostView):
 
 
 class UploadJobsView(LoggedCallMixin, Bview.JsonView):
-    unparallel = [Job, 'AttrName']
+    unparallel = [Job]
 
     def get_context_data(self, **kwargs):
         if not jobs.utils.JobAccess(self.request.user).can_create():
@@ -436,7 +436,7 @@ class UploadJobsView(LoggedCallMixin, Bview.JsonView):
 
 
 class UploadJobsTreeView(LoggedCallMixin, Bview.JsonView):
-    unparallel = [Job, 'AttrName']
+    unparallel = [Job]
 
     def get_context_data(self, **kwargs):
         if self.request.user.extended.role != USER_ROLES[2][0]:
@@ -31,8 +31,9 @@ import marks.SafeUtils as SafeUtils
 import marks.UnknownUtils as UnknownUtils
 import marks.UnsafeUtils as UnsafeUtils
 from marks.models import MarkSafe, MarkUnsafe, MarkUnknown, SafeTag, UnsafeTag, MarkUnsafeReport, ReportUnsafe
+from reports.models import mark_reports_dirty
 from reports.mea.wrapper import obtain_pretty_error_trace, error_trace_pretty_parse
-from web.ZipGenerator import ZipStream, CHUNK_SIZE
+from web.ZipGenerator import ZipStream, join_chunks
 from web.utils import logger, BridgeException
 
 
@@ -161,14 +162,8 @@ class AllMarksGen(object):
         for table in [MarkSafe, MarkUnsafe, MarkUnknown]:
             for mark in table.objects.filter(~Q(version=0)):
                 markgen = MarkArchiveGenerator(mark)
-                buf = b''
-                for data in self.stream.compress_stream(markgen.name, markgen):
-                    buf += data
-                    if len(buf) > CHUNK_SIZE:
-                        yield buf
-                        buf = b''
-                if len(buf) > 0:
-                    yield buf
+                for data in join_chunks(self.stream.compress_stream(markgen.name, markgen)):
+                    yield data
         yield self.stream.close_stream()
 
 
@@ -223,11 +218,14 @@ class UploadMark:
 
         mark = res.upload_mark()
         if self.type == 'safe':
-            SafeUtils.RecalculateTags(list(SafeUtils.ConnectMarks([mark]).changes.get(mark.id, {})))
+            changes = list(SafeUtils.ConnectMarks([mark]).changes.get(mark.id, {}))
+            SafeUtils.RecalculateTags(changes)
+            mark_reports_dirty(changes)
         elif self.type == 'unsafe':
-            UnsafeUtils.RecalculateTags(list(
-                UnsafeUtils.ConnectMarks([mark], res.similarity_threshold, res.conversion_function_args).
-                    changes.get(mark.id, {})))
+            changes = list(UnsafeUtils.ConnectMarks([mark], res.similarity_threshold, res.conversion_function_args)
+                           .changes.get(mark.id, {}))
+            UnsafeUtils.RecalculateTags(changes)
+            mark_reports_dirty(changes)
 
             most_likely_report_id = MarkUnsafeReport.objects.filter(mark__id=mark.id).values_list('report')
             if most_likely_report_id:
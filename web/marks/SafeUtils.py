@@ -32,7 +32,7 @@ from django.utils.translation import gettext_lazy as _
 from marks.attributes import create_attributes, get_marks_attributes, get_reports_by_attributes
 from marks.models import MarkSafe, MarkSafeHistory, MarkSafeReport, MarkSafeAttr, \
     SafeTag, MarkSafeTag, SafeReportTag, ReportSafeTag
-from reports.models import ReportComponentLeaf, ReportSafe, Attr, AttrName
+from reports.models import ReportComponentLeaf, ReportSafe, Attr, AttrName, mark_reports_dirty
 from users.models import User
 from web.utils import unique_id, BridgeException
 from web.vars import USER_ROLES, SAFE_VERDICTS, MARK_SAFE, MARK_STATUS, MARK_TYPE, ASSOCIATION_TYPE
@@ -98,6 +98,7 @@ class NewMark:
             raise
         self.changes = ConnectMarks([mark], prime_id=report.id).changes.get(mark.id, {})
         self.__get_tags_changes(RecalculateTags(list(self.changes)).changes)
+        mark_reports_dirty(list(self.changes))
         update_confirmed_cache([report])
         return mark
 
@@ -135,6 +136,7 @@ class NewMark:
                     changes = UpdateVerdicts(changes).changes
             self.changes = changes.get(mark.id, {})
             self.__get_tags_changes(RecalculateTags(list(self.changes)).changes)
+            mark_reports_dirty(list(self.changes))
             update_confirmed_cache(list(self.changes))
         return mark
 
@@ -493,6 +495,7 @@ class PopulateMarks:
         for m_id in changes:
             reports.extend(changes[m_id])
         RecalculateTags(reports)
+        mark_reports_dirty(reports)
 
     def __current_tags(self):
         for t_id, parent_id, t_name in SafeTag.objects.values_list('id', 'parent_id', 'tag'):
@@ -535,7 +538,7 @@ class PopulateMarks:
                     attrs_to_create.append(Attr(name_id=a['attr'], value=a['value']))
                     attrs_in_db[(a['attr'], a['value'])] = None
         if len(attrs_to_create) > 0:
-            Attr.objects.bulk_create(attrs_to_create)
+            Attr.objects.bulk_create(attrs_to_create, ignore_conflicts=True)
             self.__get_attrs()
         else:
             for mid in self._markattrs:
@@ -648,6 +651,7 @@ def delete_marks(marks):
         for report in changes[m_id]:
             safes_changes[report] = changes[m_id][report]
     RecalculateTags(safes_changes)
+    mark_reports_dirty(list(safes_changes))
     update_confirmed_cache(list(safes_changes))
     return safes_changes
 
@@ -461,7 +461,7 @@ class PopulateMarks:
                     attrs_to_create.append(Attr(name_id=a['attr'], value=a['value']))
                     attrs_in_db[(a['attr'], a['value'])] = None
         if len(attrs_to_create) > 0:
-            Attr.objects.bulk_create(attrs_to_create)
+            Attr.objects.bulk_create(attrs_to_create, ignore_conflicts=True)
             self.__get_attrs()
         else:
             for mid in self._markattrs:
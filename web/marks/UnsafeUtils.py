@@ -22,6 +22,7 @@
 import json
 import time
 
+from django.conf import settings
 from django.db import transaction
 from django.db.models import F
 from django.utils.timezone import now
@@ -29,12 +30,14 @@ from django.utils.translation import gettext_lazy as _
 
 from marks.attributes import create_attributes, get_marks_attributes, get_reports_by_attributes, get_user_attrs, \
     get_basic_attributes
-from marks.models import ConvertedTraces, MarkUnsafe, MarkUnsafeHistory, MarkUnsafeReport, MarkUnsafeAttr, \
+from marks.models import MarkUnsafe, MarkUnsafeHistory, MarkUnsafeReport, MarkUnsafeAttr, \
     MarkUnsafeTag, UnsafeTag, UnsafeReportTag, ReportUnsafeTag
 from reports.mea.wrapper import error_trace_pretty_parse, TAG_CONVERSION_FUNCTION, TAG_COMPARISON_FUNCTION, \
     TAG_EDITED_ERROR_TRACE, get_or_convert_error_trace, dump_converted_error_trace, DEFAULT_CONVERSION_FUNCTION, \
-    DEFAULT_COMPARISON_FUNCTION, compare_edited_traces, automatic_error_trace_editing
-from reports.models import ReportComponentLeaf, ReportUnsafe
+    DEFAULT_COMPARISON_FUNCTION, compare_edited_traces, automatic_error_trace_editing, get_converted_traces
+from reports.mea.executor import compare_error_traces_pairs, COMPARISON_CHUNK_SIZE
+from reports.mea.index import get_edited_fingerprints, get_fingerprint, get_fingerprints, may_be_equivalent
+from reports.models import ReportComponentLeaf, ReportUnsafe, mark_reports_dirty
 from users.models import User
 from web.utils import logger, BridgeException, unique_id
 from web.vars import UNKNOWN_ERROR, UNSAFE_VERDICTS, USER_ROLES, MARK_STATUS, MARK_UNSAFE, MARK_TYPE, \
@@ -49,6 +52,37 @@ OPTIMIZATIONS = [OPTIMIZATION_APPLY_FOR_CURRENT, OPTIMIZATION_DO_NOT_RECALC]
 CONVERSION_FUNCTION_DO_NOT_USE = "*DO NOT CHANGE*"
 
 
+def get_comparison_workers(number_of_pairs: int) -> int:
+    # There is no need to start more processes than the number of chunks.
+    return max(1, min(settings.MARKS_COMPARISON_WORKERS, -(-number_of_pairs // COMPARISON_CHUNK_SIZE)))
+
+
+def get_comparison_chunks(pairs: list, conversions: dict, errors: list):
+    # Converted error traces for pairs (<unsafe>, <mark id>) are loaded by chunks in the main process,
+    # conversions are {<mark id>: (<conversion function>, <conversion function args>)}.
+    # Pairs with failed conversion are put into errors as (<unsafe id>, <mark id>, <error>).
+    for i in range(0, len(pairs), COMPARISON_CHUNK_SIZE):
+        compared_error_traces = {}
+        conversion_errors = {}
+        chunk_pairs = []
+        for unsafe, mark_id in pairs[i:i + COMPARISON_CHUNK_SIZE]:
+            conversion_function, args = conversions[mark_id]
+            key = (unsafe.id, conversion_function, json.dumps(args, sort_keys=True))
+            if key not in compared_error_traces and key not in conversion_errors:
+                try:
+                    compared_error_traces[key] = get_or_convert_error_trace(unsafe, conversion_function, dict(args))
+                except BridgeException as e:
+                    conversion_errors[key] = str(e)
+                except Exception as e:
+                    logger.exception("Error traces comparison failed: %s" % e, exc_info=e)
+                    conversion_errors[key] = str(UNKNOWN_ERROR)
+            if key in conversion_errors:
+                errors.append((unsafe.id, mark_id, conversion_errors[key]))
+            else:
+                chunk_pairs.append((unsafe.id, mark_id, key))
+        yield compared_error_traces, chunk_pairs
+
+
 def decode_optimizations(encoded) -> set:
     counter = 0
     decoded = set()
@@ -210,6 +244,7 @@ class NewMark:
                                     prime_id=report.id, optimizations=self.optimizations). \
             changes.get(mark.id, {})
         self.__get_tags_changes(RecalculateTags(list(self.changes)).changes)
+        mark_reports_dirty(list(self.changes))
         update_confirmed_cache([report])
         return mark
 
@@ -271,6 +306,7 @@ class NewMark:
                     changes = UpdateVerdicts(changes).changes
             self.changes = changes.get(mark.id, {})
             self.__get_tags_changes(RecalculateTags(list(self.changes)).changes)
+            mark_reports_dirty(list(self.changes))
             update_confirmed_cache(list(self.changes))
         return mark
 
@@ -396,10 +432,11 @@ class ConnectMarks:
         for mark_id, report_ids in self.marks_reports.items():
             unsafes_ids.update(report_ids)
 
-        patterns = {}
-        for converted in ConvertedTraces.objects.filter(id__in=set(self.edited_error_trace.values())):
-            with converted.file as fp:
-                patterns[converted.id] = json.loads(fp.read().decode('utf8'))
+        patterns = dict((c_id, json.loads(trace)) for c_id, trace in
+                        get_converted_traces(self.edited_error_trace.values()).items())
+        edited_fingerprints = get_edited_fingerprints(patterns)
+        marks_fingerprints = dict((m_id, edited_fingerprints.get(self.edited_error_trace[m_id]))
+                                  for m_id in self.edited_error_trace)
         marks = {}
         for m_id in self.edited_error_trace:
             self.edited_error_trace[m_id] = patterns[self.edited_error_trace[m_id]]
@@ -428,36 +465,48 @@ class ConnectMarks:
         else:
             target_unsafes = ReportUnsafe.objects.filter(id__in=unsafes_ids)
 
-        number_of_target_unsafes = target_unsafes.count()
+        target_unsafes = list(target_unsafes)
+        number_of_target_unsafes = len(target_unsafes)
+        unsafes_fingerprints = self.__get_fingerprints(target_unsafes)
 
+        pairs = []
         for unsafe in target_unsafes:
             for mark_id in self.edited_error_trace:
                 if unsafe.id not in self.marks_reports[mark_id]:
                     continue
-                compare_error = None
-                compare_result = 0
-                try:
-                    converted_error_trace = get_or_convert_error_trace(unsafe, self.conversion_functions[mark_id],
-                                                                       self.conversion_function_args)
-                    is_equal, compare_result = compare_edited_traces(self.edited_error_trace[mark_id], converted_error_trace,
-                                                              self.comparison_functions[mark_id],
-                                                              self.similarity_threshold)
+                if not may_be_equivalent(marks_fingerprints[mark_id],
+                                         unsafes_fingerprints[self.conversion_functions[mark_id]].get(unsafe.id),
+                                         self.comparison_functions[mark_id], self.similarity_threshold):
+                    # Error traces can not be equivalent, so there is no need to compare them.
                     counter_all += 1
+                    continue
+                pairs.append((unsafe, mark_id))
 
-                    time_previous = self.__update_progress(marks[mark_id], counter_all, counter_applied,
-                                                           number_of_target_unsafes, time_previous)
+        unsafes = dict((unsafe.id, unsafe) for unsafe in target_unsafes)
+        edited_error_traces = dict(
+            (m_id, (self.edited_error_trace[m_id], self.comparison_functions[m_id], self.similarity_threshold))
+            for m_id in self.edited_error_trace
+        )
+        conversions = dict(
+            (m_id, (self.conversion_functions[m_id], self.conversion_function_args)) for m_id in self.edited_error_trace
+        )
+        errors = []
+        for results in compare_error_traces_pairs(edited_error_traces,
+                                                  get_comparison_chunks(pairs, conversions, errors),
+                                                  get_comparison_workers(len(pairs))):
+            results.extend((u_id, m_id, False, 0, error) for u_id, m_id, error in errors)
+            errors.clear()
+            for unsafe_id, mark_id, is_equal, compare_result, compare_error in results:
+                if compare_error is None:
+                    counter_all += 1
                     if not is_equal:
+                        time_previous = self.__update_progress(marks[mark_id], counter_all, counter_applied,
+                                                               number_of_target_unsafes, time_previous)
                         continue
                     counter_applied += 1
                     time_previous = self.__update_progress(marks[mark_id], counter_all, counter_applied,
                                                            number_of_target_unsafes, time_previous)
-
-                except BridgeException as e:
-                    compare_error = str(e)
-                except Exception as e:
-                    logger.exception("Error traces comparison failed: %s" % e, exc_info=e)
-                    compare_error = str(UNKNOWN_ERROR)
-
+                unsafe = unsafes[unsafe_id]
                 ass_type = ASSOCIATION_TYPE[0][0]
                 if self._prime_id == unsafe.id:
                     ass_type = ASSOCIATION_TYPE[1][0]
@@ -479,6 +528,14 @@ class ConnectMarks:
             marks[mark_id].format = 1
             marks[mark_id].save()
 
+    def __get_fingerprints(self, target_unsafes):
+        unsafes_fingerprints = {}
+        for conversion_function in set(self.conversion_functions[mark_id] for mark_id in self.edited_error_trace):
+            unsafes_fingerprints[conversion_function] = get_fingerprints(
+                target_unsafes, conversion_function, self.conversion_function_args
+            )
+        return unsafes_fingerprints
+
     def __update_verdicts(self):
         unsafe_verdicts = {}
         for mark_id in self.changes:
@@ -547,17 +604,29 @@ class ConnectReport:
         for mark_id in self._marks_attrs:
             if not self.marks_reports.get(mark_id, None):
                 del self._marks[mark_id]
-        patterns = {}
-        for converted in ConvertedTraces.objects.filter(
-                id__in=set(self._marks[mid]['edited_error_trace'] for mid in self._marks)):
-            with converted.file as fp:
-                patterns[converted.id] = fp.read().decode('utf8')
+        patterns = get_converted_traces(self._marks[mid]['edited_error_trace'] for mid in self._marks)
+        edited_fingerprints = get_edited_fingerprints(patterns)
+        marks_fingerprints = {}
         for m_id in self._marks:
+            marks_fingerprints[m_id] = edited_fingerprints.get(self._marks[m_id]['edited_error_trace'])
             self._marks[m_id]['edited_error_trace'] = patterns[self._marks[m_id]['edited_error_trace']]
 
+        unsafe_fingerprints = {}
         for mark_id in self._marks:
             compare_result = 0
             compare_error = None
+            # Marks with the same conversion share the fingerprint of the unsafe
+            conversion_key = (self._marks[mark_id]['conversion_functions'], self._marks[mark_id]['args'] or "{}")
+            if conversion_key not in unsafe_fingerprints:
+                try:
+                    unsafe_fingerprints[conversion_key] = get_fingerprint(self._unsafe, conversion_key[0],
+                                                                          json.loads(conversion_key[1]))
+                except Exception:
+                    unsafe_fingerprints[conversion_key] = None
+            if not may_be_equivalent(marks_fingerprints[mark_id], unsafe_fingerprints[conversion_key],
+                                     self._marks[mark_id]['comparison_functions'],
+                                     self._marks[mark_id]['similarity_threshold']):
+                continue
             try:
                 converted_error_trace = get_or_convert_error_trace(self._unsafe,
                                                                    self._marks[mark_id]['conversion_functions'],
@@ -714,6 +783,7 @@ class UpdateVerdicts:
 class RecalculateConnections:
     def __init__(self, roots):
         self._roots = roots
+        self._marks = {}
         self.__recalc()
 
     def __recalc(self):
@@ -721,12 +791,96 @@ class RecalculateConnections:
         UnsafeReportTag.objects.filter(report__root__in=self._roots).delete()
         MarkUnsafeReport.objects.filter(report__root__in=self._roots).delete()
         ReportUnsafe.objects.filter(root__in=self._roots).update(verdict=UNSAFE_VERDICTS[5][0], has_confirmed=False)
-        unsafes = []
-        for unsafe in ReportUnsafe.objects.filter(root__in=self._roots):
-            ConnectReport(unsafe)
-            unsafes.append(unsafe)
+        unsafes = list(ReportUnsafe.objects.filter(root__in=self._roots))
+        self.__connect(unsafes)
         RecalculateTags(unsafes)
 
+    def __get_marks_attrs(self):
+        attr_filters = {'is_compare': True, 'mark__version': F('mark__mark__version')}
+        marks_attrs = get_marks_attributes(MarkUnsafeAttr, attr_filters)
+        for m_id, f_comparison, f_conversion, edited_error_trace, verdict, similarity, args in \
+                MarkUnsafeHistory.objects.filter(mark_id__in=marks_attrs, version=F('mark__version')) \
+                        .values_list('mark_id', 'comparison_function', 'conversion_function', 'error_trace_id',
+                                     'verdict', 'similarity', 'args'):
+            self._marks[m_id] = {'comparison_function': f_comparison, 'conversion_function': f_conversion,
+                                 'edited_error_trace': edited_error_trace, 'verdict': verdict,
+                                 'similarity_threshold': similarity, 'args': json.loads(args or "{}")}
+        return marks_attrs
+
+    def __connect(self, unsafes):
+        # All unsafes of roots are compared with all marks at once instead of ConnectReport for each unsafe.
+        marks_reports = get_reports_by_attributes('unsafe', self.__get_marks_attrs(), {'report__root__in': self._roots})
+        self._marks = dict((m_id, self._marks[m_id]) for m_id in marks_reports if m_id in self._marks)
+        patterns = dict((c_id, json.loads(trace)) for c_id, trace in
+                        get_converted_traces(self._marks[m_id]['edited_error_trace'] for m_id in self._marks).items())
+
+        marks_fingerprints, unsafes_fingerprints = self.__get_fingerprints(unsafes, marks_reports, patterns)
+        pairs = []
+        for unsafe in unsafes:
+            for m_id in self._marks:
+                if unsafe.id not in marks_reports[m_id]:
+                    continue
+                if may_be_equivalent(marks_fingerprints[m_id],
+                                     unsafes_fingerprints[self.__conversion_key(m_id)].get(unsafe.id),
+                                     self._marks[m_id]['comparison_function'],
+                                     self._marks[m_id]['similarity_threshold']):
+                    pairs.append((unsafe, m_id))
+        edited_error_traces = dict((m_id, (
+            patterns[self._marks[m_id]['edited_error_trace']], self._marks[m_id]['comparison_function'],
+            self._marks[m_id]['similarity_threshold']
+        )) for m_id in self._marks)
+        conversions = dict(
+            (m_id, (self._marks[m_id]['conversion_function'], self._marks[m_id]['args'])) for m_id in self._marks
+        )
+
+        new_markreports = []
+        errors = []
+        for results in compare_error_traces_pairs(edited_error_traces,
+                                                  get_comparison_chunks(pairs, conversions, errors),
+                                                  get_comparison_workers(len(pairs))):
+            results.extend((u_id, m_id, False, 0, error) for u_id, m_id, error in errors)
+            errors.clear()
+            for unsafe_id, mark_id, is_equal, compare_result, compare_error in results:
+                if compare_error is None and not is_equal:
+                    continue
+                new_markreports.append(MarkUnsafeReport(
+                    mark_id=mark_id, report_id=unsafe_id, result=compare_result, error=compare_error
+                ))
+        MarkUnsafeReport.objects.bulk_create(new_markreports)
+
+        verdicts = {}
+        for mr in new_markreports:
+            if mr.error is None and mr.result > 0:
+                verdicts.setdefault(mr.report_id, set()).add(self._marks[mr.mark_id]['verdict'])
+        unsafes_to_update = {}
+        for unsafe_id, unsafe_verdicts in verdicts.items():
+            if len(unsafe_verdicts) == 1:
+                new_verdict = unsafe_verdicts.pop()
+            else:
+                new_verdict = UNSAFE_VERDICTS[4][0]
+            if new_verdict != UNSAFE_VERDICTS[5][0]:
+                unsafes_to_update.setdefault(new_verdict, set()).add(unsafe_id)
+        with transaction.atomic():
+            for verdict, unsafes_ids in unsafes_to_update.items():
+                ReportUnsafe.objects.filter(id__in=unsafes_ids).update(verdict=verdict)
+
+    def __conversion_key(self, mark_id):
+        return self._marks[mark_id]['conversion_function'], json.dumps(self._marks[mark_id]['args'], sort_keys=True)
+
+    def __get_fingerprints(self, unsafes, marks_reports, patterns):
+        edited_fingerprints = get_edited_fingerprints(patterns)
+        marks_fingerprints = {}
+        unsafes_ids = {}
+        for m_id in self._marks:
+            marks_fingerprints[m_id] = edited_fingerprints.get(self._marks[m_id]['edited_error_trace'])
+            unsafes_ids.setdefault(self.__conversion_key(m_id), set()).update(marks_reports[m_id])
+        unsafes_fingerprints = {}
+        for key, key_unsafes_ids in unsafes_ids.items():
+            unsafes_fingerprints[key] = get_fingerprints(
+                list(unsafe for unsafe in unsafes if unsafe.id in key_unsafes_ids), key[0], json.loads(key[1])
+            )
+        return marks_fingerprints, unsafes_fingerprints
+
 
 def delete_marks(marks):
     changes = {}
@@ -742,6 +896,7 @@ def delete_marks(marks):
         for report in changes[m_id]:
             unsafes_changes[report] = changes[m_id][report]
     RecalculateTags(unsafes_changes)
+    mark_reports_dirty(list(unsafes_changes))
     update_confirmed_cache(list(unsafes_changes))
     return unsafes_changes
 
@@ -16,9 +16,12 @@
 # limitations under the License.
 #
 
-from django.db.models import FloatField
-from django.db.models import Q, F
-from django.db.models.functions import Cast
+import bisect
+import functools
+import re
+import threading
+
+from django.db.models import F
 
 from marks.models import MarkUnsafeHistory, MarkSafeHistory, MarkUnknownHistory
 from reports.models import ReportAttr, ReportUnsafe, Attr, AttrName, ReportSafe, ReportUnknown
@@ -28,6 +31,12 @@ from web.vars import ATTRIBUTES_OPERATOR_EQ, ATTRIBUTES_OPERATOR_RE, ATTRIBUTES_
 
 VALUES_SEPARATOR = ","
 
+# Maximum number of attributes in a single query.
+ATTRIBUTES_CHUNK_SIZE = 500
+
+# Indexes of attributes values, which are loaded in the current thread inside AttributesValuesCache blocks
+_attributes_values = threading.local()
+
 
 def get_basic_attributes(mark_unsafe) -> list:
     attrs = []
@@ -148,60 +157,129 @@ def get_user_attrs(args: dict) -> dict:
     return marks_attrs
 
 
-def get_reports_by_attributes(mark_type: str, marks_attrs: dict, attr_filters: dict = None):
-    marks_reports = dict()
-
-    for m_id, attrs_desc in marks_attrs.items():
-        attrs = dict()
-        for attr_desc in attrs_desc:
-            name = attr_desc[0]
-            value = str(attr_desc[1])
-            op = attr_desc[2]
-
-            if op == ATTRIBUTES_OPERATOR_EQ and VALUES_SEPARATOR not in value:
-                tmp_attrs = Attr.objects.filter(name__name=name, value=value).values_list('id')
-                if tmp_attrs:
-                    attrs[name] = {value}
-            else:
-                values = value.split(VALUES_SEPARATOR)
-                tmp_attrs = tuple()
-                if op == ATTRIBUTES_OPERATOR_EQ:
-                    tmp_attrs = Attr.objects.filter(name__name=name, value__in=values).values_list('id', 'value')
-                elif op == ATTRIBUTES_OPERATOR_RE:
-                    for val in values:
-                        tmp_attrs += tuple(Attr.objects.filter(name__name=name, value__regex=val).
-                                           values_list('id', 'value'))
-                elif op == ATTRIBUTES_OPERATOR_NE:
-                    tmp_attrs = Attr.objects.filter(~Q(value__in=values), name__name=name).values_list('id', 'value')
-                else:  # numbers
-                    if len(values) == 1:
-                        try:
-                            number = float(values[0])
-                            if op == ATTRIBUTES_OPERATOR_LE:
-                                tmp_attrs = Attr.objects.annotate(value_float=Cast('value', FloatField())). \
-                                    filter(name__name=name, value_float__lte=number). \
-                                    values_list('id', 'value')
-                            elif op == ATTRIBUTES_OPERATOR_LT:
-                                tmp_attrs = Attr.objects.annotate(value_float=Cast('value', FloatField())). \
-                                    filter(name__name=name, value_float__lt=number). \
-                                    values_list('id', 'value')
-                            elif op == ATTRIBUTES_OPERATOR_GE:
-                                tmp_attrs = Attr.objects.annotate(value_float=Cast('value', FloatField())). \
-                                    filter(name__name=name, value_float__gte=number). \
-                                    values_list('id', 'value')
-                            elif op == ATTRIBUTES_OPERATOR_GT:
-                                tmp_attrs = Attr.objects.annotate(value_float=Cast('value', FloatField())). \
-                                    filter(name__name=name, value_float__gt=number). \
-                                    values_list('id', 'value')
-                        except Exception as e:
-                            logger.warning("Cannot parse number {}: {}".format(values[0], e))
-                    else:
-                        logger.warning("Only one number can be specified {}".format(values))
-                for attr_id, attr_value in tmp_attrs:
-                    if name not in attrs:
-                        attrs[name] = set()
-                    attrs[name].add(attr_value)
+class AttributesIndex:
+    # Inverted index of attributes: name -> value -> ids (of reports or attributes).
+    def __init__(self, rows):
+        self.values = {}
+        self.__numbers = {}
+        for name, value, obj_id in rows:
+            self.values.setdefault(name, {}).setdefault(value, set()).add(obj_id)
+
+    def ids(self, name, values) -> set:
+        ids = set()
+        name_values = self.values.get(name, {})
+        for value in values:
+            ids |= name_values.get(value, set())
+        return ids
+
+    def match(self, name: str, value: str, op: str) -> set:
+        # Values of attribute, which satisfy the given condition.
+        name_values = self.values.get(name, {})
+        if op == ATTRIBUTES_OPERATOR_EQ and VALUES_SEPARATOR not in value:
+            return {value} if value in name_values else set()
+        values = value.split(VALUES_SEPARATOR)
+        if op == ATTRIBUTES_OPERATOR_EQ:
+            return set(values) & set(name_values)
+        elif op == ATTRIBUTES_OPERATOR_RE:
+            regexps = list(filter(None, (compile_attr_regex(val) for val in values)))
+            return set(v for v in name_values if any(regexp.search(v) for regexp in regexps))
+        elif op == ATTRIBUTES_OPERATOR_NE:
+            return set(name_values) - set(values)
+        # Numbers
+        if len(values) != 1:
+            logger.warning("Only one number can be specified {}".format(values))
+            return set()
+        try:
+            number = float(values[0])
+        except Exception as e:
+            logger.warning("Cannot parse number {}: {}".format(values[0], e))
+            return set()
+        numbers, numbers_values = self.__get_numbers(name)
+        if op == ATTRIBUTES_OPERATOR_LE:
+            return set(numbers_values[:bisect.bisect_right(numbers, number)])
+        elif op == ATTRIBUTES_OPERATOR_LT:
+            return set(numbers_values[:bisect.bisect_left(numbers, number)])
+        elif op == ATTRIBUTES_OPERATOR_GE:
+            return set(numbers_values[bisect.bisect_left(numbers, number):])
+        elif op == ATTRIBUTES_OPERATOR_GT:
+            return set(numbers_values[bisect.bisect_right(numbers, number):])
+        return set()
+
+    def __get_numbers(self, name):
+        # Sorted numeric values of attribute for range operators.
+        if name not in self.__numbers:
+            numbers = []
+            for value in self.values.get(name, {}):
+                try:
+                    numbers.append((float(value), value))
+                except ValueError:
+                    pass
+            numbers.sort()
+            self.__numbers[name] = (list(n for n, v in numbers), list(v for n, v in numbers))
+        return self.__numbers[name]
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_attr_regex(pattern: str):
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        logger.warning("Wrong regular expression {}: {}".format(pattern, e))
+        return None
+
+
+class AttributesValuesCache:
+    # All values of attribute are loaded once for reports matched inside the block (e.g., uploaded reports
+    # are matched with the same marks), otherwise they are loaded for each matched report.
+    def __enter__(self):
+        self._outer = getattr(_attributes_values, 'indexes', None)
+        if self._outer is None:
+            _attributes_values.indexes = {}
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._outer is None:
+            _attributes_values.indexes = None
+
 
+def invalidate_attribute_values(names):
+    # Values of attributes are loaded again inside the block after new values of them were created
+    indexes = getattr(_attributes_values, 'indexes', None)
+    if indexes:
+        for name in names:
+            indexes.pop(name, None)
+
+
+def get_attribute_values(name: str) -> AttributesIndex:
+    indexes = getattr(_attributes_values, 'indexes', None)
+    if indexes is None:
+        indexes = {}
+    if name not in indexes:
+        indexes[name] = AttributesIndex(Attr.objects.filter(name__name=name).values_list('name__name', 'value', 'id'))
+    return indexes[name]
+
+
+class AttributesMatcher:
+    # Finds reports, which attributes satisfy attributes of marks. Attributes of reports are loaded
+    # at once for all marks, so the number of queries does not depend on the number of marks.
+    def __init__(self, mark_type: str, marks_attrs: dict, attr_filters: dict = None):
+        self.marks_reports = {}
+        self._marks_attrs = marks_attrs
+        self._names = set(attr_desc[0] for attrs_desc in marks_attrs.values() for attr_desc in attrs_desc)
+        self._report_attrs = self.__get_report_attrs(mark_type, attr_filters)
+        self._attrs = {}
+        if not self._names:
+            return
+        if attr_filters:
+            # Reports index is small, so conditions are checked against it.
+            self._reports = AttributesIndex(self._report_attrs.filter(attr__name__name__in=self._names)
+                                            .values_list('attr__name__name', 'attr__value', 'report_id'))
+            self.__match_reports()
+        else:
+            self.__match_attrs()
+
+    def __get_report_attrs(self, mark_type, attr_filters):
+        self.__is_not_used()
         if mark_type == 'unsafe':
             report_attrs = ReportAttr.objects.exclude(report__reportunsafe=None)
         elif mark_type == 'safe':
@@ -210,17 +288,83 @@ def get_reports_by_attributes(mark_type: str, marks_attrs: dict, attr_filters: d
             report_attrs = ReportAttr.objects.exclude(report__reportunknown=None)
         if attr_filters:
             report_attrs = report_attrs.filter(**attr_filters)
-        report_ids = set()
-        for a_name, a_val in attrs.items():
-            cur_ids = set(x[0] for x in report_attrs.filter(attr__name__name=a_name, attr__value__in=a_val).
-                          values_list('report_id'))
-            if not report_ids:
-                report_ids = cur_ids
+        return report_attrs
+
+    def __has_values(self, name, conditions) -> bool:
+        # Condition is ignored if there are no values of attribute, which satisfy it. Only matched values
+        # are queried for simple operators, all values are loaded for regular expressions and numbers.
+        for value, op in conditions:
+            values = value.split(VALUES_SEPARATOR)
+            if op == ATTRIBUTES_OPERATOR_EQ:
+                has_values = Attr.objects.filter(name__name=name, value__in=values).exists()
+            elif op == ATTRIBUTES_OPERATOR_NE:
+                has_values = Attr.objects.filter(name__name=name).exclude(value__in=values).exists()
             else:
-                report_ids = report_ids.intersection(cur_ids)
-            if not report_ids:
-                break
-        if report_ids:
-            marks_reports[m_id] = report_ids
+                if name not in self._attrs:
+                    self._attrs[name] = get_attribute_values(name)
+                has_values = bool(self._attrs[name].match(name, value, op))
+            if has_values:
+                return True
+        return False
+
+    def __conditions(self, m_id):
+        # Conditions of mark grouped by attributes names.
+        conditions = {}
+        for name, value, op in self._marks_attrs[m_id]:
+            conditions.setdefault(name, []).append((str(value), op))
+        return conditions
+
+    def __match_reports(self):
+        for m_id in self._marks_attrs:
+            report_ids = None
+            for name, conditions in self.__conditions(m_id).items():
+                values = set()
+                for value, op in conditions:
+                    values |= self._reports.match(name, value, op)
+                if not values and not self.__has_values(name, conditions):
+                    continue
+                cur_ids = self._reports.ids(name, values)
+                report_ids = cur_ids if report_ids is None else report_ids & cur_ids
+                if not report_ids:
+                    break
+            if report_ids:
+                self.marks_reports[m_id] = report_ids
+
+    def __match_attrs(self):
+        attrs_index = AttributesIndex(Attr.objects.filter(name__name__in=self._names)
+                                      .values_list('name__name', 'value', 'id'))
+        marks_conditions = {}
+        attrs_ids = set()
+        for m_id in self._marks_attrs:
+            marks_conditions[m_id] = []
+            for name, conditions in self.__conditions(m_id).items():
+                values = set()
+                for value, op in conditions:
+                    values |= attrs_index.match(name, value, op)
+                if values:
+                    marks_conditions[m_id].append(attrs_index.ids(name, values))
+                    attrs_ids |= marks_conditions[m_id][-1]
+        attrs_reports = {}
+        attrs_ids = list(attrs_ids)
+        for i in range(0, len(attrs_ids), ATTRIBUTES_CHUNK_SIZE):
+            for attr_id, report_id in self._report_attrs.filter(attr_id__in=attrs_ids[i:i + ATTRIBUTES_CHUNK_SIZE]) \
+                    .values_list('attr_id', 'report_id'):
+                attrs_reports.setdefault(attr_id, set()).add(report_id)
+        for m_id, conditions in marks_conditions.items():
+            report_ids = None
+            for attrs_ids in conditions:
+                cur_ids = set()
+                for attr_id in attrs_ids:
+                    cur_ids |= attrs_reports.get(attr_id, set())
+                report_ids = cur_ids if report_ids is None else report_ids & cur_ids
+                if not report_ids:
+                    break
+            if report_ids:
+                self.marks_reports[m_id] = report_ids
 
-    return marks_reports
+    def __is_not_used(self):
+        pass
+
+
+def get_reports_by_attributes(mark_type: str, marks_attrs: dict, attr_filters: dict = None):
+    return AttributesMatcher(mark_type, marks_attrs, attr_filters).marks_reports
@@ -369,6 +369,26 @@ class ErrorTraceConvertionCache(models.Model):
         db_table = 'cache_error_trace_converted'
 
 
+class ErrorTraceFingerprint(models.Model):
+    unsafe = models.ForeignKey(ReportUnsafe, models.CASCADE)
+    function = models.CharField(max_length=64, default='')
+    args = models.TextField(null=True)
+    threads = models.PositiveIntegerField(default=0)
+    threads_data = models.TextField()
+
+    class Meta:
+        db_table = 'cache_error_trace_fingerprint'
+        index_together = ['unsafe', 'function']
+
+
+class EditedTraceFingerprint(models.Model):
+    trace = models.OneToOneField(ConvertedTraces, models.CASCADE, related_name='+')
+    threads_data = models.TextField()
+
+    class Meta:
+        db_table = 'cache_edited_trace_fingerprint'
+
+
 class SafeTagAccess(models.Model):
     user = models.ForeignKey(User, models.CASCADE)
     tag = models.ForeignKey(SafeTag, models.CASCADE)
@@ -20,14 +20,23 @@ import os
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from jobs.models import Job
+from marks.attributes import AttributesValuesCache, get_reports_by_attributes
 from marks.models import MarkSafe, MarkUnsafe, MarkUnknown, MarkSafeHistory, MarkUnsafeHistory, MarkUnknownHistory, \
     SafeTag, UnsafeTag, ReportSafeTag, ReportUnsafeTag, MarkSafeTag, MarkUnsafeTag, SafeReportTag, UnsafeReportTag, \
-    MarkSafeReport, MarkUnsafeReport, MarkUnknownReport, MarkUnsafeCompare, UnknownProblem
-from reports.models import ReportSafe, ReportUnsafe, ReportUnknown, ReportComponent
-from reports.test import DecideJobs, SJC_1
+    MarkSafeReport, MarkUnsafeReport, MarkUnknownReport, MarkUnsafeCompare, UnknownProblem, EditedTraceFingerprint
+from reports.mea.core import COMPARISON_FUNCTION_EQUAL, COMPARISON_FUNCTION_INCLUDE, \
+    COMPARISON_FUNCTION_INCLUDE_PARTIAL
+from reports.mea.index import compute_fingerprint, get_edited_fingerprints, may_be_equivalent
+from reports.mea.wrapper import compare_edited_traces, dump_converted_error_trace, error_trace_pretty_parse, \
+    error_trace_pretty_print
+from reports.models import ReportSafe, ReportUnsafe, ReportUnknown, ReportComponent, ReportAttr, Attr, AttrName
+from reports.test import DecideJobs, SJC_1, calls_error_trace, create_decided_job
+from reports.utils import AttrData
 from users.models import User
 from web.populate import populate_users
 from web.utils import CVTestCase, ArchiveFileContent
@@ -1221,3 +1230,100 @@ class TestMarks(CVTestCase):
         if os.path.exists(os.path.join(settings.MEDIA_ROOT, self.all_marks_arch)):
             os.remove(os.path.join(settings.MEDIA_ROOT, self.all_marks_arch))
         super(TestMarks, self).tearDown()
+
+
+class TestFingerprints(CVTestCase):
+    def test_pruning(self):
+        edited = error_trace_pretty_parse(error_trace_pretty_print(calls_error_trace('a', 'b')))
+        compared_traces = [
+            calls_error_trace('a', 'b'), calls_error_trace('a', 'b', 'c'), calls_error_trace('c'),
+            calls_error_trace('b', 'a'), calls_error_trace('a', 'c', 'b'), calls_error_trace('a', 'b', thread='2')
+        ]
+        edited_fingerprint = compute_fingerprint(edited, normalize=False)
+        pruned = 0
+        for comparison_function in [COMPARISON_FUNCTION_EQUAL, COMPARISON_FUNCTION_INCLUDE,
+                                    COMPARISON_FUNCTION_INCLUDE_PARTIAL]:
+            for compared in compared_traces:
+                is_equal = compare_edited_traces(edited, compared, comparison_function, 100)[0]
+                may_be_equal = may_be_equivalent(edited_fingerprint, compute_fingerprint(compared),
+                                                 comparison_function, 100)
+                # Fingerprints must never skip equivalent error traces
+                if is_equal:
+                    self.assertTrue(may_be_equal)
+                elif not may_be_equal:
+                    pruned += 1
+        self.assertGreater(pruned, 0)
+        self.assertFalse(may_be_equivalent(edited_fingerprint, compute_fingerprint(calls_error_trace('c')),
+                                           COMPARISON_FUNCTION_INCLUDE, 100))
+        self.assertTrue(may_be_equivalent(None, compute_fingerprint(calls_error_trace('c')),
+                                          COMPARISON_FUNCTION_EQUAL, 100))
+
+    def test_edited_fingerprints(self):
+        edited = calls_error_trace('a', 'b')
+        trace_id = dump_converted_error_trace(edited).id
+        broken_id = dump_converted_error_trace({'broken': True}).id
+        fingerprints = get_edited_fingerprints({trace_id: edited, broken_id: 'broken'})
+        self.assertEqual(fingerprints, {trace_id: compute_fingerprint(edited, normalize=False)})
+        self.assertEqual(EditedTraceFingerprint.objects.count(), 1)
+
+        # Saved fingerprint is not computed again for the edited error trace
+        with self.assertNumQueries(1):
+            self.assertEqual(get_edited_fingerprints({trace_id: None}), fingerprints)
+        self.assertEqual(EditedTraceFingerprint.objects.count(), 1)
+
+
+class TestAttributesMatcher(CVTestCase):
+    def setUp(self):
+        super().setUp()
+        job, root, core = create_decided_job('attrs_job')
+        self.safes = []
+        reports_attrs = [{'Requirement': 'mutex', 'Version': '1.5'}, {'Requirement': 'spin', 'Version': '3'}]
+        for i, attrs in enumerate(reports_attrs):
+            safe = ReportSafe.objects.create(root=root, parent=core, identifier='safe%s' % i,
+                                             cpu_time=1, wall_time=1, memory=1)
+            for name, value in attrs.items():
+                attr = Attr.objects.get_or_create(name=AttrName.objects.get_or_create(name=name)[0], value=value)[0]
+                ReportAttr.objects.create(report=safe, attr=attr)
+            self.safes.append(safe)
+        # Value of attribute without reports
+        Attr.objects.create(name=AttrName.objects.get(name='Requirement'), value='other')
+        self.marks_attrs = {
+            1: {('Requirement', 'mutex', 'eq')},
+            2: {('Requirement', 'm.*', 're')},
+            3: {('Version', '2', 'le')},
+            # Conditions without any values are ignored
+            4: {('Requirement', 'absent,nothing', 'eq'), ('Version', '3', 'ge')},
+            5: {('Requirement', 'other', 'eq'), ('Version', '3', 'ge')},
+            6: {('Requirement', '^z', 're'), ('Version', '3', 'ge')},
+            7: {('Requirement', 'mutex,spin,other', 'ne'), ('Version', '1', 'gt')},
+            8: {('Requirement', 'absent', 'eq')}
+        }
+
+    def test_match(self):
+        safe1, safe2 = list(safe.id for safe in self.safes)
+        expected = {1: {safe1}, 2: {safe1}, 3: {safe1}, 4: {safe2}, 6: {safe2}, 7: {safe1, safe2}}
+        self.assertEqual(get_reports_by_attributes('safe', self.marks_attrs), expected)
+        for safe in self.safes:
+            self.assertEqual(
+                get_reports_by_attributes('safe', self.marks_attrs, {'report': safe}),
+                dict((m_id, {safe.id}) for m_id, ids in expected.items() if safe.id in ids)
+            )
+
+    def test_values_cache(self):
+        queries = []
+        with AttributesValuesCache():
+            for i in range(2):
+                with CaptureQueriesContext(connection) as context:
+                    get_reports_by_attributes('safe', self.marks_attrs, {'report': self.safes[1]})
+                queries.append(len(context.captured_queries))
+        # Values of attributes for regular expressions and numbers are loaded only for the first report
+        self.assertEqual(queries[1], queries[0] - 2)
+
+    def test_values_cache_invalidation(self):
+        with AttributesValuesCache():
+            self.assertIn(6, get_reports_by_attributes('safe', self.marks_attrs, {'report': self.safes[1]}))
+            # The condition is not ignored after the value is uploaded by the next report in the block
+            attrs = AttrData(self.safes[0].root_id, None)
+            attrs.add(self.safes[0].id, 'Requirement', 'zone', True, True, None)
+            attrs.upload()
+            self.assertNotIn(6, get_reports_by_attributes('safe', self.marks_attrs, {'report': self.safes[1]}))
@@ -30,7 +30,7 @@ import marks.UnknownUtils as UnknownUtils
 import marks.UnsafeUtils as UnsafeUtils
 from marks.models import MarkSafe, MarkUnsafe, MarkUnknown, MarkSafeHistory, MarkUnsafeHistory, \
     SafeTag, UnsafeTag, ConvertedTraces, MarkSafeReport, MarkUnsafeReport, MarkUnknownReport
-from reports.models import ReportUnsafe, ReportSafe, ReportUnknown
+from reports.models import ReportUnsafe, ReportSafe, ReportUnknown, mark_reports_dirty
 from users.models import User
 from web.utils import BridgeException
 from web.vars import USER_ROLES, JOB_ROLES
@@ -411,4 +411,5 @@ class UpdateAssociationCache:
                 self._association.report: {'kind': '=', 'verdict1': self._association.report.verdict}
             }}).changes.get(self._association.mark_id, {})
             leaf_lib.RecalculateTags(list(changes))
+            mark_reports_dirty(list(changes))
         leaf_lib.update_confirmed_cache([self._association.report])
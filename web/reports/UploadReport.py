@@ -19,6 +19,7 @@
 # limitations under the License.
 #
 
+import hashlib
 import json
 import os
 import zipfile
@@ -26,23 +27,26 @@ from io import BytesIO
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection, transaction
 from django.db.models import Q, F
 from django.utils.timezone import now
 
 import marks.SafeUtils as SafeUtils
 import marks.UnknownUtils as UnknownUtils
 import marks.UnsafeUtils as UnsafeUtils
+from marks.attributes import AttributesValuesCache
 from marks.models import ErrorTraceConvertionCache
 from reports.coverage import FillCoverageCache
 from reports.etv import GetETV
 from reports.mea.wrapper import dump_converted_error_trace
 from reports.models import Report, ReportRoot, ReportComponent, ReportSafe, ReportUnsafe, ReportUnknown, \
     Component, ComponentResource, ReportAttr, ReportComponentLeaf, Computer, ComponentInstances, \
-    CoverageArchive, ErrorTraceSource, Resources, VerifierConfig
+    CoverageArchive, ErrorTraceSource, Resources, VerifierConfig, REPORT_PATH_SEP, mark_reports_dirty
 from reports.utils import AttrData
 from service.models import Task
 from service.utils import CoreStartDecision
-from tools.utils import RecalculateLeaves
+from tools.files import SavedFiles
+from tools.utils import RecalculateLeaves, RecalculateReportsPaths
 from users.models import Extended
 from web.utils import logger, unique_id, ArchiveFileContent
 from web.vars import REPORT_ARCHIVE, JOB_WEIGHT, JOB_STATUS, USER_ROLES, CONVERTED_ERROR_TRACES_FILE, COVERAGE_FILE
@@ -59,28 +63,52 @@ class CheckArchiveError(Exception):
     pass
 
 
-class UploadReport:
-    def __init__(self, job, data, archives=None, attempt=0, source_archives={}):
-        self.error = None
-        self.job = job
-        self.archives = archives
-        self.attempt = attempt
-        self.data = {}
-        self.ordered_attrs = []
-        self.source_archives = source_archives
+def attr_children(name, value, compare=False, associate=False, data=None):
+    attr_data = []
+    if isinstance(value, list):
+        for v in value:
+            if not isinstance(v, dict) or 'name' not in v or 'value' not in v:
+                raise ValueError('Wrong format of report attribute')
+            for n in attr_children(v['name'].replace(':', '_'), v['value'], v.get('compare', False),
+                                   v.get('associate', False), v.get('data')):
+                attr_data.append(("%s:%s" % (name, n[0]) if len(name) > 0 else n[0], n[1], n[2], n[3], n[4]))
+    elif isinstance(value, str):
+        attr_data = [(name, value, compare, associate, data)]
+    else:
+        raise ValueError('Wrong format of report attributes')
+    return attr_data
+
+
+def fill_unsafes_cache(reports):
+    # Converted error traces from archives are cached and unsafes are associated with marks
+    if len(reports) == 0:
+        return
+    cache = []
+    for leaf in reports:
         try:
-            self.__check_data(data)
-            self.__check_archives(self.data['id'])
-            self.parent = self.__get_parent()
-            self._parents_branch = self.__get_parents_branch()
-            self.root = self.__get_root_report()
-            self.__upload()
-        except CheckArchiveError as e:
-            logger.info(str(e))
-            self.error = 'ZIP error'
-        except Exception as e:
-            logger.exception(e)
-            self.error = str(e)
+            converted_traces = json.loads(
+                ArchiveFileContent(leaf, 'error_trace', CONVERTED_ERROR_TRACES_FILE).content.decode('utf8'))
+            for conversion_function, converted_trace in converted_traces.items():
+                et_file = dump_converted_error_trace(converted_trace)
+                cache.append(ErrorTraceConvertionCache(unsafe=leaf, function=conversion_function, converted=et_file,
+                                                       args="{}"))
+        except:
+            # Old format.
+            pass
+    if cache:
+        ErrorTraceConvertionCache.objects.bulk_create(cache)
+
+    for leaf in reports:
+        UnsafeUtils.ConnectReport(leaf)
+    UnsafeUtils.RecalculateTags(reports)
+
+
+class CheckReportData:
+    # Report data is validated and normalized, archives are only looked for in the archives list
+    def __init__(self, data, archives=None):
+        self.archives = archives or {}
+        self.data = {}
+        self.__check_data(data)
 
     def __check_data(self, data):
         if not isinstance(data, dict):
@@ -106,8 +134,6 @@ class UploadReport:
             if data['id'] == '/':
                 if 'config' in data:
                     self.data['config'] = data['config']
-                if self.attempt == 0:
-                    CoreStartDecision(self.job)
                 try:
                     self.data.update({
                         'attrs': data['attrs'],
@@ -283,6 +309,36 @@ class UploadReport:
             if not isinstance(d[next(iter(d))], str) and not isinstance(d[next(iter(d))], int):
                 raise ValueError('wrong computer description format')
 
+    def __is_not_used(self):
+        pass
+
+
+class UploadReport:
+    def __init__(self, job, data, archives=None, attempt=0, source_archives={}):
+        self.error = None
+        self.job = job
+        self.archives = archives
+        self.attempt = attempt
+        self.data = {}
+        self.ordered_attrs = []
+        self.source_archives = source_archives
+        try:
+            self.data = CheckReportData(data, self.archives).data
+            if self.data['type'] == 'start' and self.data['id'] == '/' and self.attempt == 0:
+                CoreStartDecision(self.job)
+            self.__check_archives(self.data['id'])
+            self.parent = self.__get_parent()
+            self._parents_branch = self.__get_parents_branch()
+            self.root = self.__get_root_report()
+            with AttributesValuesCache():
+                self.__upload()
+        except CheckArchiveError as e:
+            logger.info(str(e))
+            self.error = 'ZIP error'
+        except Exception as e:
+            logger.exception(e)
+            self.error = str(e)
+
     def __get_root_report(self):
         try:
             return ReportRoot.objects.get(job=self.job)
@@ -308,15 +364,10 @@ class UploadReport:
                 raise ValueError('report or its parent was not found')
 
     def __get_parents_branch(self):
-        branch = []
-        parent = self.parent
-        while parent is not None:
-            branch.insert(0, parent)
-            if parent.parent_id is not None:
-                parent = ReportComponent.objects.get(id=parent.parent_id)
-            else:
-                parent = None
-        return branch
+        if self.parent is None:
+            return []
+        ancestors = dict((r.id, r) for r in ReportComponent.objects.ancestors(self.parent))
+        return list(ancestors[r_id] for r_id in self.parent.ancestors_ids) + [self.parent]
 
     def __upload(self):
         actions = {
@@ -343,6 +394,8 @@ class UploadReport:
             if self.attempt > 0:
                 report.start_date = now()
                 report.save()
+                # Reports of the component are uploaded again
+                mark_reports_dirty([report])
                 return
             else:
                 raise ValueError('the report with specified identifier already exists')
@@ -360,9 +413,9 @@ class UploadReport:
             ))
 
         if 'comp' in self.data:
-            report.computer = Computer.objects.get_or_create(
-                description=json.dumps(self.data['comp'], ensure_ascii=False, sort_keys=True, indent=4)
-            )[0]
+            report.computer = get_computer(
+                json.dumps(self.data['comp'], ensure_ascii=False, sort_keys=True, indent=4)
+            )
         else:
             report.computer = self.parent.computer
 
@@ -409,9 +462,9 @@ class UploadReport:
             ).encode('utf8')))
 
         if 'comp' in self.data:
-            report.computer = Computer.objects.get_or_create(
-                description=json.dumps(self.data['comp'], ensure_ascii=False, sort_keys=True, indent=4)
-            )[0]
+            report.computer = get_computer(
+                json.dumps(self.data['comp'], ensure_ascii=False, sort_keys=True, indent=4)
+            )
         else:
             report.computer = self.parent.computer
 
@@ -567,8 +620,10 @@ class UploadReport:
 
         if not save_add_data and ReportComponent.objects.filter(parent=report).count() == 0:
             report.delete()
+            mark_reports_dirty(self._parents_branch[-1:])
         else:
             report_ids.add(report.id)
+            mark_reports_dirty([report])
         ComponentInstances.objects.filter(report_id__in=report_ids, component_id=component_id, in_progress__gt=0) \
             .update(in_progress=(F('in_progress') - 1))
 
@@ -588,10 +643,12 @@ class UploadReport:
         # I hope that verification reports can't have component reports as its children
         if self.job.weight == JOB_WEIGHT[1][0] and Report.objects.filter(parent=report).count() == 0:
             report.delete()
+            mark_reports_dirty(self._parents_branch[-1:])
         else:
             report.finish_date = now()
             report.save()
             report_ids.add(report.id)
+            mark_reports_dirty([report])
         ComponentInstances.objects.filter(report_id__in=report_ids, component_id=component_id, in_progress__gt=0) \
             .update(in_progress=(F('in_progress') - 1))
 
@@ -695,12 +752,13 @@ class UploadReport:
     def __create_leaf_attrs(self, leaf, add_attrs=None):
         self.ordered_attrs = []
         parent_attrs = []
-        for p in self._parents_branch:
-            for ra in p.attrs.order_by('id').select_related('attr__name'):
-                self.ordered_attrs.append(ra.attr.name.name)
-                parent_attrs.append(ReportAttr(
-                    attr_id=ra.attr_id, report=leaf, compare=ra.compare, associate=ra.associate, data_id=ra.data_id
-                ))
+        branch_order = dict((p.id, i) for i, p in enumerate(self._parents_branch))
+        for ra in sorted(ReportAttr.objects.filter(report_id__in=branch_order).select_related('attr__name'),
+                         key=lambda x: (branch_order[x.report_id], x.id)):
+            self.ordered_attrs.append(ra.attr.name.name)
+            parent_attrs.append(ReportAttr(
+                attr_id=ra.attr_id, report=leaf, compare=ra.compare, associate=ra.associate, data_id=ra.data_id
+            ))
         ReportAttr.objects.bulk_create(parent_attrs)
 
         if 'attrs' in self.data:
@@ -715,30 +773,15 @@ class UploadReport:
                 # After verification finish report self.parent.parent will be Core/first-level report
                 self._parents_branch.append(self.parent)
             else:
-                ReportUnsafe.objects.filter(id__in=list(r.id for r in reports)).update(parent=self._parents_branch[-1])
+                ReportUnsafe.objects.filter(id__in=list(r.id for r in reports)).update(
+                    parent=self._parents_branch[-1], path=self._parents_branch[-1].children_path
+                )
 
         leaves = []
         for p in self._parents_branch:
             leaves.extend(list(ReportComponentLeaf(report=p, unsafe=unsafe) for unsafe in reports))
         ReportComponentLeaf.objects.bulk_create(leaves)
-        cache = []
-        for leaf in reports:
-            try:
-                converted_traces = json.loads(
-                    ArchiveFileContent(leaf, 'error_trace', CONVERTED_ERROR_TRACES_FILE).content.decode('utf8'))
-                for conversion_function, converted_trace in converted_traces.items():
-                    et_file = dump_converted_error_trace(converted_trace)
-                    cache.append(ErrorTraceConvertionCache(unsafe=leaf, function=conversion_function, converted=et_file,
-                                                           args="{}"))
-            except:
-                # Old format.
-                pass
-        if cache:
-            ErrorTraceConvertionCache.objects.bulk_create(cache)
-
-        for leaf in reports:
-            UnsafeUtils.ConnectReport(leaf)
-        UnsafeUtils.RecalculateTags(reports)
+        fill_unsafes_cache(reports)
 
     def __fill_leaf_cache(self, leaf):
         if self.job.weight == JOB_WEIGHT[1][0]:
@@ -806,21 +849,6 @@ class UploadReport:
             compres.save()
             update_total_resources(p)
 
-    def __attr_children(self, name, value, compare=False, associate=False, data=None):
-        attr_data = []
-        if isinstance(value, list):
-            for v in value:
-                if not isinstance(v, dict) or 'name' not in v or 'value' not in v:
-                    raise ValueError('Wrong format of report attribute')
-                for n in self.__attr_children(v['name'].replace(':', '_'), v['value'], v.get('compare', False),
-                                              v.get('associate', False), v.get('data')):
-                    attr_data.append(("%s:%s" % (name, n[0]) if len(name) > 0 else n[0], n[1], n[2], n[3], n[4]))
-        elif isinstance(value, str):
-            attr_data = [(name, value, compare, associate, data)]
-        else:
-            raise ValueError('Wrong format of report attributes')
-        return attr_data
-
     def __save_attrs(self, report_id, attrs):
         if not isinstance(attrs, list):
             return []
@@ -829,7 +857,7 @@ class UploadReport:
             attr_archive = self.archives[self.data['attr data']]
         attrdata = AttrData(self.root.id, attr_archive)
         attrorder = []
-        for attr, value, compare, associate, data in self.__attr_children('', attrs):
+        for attr, value, compare, associate, data in attr_children('', attrs):
             attrorder.append(attr)
             attrdata.add(report_id, attr, value, compare, associate, data)
         attrdata.upload()
@@ -847,8 +875,484 @@ class UploadReport:
             if not zipfile.is_zipfile(arch) or zipfile.ZipFile(arch).testzip():
                 raise CheckArchiveError('The archive "%s" of report "%s" is not a ZIP file' % (arch.name, report_id))
 
-    def __is_not_used(self):
-        pass
+
+def get_computer(description):
+    # Computers can be created by concurrent uploads, the unique hash sum makes get_or_create() retry the select
+    return Computer.objects.get_or_create(
+        hash_sum=hashlib.sha256(description.encode('utf8')).hexdigest(), defaults={'description': description}
+    )[0]
+
+
+def bulk_create_reports(model, reports):
+    # Django can't bulk create models with multi-table inheritance, so rows of the parent table (Report) are created
+    # first and then rows of the child table are inserted with primary keys of created parents.
+    if len(reports) == 0:
+        return reports
+    if not connection.features.can_return_rows_from_bulk_insert:
+        for report in reports:
+            report.save()
+        return reports
+    for report in reports:
+        report.path = report.parent.children_path if report.parent_id is not None else REPORT_PATH_SEP
+    with transaction.atomic():
+        parents = Report.objects.bulk_create(list(
+            Report(root_id=r.root_id, parent_id=r.parent_id, identifier=r.identifier, path=r.path) for r in reports
+        ))
+        for report, parent in zip(reports, parents):
+            report.id = report.report_ptr_id = parent.id
+        getattr(model, '_base_manager')._insert(reports, fields=getattr(model, '_meta').local_concrete_fields)
+    for report in reports:
+        report._state.adding = False
+        report._state.db = connection.alias
+        report._saved_parent_id = report.parent_id
+    return reports
+
+
+class UploadReportsBatch:
+    # Only these reports are uploaded together, other reports are uploaded one by one with UploadReport
+    batch_types = {'verification', 'verification finish', 'safe', 'unsafe', 'unknown'}
+
+    def __init__(self, job, reports, archives=None, source_archives=None):
+        self.error = None
+        self.job = job
+        self.archives = archives or {}
+        self.source_archives = {} if source_archives is None else source_archives
+        self._component_cache = {}
+        self._computer_cache = {}
+        try:
+            if not isinstance(reports, list):
+                raise ValueError('Wrong format of reports data')
+            self.root = self.__get_root_report()
+            self.__check_archives()
+            with AttributesValuesCache():
+                for is_batch, data in self.__get_chunks(reports):
+                    if is_batch:
+                        self.__upload_batch(data)
+                    else:
+                        self.error = UploadReport(self.job, data, self.archives,
+                                                  source_archives=self.source_archives).error
+                        if self.error is not None:
+                            return
+        except CheckArchiveError as e:
+            logger.info(str(e))
+            self.error = 'ZIP error'
+        except Exception as e:
+            logger.exception(e)
+            self.error = str(e)
+
+    def __get_root_report(self):
+        try:
+            return ReportRoot.objects.get(job=self.job)
+        except ObjectDoesNotExist:
+            raise ValueError("the job is corrupted: can't find report root")
+
+    def __check_archives(self):
+        for arch in self.archives.values():
+            if not zipfile.is_zipfile(arch) or zipfile.ZipFile(arch).testzip():
+                raise CheckArchiveError('The archive "%s" is not a ZIP file' % arch.name)
+            arch.seek(0)
+
+    def __get_chunks(self, reports):
+        # Lightweight jobs cut parents branches of reports, so their reports are always uploaded one by one
+        chunk = []
+        for data in reports:
+            if self.job.weight == JOB_WEIGHT[0][0] and isinstance(data, dict) and data.get('type') in self.batch_types:
+                chunk.append(data)
+                continue
+            if chunk:
+                yield True, chunk
+                chunk = []
+            yield False, data
+        if chunk:
+            yield True, chunk
+
+    def __upload_batch(self, chunk):
+        reports = []
+        for data in chunk:
+            reports.append(CheckReportData(data, self.archives).data)
+
+        # Reports of the batch are created all or nothing, saved archives are released on failure
+        with SavedFiles(), transaction.atomic():
+            # Report identifier: ReportComponent
+            self._components = {}
+            # Report id: ReportComponent (parents and all their ancestors)
+            self._reports = {}
+            # (report id, component id): [cpu time, wall time, memory]
+            self._resources = {}
+            # (report id, component id): [in progress, total]
+            self._instances = {}
+            self.__check_identifiers(reports)
+            self.__get_parents(reports)
+            self.__create_verification_reports(list(d for d in reports if d['type'] == 'verification'))
+            self.__create_leaves(list(d for d in reports if d['type'] in {'safe', 'unsafe', 'unknown'}))
+            self.__finish_verification_reports(list(d for d in reports if d['type'] == 'verification finish'))
+            self.__update_resources()
+            self.__update_instances()
+
+    def __check_identifiers(self, reports):
+        identifiers = set()
+        for data in reports:
+            if data['type'] == 'verification finish':
+                continue
+            if data['type'] == 'unsafe':
+                new_ids = list('{0}{1}/{2}'.format(self.job.identifier, data['id'], i + 1)
+                               for i in range(len(data['error traces'])))
+            else:
+                new_ids = [self.job.identifier + data['id']]
+            if any(x in identifiers for x in new_ids):
+                raise ValueError('the report with specified identifier already exists')
+            identifiers.update(new_ids)
+        if Report.objects.filter(identifier__in=identifiers).exists():
+            raise ValueError('the report with specified identifier already exists')
+
+    def __get_parents(self, reports):
+        identifiers = set()
+        for data in reports:
+            if 'parent id' in data:
+                identifiers.add(self.job.identifier + data['parent id'])
+            elif data['type'] == 'verification finish':
+                identifiers.add(self.job.identifier + data['id'])
+        for report in ReportComponent.objects.filter(root=self.root, identifier__in=identifiers):
+            self.__add_component(report)
+
+        # Get all ancestors of parents
+        ancestors_ids = set()
+        for report in self._reports.values():
+            ancestors_ids.update(report.ancestors_ids)
+        for report in ReportComponent.objects.filter(id__in=ancestors_ids - set(self._reports)):
+            self.__add_component(report)
+
+    def __add_component(self, report):
+        self._components[report.identifier] = report
+        self._reports[report.id] = report
+
+    def __get_parent(self, data):
+        try:
+            return self._components[self.job.identifier + data['parent id']]
+        except KeyError:
+            raise ValueError('report parent was not found')
+
+    def __get_branch(self, report):
+        return list(self._reports[r_id] for r_id in report.ancestors_ids) + [report]
+
+    def __get_component(self, name):
+        if name not in self._component_cache:
+            self._component_cache[name] = Component.objects.get_or_create(name=name)[0]
+        return self._component_cache[name]
+
+    def __get_computer(self, comp):
+        description = json.dumps(comp, ensure_ascii=False, sort_keys=True, indent=4)
+        if description not in self._computer_cache:
+            self._computer_cache[description] = get_computer(description)
+        return self._computer_cache[description]
+
+    def __get_source(self, arch_name):
+        if arch_name not in self.source_archives:
+            # Copy source archive into media directory.
+            source = ErrorTraceSource(root=self.root)
+            source.add_sources(REPORT_ARCHIVE['sources'], self.archives[arch_name], True)
+            self.source_archives[arch_name] = source
+        return self.source_archives[arch_name]
+
+    def __add_instance(self, report_id, component_id, in_progress, total):
+        key = (report_id, component_id)
+        if key not in self._instances:
+            self._instances[key] = [0, 0]
+        self._instances[key][0] += in_progress
+        self._instances[key][1] += total
+
+    def __add_resources(self, report_id, component_id, cpu_time, wall_time, memory):
+        key = (report_id, component_id)
+        if key not in self._resources:
+            self._resources[key] = [0, 0, 0]
+        self._resources[key][0] += cpu_time
+        self._resources[key][1] += wall_time
+        self._resources[key][2] = max(self._resources[key][2], memory)
+
+    def __create_verification_reports(self, reports_data):
+        new_reports = []
+        for data in reports_data:
+            parent = self.__get_parent(data)
+            report = ReportComponent(
+                identifier=self.job.identifier + data['id'], parent=parent, root=self.root, start_date=now(),
+                verification=True, component=self.__get_component(data['name']), covnum=int('coverage' in data),
+                cpu_time=int(data['resources']['CPU time']), wall_time=int(data['resources']['wall time']),
+                memory=int(data['resources']['memory size'])
+            )
+            if 'comp' in data:
+                report.computer = self.__get_computer(data['comp'])
+            else:
+                report.computer_id = parent.computer_id
+            if 'data' in data:
+                report.new_data('report-data.json', BytesIO(json.dumps(
+                    data['data'], ensure_ascii=False, sort_keys=True, indent=4
+                ).encode('utf8')))
+            if 'log' in data:
+                report.add_log(REPORT_ARCHIVE['log'], self.archives[data['log']])
+            if 'task' in data:
+                with data['task'].archive.file as fp:
+                    report.add_verifier_input(REPORT_ARCHIVE['verifier input'], fp)
+            elif 'verifier input' in data:
+                report.add_verifier_input(REPORT_ARCHIVE['verifier input'], self.archives[data['verifier input']])
+
+            # Check that report archives were successfully saved on disk
+            for field_name in ['log', 'verifier_input']:
+                arch_name = getattr(report, field_name).name
+                if arch_name and not os.path.exists(os.path.join(settings.MEDIA_ROOT, arch_name)):
+                    raise CheckArchiveError('Report archive "%s" was not saved' % field_name)
+            new_reports.append(report)
+        bulk_create_reports(ReportComponent, new_reports)
+
+        additional_resources = []
+        own_resources = []
+        attrs = []
+        for data, report in zip(reports_data, new_reports):
+            self.__add_component(report)
+            for r_name, r_val in data['resources'].items():
+                if r_name not in ['CPU time', 'memory size', 'wall time']:
+                    additional_resources.append(Resources(report=report, name=r_name, value=r_val))
+            own_resources.append(ComponentResource(
+                report=report, component=report.component,
+                cpu_time=report.cpu_time, wall_time=report.wall_time, memory=report.memory
+            ))
+            attrs.append((report, data, data['attrs']))
+
+            for parent in self.__get_branch(report.parent):
+                self.__add_resources(parent.id, report.component_id, report.cpu_time, report.wall_time, report.memory)
+                self.__add_instance(parent.id, report.component_id, 1, 1)
+            self.__add_instance(report.id, report.component_id, 1, 1)
+        Resources.objects.bulk_create(additional_resources)
+        ComponentResource.objects.bulk_create(own_resources)
+        self.__save_attrs(attrs, check_parents=True)
+
+        for data, report in zip(reports_data, new_reports):
+            if 'coverage' in data:
+                carch = CoverageArchive(report=report)
+                carch.save_archive(REPORT_ARCHIVE['coverage'], self.archives[data['coverage']])
+            if 'coverage sources' in data:
+                source = ErrorTraceSource(root=self.root)
+                source.add_sources(REPORT_ARCHIVE['coverage sources'],
+                                   self.archives[REPORT_ARCHIVE['coverage sources']], True)
+            if report.covnum > 0:
+                FillCoverageCache(report)
+
+    def __create_leaves(self, reports_data):
+        leaves = {ReportSafe: [], ReportUnsafe: [], ReportUnknown: []}
+        attrs = []
+        trace_ids = set()
+        for data in reports_data:
+            parent = self.__get_parent(data)
+            identifier = self.job.identifier + data['id']
+            if data['type'] == 'safe':
+                if parent.cpu_time is None:
+                    raise ValueError('safe parent need to be verification report and must have cpu_time')
+                report = ReportSafe(
+                    identifier=identifier, parent=parent, root=self.root, cpu_time=parent.cpu_time,
+                    wall_time=parent.wall_time, memory=parent.memory
+                )
+                if 'sources' in data:
+                    # Those sources are shared with error traces.
+                    report.source = self.__get_source(data['sources'])
+                if 'proof' in data:
+                    report.add_proof(REPORT_ARCHIVE['proof'], self.archives[data['proof']])
+                    if not os.path.exists(os.path.join(settings.MEDIA_ROOT, report.proof.name)):
+                        raise CheckArchiveError('Report archive "proof" was not saved')
+                leaves[ReportSafe].append(report)
+                attrs.append((report, data, data.get('attrs')))
+            elif data['type'] == 'unknown':
+                report = ReportUnknown(identifier=identifier, parent=parent, root=self.root,
+                                       component_id=parent.component_id)
+                if parent.verification:
+                    report.cpu_time = parent.cpu_time
+                    report.wall_time = parent.wall_time
+                    report.memory = parent.memory
+                else:
+                    resources = data.get('resources', {})
+                    report.cpu_time = resources.get('CPU time', 0)
+                    report.wall_time = resources.get('wall time', 0)
+                    report.memory = resources.get('memory size', 0)
+                report.add_problem_desc(REPORT_ARCHIVE['problem desc'], self.archives[data['problem desc']])
+                if not os.path.exists(os.path.join(settings.MEDIA_ROOT, report.problem_description.name)):
+                    raise CheckArchiveError('Report archive "problem desc" was not saved')
+                leaves[ReportUnknown].append(report)
+                attrs.append((report, data, data.get('attrs')))
+            else:
+                if parent.cpu_time is None:
+                    raise ValueError('unsafe parent need to be verification report and must have cpu_time')
+                et_archs = {}
+                for arch_name in data['error traces']:
+                    et_archs[arch_name] = self.archives[arch_name]
+                res = CheckErrorTraces(et_archs, self.archives[data['sources']])
+                source = self.__get_source(data['sources'])
+                for cnt, arch_name in enumerate(data['error traces'], start=1):
+                    trace_id = unique_id()
+                    while trace_id in trace_ids:
+                        trace_id = unique_id()
+                    trace_ids.add(trace_id)
+                    report = ReportUnsafe(
+                        identifier=identifier + '/{0}'.format(cnt), parent=parent, root=self.root,
+                        trace_id=trace_id, source=source,
+                        cpu_time=parent.cpu_time, wall_time=parent.wall_time, memory=parent.memory
+                    )
+                    report.add_trace(REPORT_ARCHIVE['error trace'], self.archives[arch_name])
+                    if not os.path.exists(os.path.join(settings.MEDIA_ROOT, report.error_trace.name)):
+                        raise CheckArchiveError('Report archive "error trace" was not saved')
+                    leaves[ReportUnsafe].append(report)
+                    attrs.append((report, data, data['attrs']))
+                    if arch_name in res.add_attrs:
+                        attrs.append((report, data, res.add_attrs[arch_name]))
+        for model in leaves:
+            bulk_create_reports(model, leaves[model])
+
+        self.__create_leaf_attrs(attrs)
+
+        leaves_cache = []
+        for model, field in [(ReportSafe, 'safe'), (ReportUnsafe, 'unsafe'), (ReportUnknown, 'unknown')]:
+            for leaf in leaves[model]:
+                for parent in self.__get_branch(leaf.parent):
+                    leaves_cache.append(ReportComponentLeaf(report=parent, **{field: leaf}))
+        ReportComponentLeaf.objects.bulk_create(leaves_cache)
+
+        fill_unsafes_cache(leaves[ReportUnsafe])
+        for leaf in leaves[ReportSafe]:
+            SafeUtils.ConnectReport(leaf)
+        if leaves[ReportSafe]:
+            SafeUtils.RecalculateTags(leaves[ReportSafe])
+        for leaf in leaves[ReportUnknown]:
+            UnknownUtils.ConnectReport(leaf)
+
+    def __create_leaf_attrs(self, attrs):
+        # Copy attributes of all parents to leaves
+        parents_attrs = {}
+        for ra in ReportAttr.objects.filter(report_id__in=set(self._reports)).order_by('id') \
+                .values('report_id', 'attr_id', 'attr__name__name', 'compare', 'associate', 'data_id'):
+            parents_attrs.setdefault(ra['report_id'], []).append(ra)
+
+        # Report id: list of attributes names
+        ordered_attrs = {}
+        leaf_attrs = []
+        for leaf in set(a[0] for a in attrs):
+            ordered_attrs[leaf.id] = []
+            for parent in self.__get_branch(leaf.parent):
+                for ra in parents_attrs.get(parent.id, []):
+                    ordered_attrs[leaf.id].append(ra['attr__name__name'])
+                    leaf_attrs.append(ReportAttr(
+                        attr_id=ra['attr_id'], report=leaf, compare=ra['compare'], associate=ra['associate'],
+                        data_id=ra['data_id']
+                    ))
+        ReportAttr.objects.bulk_create(leaf_attrs)
+
+        for report_id, names in self.__save_attrs(attrs).items():
+            ordered_attrs[report_id].extend(names)
+        for names in ordered_attrs.values():
+            if len(names) != len(set(names)):
+                logger.error("Attributes were redefined. List of attributes that should be unique: %s" % names)
+                raise ValueError("attributes were redefined")
+
+    def __save_attrs(self, attrs, check_parents=False):
+        # Attributes are uploaded together for all reports with the same archive of attributes data
+        attrdata = {}
+        ordered_attrs = {}
+        for report, data, report_attrs in attrs:
+            ordered_attrs.setdefault(report.id, [])
+            if not isinstance(report_attrs, list):
+                continue
+            arch_name = data.get('attr data')
+            if arch_name not in attrdata:
+                attrdata[arch_name] = AttrData(self.root.id, self.archives[arch_name] if arch_name else None)
+            for attr, value, compare, associate, a_data in attr_children('', report_attrs):
+                ordered_attrs[report.id].append(attr)
+                attrdata[arch_name].add(report.id, attr, value, compare, associate, a_data)
+        for data in attrdata.values():
+            data.upload()
+
+        if check_parents:
+            parents_names = {}
+            for r_id, name in ReportAttr.objects.filter(report_id__in=set(self._reports) - set(ordered_attrs)) \
+                    .values_list('report_id', 'attr__name__name'):
+                parents_names.setdefault(r_id, set()).add(name)
+            for report, data, report_attrs in attrs:
+                names = set(ordered_attrs[report.id])
+                if len(names) != len(ordered_attrs[report.id]):
+                    logger.error("Attributes were redefined. List of attributes that should be unique: %s" %
+                                 ordered_attrs[report.id])
+                    raise ValueError("attributes were redefined")
+                if any(names & parents_names.get(p.id, set()) for p in self.__get_branch(report.parent)):
+                    raise ValueError("The report has redefined parent's attributes")
+        return ordered_attrs
+
+    def __finish_verification_reports(self, reports_data):
+        finished = {}
+        for data in reports_data:
+            try:
+                report = self._components[self.job.identifier + data['id']]
+            except KeyError:
+                raise ValueError('verification report does not exist')
+            finished[report.id] = report
+            for parent in self.__get_branch(report):
+                self.__add_instance(parent.id, report.component_id, -1, 0)
+        if finished:
+            ReportComponent.objects.filter(id__in=finished).update(finish_date=now())
+            mark_reports_dirty(finished.values())
+
+    def __update_resources(self):
+        if len(self._resources) == 0:
+            return
+        report_ids = set(key[0] for key in self._resources)
+        # (report id, component id): ComponentResource
+        resources = {}
+        for compres in ComponentResource.objects.filter(report_id__in=report_ids):
+            resources[(compres.report_id, compres.component_id)] = compres
+
+        to_create = []
+        for key, (cpu_time, wall_time, memory) in self._resources.items():
+            if key not in resources:
+                resources[key] = ComponentResource(report_id=key[0], component_id=key[1])
+                to_create.append(resources[key])
+            resources[key].cpu_time += cpu_time
+            resources[key].wall_time += wall_time
+            resources[key].memory = max(memory, resources[key].memory)
+
+        # Total resources of each report are calculated by resources of all its components
+        totals = {}
+        for (report_id, component_id), compres in resources.items():
+            if component_id is None:
+                continue
+            if report_id not in totals:
+                totals[report_id] = resources.get((report_id, None))
+                if totals[report_id] is None:
+                    totals[report_id] = ComponentResource(report_id=report_id, component=None)
+                    to_create.append(totals[report_id])
+                totals[report_id].cpu_time = totals[report_id].wall_time = totals[report_id].memory = 0
+            totals[report_id].cpu_time += compres.cpu_time
+            totals[report_id].wall_time += compres.wall_time
+            totals[report_id].memory = max(totals[report_id].memory, compres.memory)
+
+        ComponentResource.objects.bulk_update(
+            list(r for r in resources.values() if r.pk is not None), ['cpu_time', 'wall_time', 'memory']
+        )
+        ComponentResource.objects.bulk_create(to_create)
+
+    def __update_instances(self):
+        if len(self._instances) == 0:
+            return
+        instances = {}
+        for comp_inst in ComponentInstances.objects.filter(report_id__in=set(key[0] for key in self._instances)):
+            instances[(comp_inst.report_id, comp_inst.component_id)] = comp_inst
+
+        to_update = []
+        to_create = []
+        for key, (in_progress, total) in self._instances.items():
+            if key in instances:
+                instances[key].in_progress = max(instances[key].in_progress + in_progress, 0)
+                instances[key].total += total
+                to_update.append(instances[key])
+            else:
+                to_create.append(ComponentInstances(
+                    report_id=key[0], component_id=key[1], in_progress=max(in_progress, 0), total=total
+                ))
+        ComponentInstances.objects.bulk_update(to_update, ['in_progress', 'total'])
+        ComponentInstances.objects.bulk_create(to_create)
 
 
 class CollapseReports:
@@ -903,7 +1407,10 @@ class CollapseReports:
         ReportComponent.objects.filter(root=root, verifier_input='', covnum=0) \
             .exclude(id__in=set(sub_jobs) | {core_id}).delete()
 
+        RecalculateReportsPaths([root])
         RecalculateLeaves([root])
+        # Other caches of the whole tree are changed too
+        mark_reports_dirty(ReportComponent.objects.filter(id=core_id))
 
 
 class CheckErrorTraces:
@@ -918,14 +1425,28 @@ class CheckErrorTraces:
         manager = Extended.objects.filter(role=USER_ROLES[2][0]).first()
         if not manager:
             raise ValueError("Can't check error traces without manager in the system")
+        users = self.__get_users_options(manager)
 
         for tr_name in self._traces:
-            res = GetETV(self.__read_trace(tr_name), manager.user)
+            error_trace = self.__read_trace(tr_name)
+            res = GetETV(error_trace, manager.user)
 
             if 'attrs' in res.data:
                 self.add_attrs[tr_name] = res.data['attrs']
             if 'files' not in res.data:
                 raise ValueError('Wrong format of error trace')
+            # Rendered error traces depend on options of users, so they are cached for all used options
+            for user in users:
+                GetETV(error_trace, user)
+
+    def __get_users_options(self, manager):
+        # One user for each combination of options, which is used by other users
+        self.__is_not_used()
+        users = {(manager.assumptions, manager.triangles): None}
+        for extended in Extended.objects.select_related('user').order_by('id'):
+            if (extended.assumptions, extended.triangles) not in users:
+                users[(extended.assumptions, extended.triangles)] = extended.user
+        return list(user for user in users.values() if user is not None)
 
     def __read_trace(self, trace_name):
         with zipfile.ZipFile(self._traces[trace_name], mode='r') as zfp:
@@ -939,3 +1460,6 @@ class CheckErrorTraces:
         for arch in self._traces:
             self._traces[arch].seek(0)
         self._sources.seek(0)
+
+    def __is_not_used(self):
+        pass
@@ -16,15 +16,23 @@
 # limitations under the License.
 #
 
+import hashlib
+import json
 import sys
 from difflib import SequenceMatcher
 
+from django.db import transaction, IntegrityError
+from django.db.models import Count, Max
+
 from jobs.models import Job
 from jobs.utils import get_resource_data
 from marks.models import MarkUnsafeReport, MarkUnknownReport
+from reports.mea.clustering import ErrorTracesClustering
 from reports.mea.wrapper import COMPARISON_FUNCTIONS, CONVERSION_FUNCTIONS, DEFAULT_SIMILARITY_THRESHOLD, \
-    DEFAULT_COMPARISON_FUNCTION, DEFAULT_CONVERSION_FUNCTION, compare_converted_traces, get_or_convert_error_trace_auto
-from reports.models import ReportAttr, ReportSafe, ReportUnsafe, ReportUnknown, ReportRoot, ComponentResource
+    DEFAULT_COMPARISON_FUNCTION, DEFAULT_CONVERSION_FUNCTION, get_or_convert_error_trace_auto
+from reports.models import ReportAttr, ReportSafe, ReportUnsafe, ReportUnknown, ReportRoot, ComponentResource, \
+    Report, ComparisonSnapshot, ComparisonSnapshotLeaf
+from web.vars import COMPARISON_CATEGORY
 
 VERDICT_SAFE = 'safe'
 VERDICT_UNSAFE = 'unsafe'
@@ -56,7 +64,6 @@ TAG_MARK = "mark"
 TAG_ORIGIN = "origin"
 TAG_ATTRS = "attrs"
 TAG_REPORTS = "reports"
-TAG_CET = "cet"
 TAG_COLOR = "color"
 TAG_HIDE = "hide"
 TAG_NEW_PROOFS = "new_proofs"
@@ -161,6 +168,7 @@ class JobsComparison:
         # 2nd iteration.
         counter = 0
         clusters = list()
+        clusters_groups = list()
         self.cpu_time_first_sum = 0
         self.cpu_time_first = dict()
         unused_attrs_all = list()
@@ -193,7 +201,9 @@ class JobsComparison:
                     cmp[TAG_NEW_PROOFS] = sorted(cmp[TAG_NEW_PROOFS], key=lambda x: x[1])
 
             if self.enable_clustering:
-                clusters.append(self.perform_clustering(unsafes, unsafe_incompletes, cmp))
+                marks_clusters, traces_groups = self.perform_clustering(unsafes, unsafe_incompletes, cmp)
+                clusters.append(marks_clusters)
+                clusters_groups.append(traces_groups)
 
             for name, vals in cmp['attrs_vals']:
                 marked_vals = list()
@@ -209,7 +219,9 @@ class JobsComparison:
         self.uncore_attrs = sorted(self.uncore_attrs)
 
         if clusters:
-            # TODO: support for more than 2 reports comparison
+            common_ama_counter = self.__cluster_error_traces(clusters, clusters_groups)
+
+            # TODO: support for more than 2 reports comparison in results
             assert len(clusters) == 2
             clusters_1 = clusters[0]
             clusters_2 = clusters[1]
@@ -230,28 +242,6 @@ class JobsComparison:
                                     cluster_1[TAG_HIDE] = True
                                     cluster_2[TAG_HIDE] = True
 
-            common_compared_attrs = desc_1.get(CLUSTERING_ORIGIN_AUTO, set()). \
-                intersection(desc_2.get(CLUSTERING_ORIGIN_AUTO, set()))
-
-            common_ama_counter = 0
-            for cluster_1 in clusters_1:
-                if cluster_1[TAG_ORIGIN] == CLUSTERING_ORIGIN_AUTO and cluster_1[TAG_ATTRS] in common_compared_attrs:
-                    compared_attrs = cluster_1[TAG_ATTRS]
-                    cet_1 = cluster_1[TAG_CET]
-                    for cluster_2 in clusters_2:
-                        if cluster_2[TAG_ORIGIN] == CLUSTERING_ORIGIN_AUTO and cluster_2[TAG_ATTRS] == compared_attrs \
-                                and TAG_AUTO_ID not in cluster_2:
-                            cet_2 = cluster_2[TAG_CET]
-                            if compare_converted_traces(cet_1, cet_2, self.comparison_function, self.similarity):
-                                common_ama_counter += 1
-                                cluster_1[TAG_AUTO_ID] = common_ama_counter
-                                cluster_2[TAG_AUTO_ID] = common_ama_counter
-                                if self.clustering_type == CLUSTERING_TYPE_DIFF_TRACES:
-                                    if len(cluster_1[TAG_REPORTS]) == len(cluster_2[TAG_REPORTS]):
-                                        cluster_1[TAG_HIDE] = True
-                                        cluster_2[TAG_HIDE] = True
-                                break
-
             counter = 0
             for cluster in clusters:
                 self.comparison[counter]['clusters_len'] = len(cluster)
@@ -431,7 +421,8 @@ class JobsComparison:
             cluster[TAG_HIDE] = True
         common_clusters.append(cluster)
 
-    def perform_clustering(self, unsafes: dict, unsafe_incompletes: dict, cmp) -> list:
+    def perform_clustering(self, unsafes: dict, unsafe_incompletes: dict, cmp) -> tuple:
+        # Returns clusters of marks and groups of error traces without marks, which should be clustered
         clusters_by_attrs = dict()
         clusters_by_attrs_reverse = dict()
         traces = set()
@@ -478,38 +469,49 @@ class JobsComparison:
             })
         cmp['cluster_marks'] = len(mark_to_reports)
 
-        auto_clusters_counter = 0
+        traces_groups = dict()
         for attrs, reports in clusters_by_attrs.items():
-            converted_error_traces = dict()
-            for report_id in sorted(reports):
-                if report_id not in traces:
-                    # There is a mark for this trace.
-                    continue
-                converted_error_trace = get_or_convert_error_trace_auto(report_id, self.conversion_function, {})
-                if not converted_error_traces:
-                    converted_error_traces[converted_error_trace] = {report_id}
-                else:
-                    is_equal = False
-                    for processed_cet in converted_error_traces.keys():
-                        if compare_converted_traces(converted_error_trace, processed_cet, self.comparison_function,
-                                                    self.similarity):
-                            is_equal = True
-                            converted_error_traces[processed_cet].add(report_id)
-                            break
-                    if not is_equal:
-                        converted_error_traces[converted_error_trace] = {report_id}
-            if converted_error_traces:
-                for cet, report_ids in converted_error_traces.items():
-                    clusters.append({
-                        TAG_ATTRS: attrs,
-                        TAG_ORIGIN: CLUSTERING_ORIGIN_AUTO,
-                        TAG_CET: cet,
-                        TAG_REPORTS: sorted(report_ids)
-                    })
-                    auto_clusters_counter += 1
-
-        cmp['cluster_ama'] = auto_clusters_counter
-        return clusters
+            # Error traces with marks are already clustered
+            reports = reports.intersection(traces)
+            if reports:
+                traces_groups[attrs] = reports
+        return clusters, traces_groups
+
+    def __cluster_error_traces(self, clusters: list, clusters_groups: list) -> int:
+        # Error traces without marks of all compared reports are clustered at once
+        traces_clustering = ErrorTracesClustering(
+            clusters_groups, lambda report_id: get_or_convert_error_trace_auto(report_id, self.conversion_function, {}),
+            self.comparison_function, self.similarity
+        )
+        common_ama_counter = 0
+        common_ids = dict()
+        for counter, traces_clusters in enumerate(traces_clustering.clusters):
+            for attrs, report_ids, component in traces_clusters:
+                cluster = {
+                    TAG_ATTRS: attrs,
+                    TAG_ORIGIN: CLUSTERING_ORIGIN_AUTO,
+                    TAG_REPORTS: report_ids
+                }
+                if len(traces_clustering.components[component]) > 1:
+                    if component not in common_ids:
+                        common_ama_counter += 1
+                        common_ids[component] = common_ama_counter
+                    cluster[TAG_AUTO_ID] = common_ids[component]
+                clusters[counter].append(cluster)
+            self.comparison[counter]['cluster_ama'] = len(traces_clusters)
+
+        if self.clustering_type == CLUSTERING_TYPE_DIFF_TRACES:
+            # Equivalent clusters with the same number of error traces in all compared reports are not shown
+            common_clusters = dict()
+            for cluster in sum(clusters, list()):
+                if cluster[TAG_ORIGIN] == CLUSTERING_ORIGIN_AUTO and TAG_AUTO_ID in cluster:
+                    common_clusters.setdefault(cluster[TAG_AUTO_ID], list()).append(cluster)
+            for common_cluster in common_clusters.values():
+                if len(common_cluster) == len(clusters) and \
+                        len(set(len(cluster[TAG_REPORTS]) for cluster in common_cluster)) == 1:
+                    for cluster in common_cluster:
+                        cluster[TAG_HIDE] = True
+        return common_ama_counter
 
     def __init_args(self, args: dict):
         # Default values.
@@ -844,3 +846,70 @@ class JobsComparison:
         comparison_data['attrs'] = attrs
 
         return attrs, attrs_vals, attrs_ids, comparison_data
+
+
+def get_comparison_state(root1: ReportRoot, root2: ReportRoot) -> str:
+    # Comparison of roots is changed only if they get new reports, marks associations (which are recreated
+    # on each change, so they get new ids) or associated marks are changed
+    state = []
+    for root in (root1, root2):
+        reports = Report.objects.filter(root=root).aggregate(number=Count('id'), last=Max('id'))
+        state.extend([reports['number'], reports['last'] or 0])
+        for model in (MarkUnsafeReport, MarkUnknownReport):
+            marks = model.objects.filter(report__root=root)\
+                .aggregate(number=Count('id'), last=Max('id'), changed=Max('mark__change_date'))
+            state.extend([marks['number'], marks['last'] or 0,
+                          marks['changed'].timestamp() if marks['changed'] else 0])
+    return ':'.join(str(x) for x in state)
+
+
+class CreateComparisonSnapshot:
+    def __init__(self, root1: ReportRoot, root2: ReportRoot, args: dict, options: str, state: str):
+        self._root1 = root1
+        self._root2 = root2
+        self._options = options
+        self._state = state
+        self.snapshot = self.__create_snapshot(JobsComparison([root1, root2], args).comparison[1].get('clusters', []))
+
+    def __get_leaves(self, clusters):
+        leaves = []
+        for cluster_id, cluster in enumerate(clusters):
+            reports_1 = cluster.get(TAG_REPORTS + '_0', [])
+            reports_2 = cluster.get(TAG_REPORTS + '_1', [])
+            if reports_1 and reports_2:
+                category_1 = category_2 = COMPARISON_CATEGORY[0][0]
+            else:
+                category_1, category_2 = COMPARISON_CATEGORY[1][0], COMPARISON_CATEGORY[2][0]
+            for report_id in reports_1:
+                leaves.append((report_id, cluster_id, category_1, report_id == cluster[TAG_REPORTS]))
+            for report_id in reports_2:
+                leaves.append((report_id, cluster_id, category_2, False))
+        return leaves
+
+    def __create_snapshot(self, clusters):
+        leaves = self.__get_leaves(clusters)
+        try:
+            with transaction.atomic():
+                ComparisonSnapshot.objects.filter(root1=self._root1, root2=self._root2, options=self._options).delete()
+                snapshot = ComparisonSnapshot.objects.create(
+                    root1=self._root1, root2=self._root2, options=self._options, state=self._state
+                )
+                ComparisonSnapshotLeaf.objects.bulk_create(list(ComparisonSnapshotLeaf(
+                    snapshot=snapshot, report_id=report_id, cluster=cluster_id, category=category,
+                    representative=representative
+                ) for report_id, cluster_id, category, representative in leaves), batch_size=1000)
+        except IntegrityError:
+            # The same snapshot was created by a concurrent request
+            snapshot = ComparisonSnapshot.objects.get(root1=self._root1, root2=self._root2, options=self._options)
+        return snapshot
+
+
+def get_comparison_snapshot(root1: ReportRoot, root2: ReportRoot, args: dict = None) -> ComparisonSnapshot:
+    # Clusters of jobs comparison are computed only once until compared roots are changed
+    args = args or {}
+    options = hashlib.md5(json.dumps(args, sort_keys=True).encode('utf8')).hexdigest()
+    state = get_comparison_state(root1, root2)
+    snapshot = ComparisonSnapshot.objects.filter(root1=root1, root2=root2, options=options).first()
+    if snapshot is not None and snapshot.state == state:
+        return snapshot
+    return CreateComparisonSnapshot(root1, root2, args, options, state).snapshot
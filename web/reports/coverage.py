@@ -24,18 +24,21 @@ import json
 import logging
 import os
 import re
+import sys
 import zipfile
+from array import array
 from io import StringIO
 
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.files import File as NewFile
 from django.db import transaction
+from django.db.models import Q
 from django.template import loader
 from django.utils.translation import gettext as _
 
 from reports.etv import TAB_LENGTH, KEY1_WORDS, KEY2_WORDS
 from reports.models import CoverageFile, CoverageData, CoverageDataValue, CoverageDataStatistics, CoverageArchive, \
-    ErrorTraceSource
+    CoverageDirectory, ErrorTraceSource
 from reports.utils import get_parents
 from web.vars import COVERAGE_FILE
 
@@ -55,6 +58,72 @@ COLOR = {
 
 TABLE_STAT_COLOR = ['#f18fa6', '#f1c0b2', '#f9e19b', '#e4f495', '#acf1a8']
 
+# All directories of coverage statistics table are loaded at once only for small archives,
+# otherwise subdirectories are loaded on expanding.
+COVERAGE_TREE_MAX_FILES = 30
+# Directories with such files are expanded by default in small archives.
+COVERAGE_TREE_SOURCE_EXT = ('.i', '.c', '.c.aux')
+# Top-level directory, which is not expanded by default.
+COVERAGE_TREE_GENERATED = 'generated'
+
+# Packed coverage is a sequence of unsigned 32-bit integers (first line, last line, value).
+COVERAGE_ARRAY_TYPE = 'I'
+COVERAGE_MAX_VALUE = 0xFFFFFFFF
+
+
+def pack_coverage(ranges) -> bytes:
+    values = array(COVERAGE_ARRAY_TYPE)
+    for first, last, value in ranges:
+        values.extend((first, last, max(0, min(int(value), COVERAGE_MAX_VALUE))))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def unpack_coverage(packed) -> list:
+    values = array(COVERAGE_ARRAY_TYPE)
+    values.frombytes(bytes(packed))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return list(zip(values[0::3], values[1::3], values[2::3]))
+
+
+def lines_ranges(lines):
+    # Lines are given either as numbers or as ranges [first, last].
+    for line in lines:
+        if isinstance(line, int):
+            yield line, line
+        elif isinstance(line, list) and len(line) == 2:
+            if line[0] <= line[1]:
+                yield line[0], line[1]
+            else:
+                yield line[1], line[1]
+
+
+def coverage_ranges(coverage: list) -> list:
+    # Coverage [[<value>, <lines>], ...] is converted into ranges of consecutive lines with the same value.
+    lines_values = {}
+    for value, lines in coverage:
+        for first, last in lines_ranges(lines):
+            for line in range(first, last + 1):
+                lines_values[line] = value
+    ranges = []
+    for line in sorted(lines_values):
+        value = lines_values[line]
+        if ranges and ranges[-1][1] == line - 1 and ranges[-1][2] == value:
+            ranges[-1][1] = line
+        else:
+            ranges.append([line, line, value])
+    return ranges
+
+
+def expand_coverage(packed) -> dict:
+    lines_values = {}
+    for first, last, value in unpack_coverage(packed):
+        for line in range(first, last + 1):
+            lines_values[line] = value
+    return lines_values
+
 
 def coverage_color(curr_cov, max_cov=0, delta=0):
     if curr_cov == 0:
@@ -229,6 +298,10 @@ class GetCoverageSrcHTML:
     def __get_coverage(self):
         if self._covfile is None:
             return 0, 0, {}, {}
+        if self._covfile.lines is not None:
+            line_data = expand_coverage(self._covfile.lines)
+            func_data = expand_coverage(self._covfile.functions or b'')
+            return max(line_data.values(), default=0), max(func_data.values(), default=0), line_data, func_data
         max_line_cov = 0
         max_func_cov = 0
         line_data = {}
@@ -255,13 +328,26 @@ class GetCoverageSrcHTML:
                     func_data[line[1]] = linecov[0]
         return max_line_cov, max_func_cov, line_data, func_data
 
+    def __get_lines_data(self):
+        if self._covfile.data is None:
+            # Old coverage cache
+            return list(CoverageData.objects.filter(covfile=self._covfile)
+                        .values_list('data_id', 'data__name', 'line').order_by('line', 'data__name'))
+        lines_data = set()
+        for first, last, data_id in unpack_coverage(self._covfile.data):
+            for line in range(first, last + 1):
+                lines_data.add((data_id, line))
+        names = dict(CoverageDataValue.objects.filter(id__in=set(d_id for d_id, line in lines_data))
+                     .values_list('id', 'name'))
+        return sorted(((d_id, names[d_id], line) for d_id, line in lines_data if d_id in names),
+                      key=lambda x: (x[2], x[1]))
+
     def __get_data(self):
         data_map = []
         data_ids = set()
         last_i = -1
         if self._covfile is not None:
-            for data_id, dataname, line in CoverageData.objects.filter(covfile=self._covfile) \
-                    .values_list('data_id', 'data__name', 'line').order_by('line', 'data__name'):
+            for data_id, dataname, line in self.__get_lines_data():
                 self._lines_with_data.add(line)
                 if last_i >= 0 and data_map[last_i]['line'] == line:
                     data_map[last_i]['content'].append([dataname, data_id, False])
@@ -443,6 +529,130 @@ class GetCoverageSrcHTML:
         pass
 
 
+def file_directory(fname):
+    # Path of file directory in coverage tree, None means the root of coverage archive
+    path = fname.split('/')
+    return '/'.join(path[:-1]) if len(path) > 1 else None
+
+
+def coverage_stat_cell(covered, total):
+    cell = {'covered': covered, 'total': total, 'percent': '-'}
+    if total > 0:
+        div = covered / total
+        cell['percent'] = '%s%%' % round(100 * div, 2)
+        cell['color'] = TABLE_STAT_COLOR[max(0, min(int(div * len(TABLE_STAT_COLOR)), len(TABLE_STAT_COLOR) - 1))]
+    return cell
+
+
+def coverage_tree_rows(root_id, start_id, directories, files, expanded, loaded):
+    # Rows of statistics table in depth-first order (directories go first), starting from children of start_id
+    children = {}
+    for d in directories:
+        children.setdefault(d['parent_id'], []).append({
+            'id': d['id'], 'title': d['title'], 'path': d['path'], 'is_dir': True,
+            'parent_id': d['parent_id'] if d['parent_id'] != root_id else None,
+            'display': d['id'] in expanded, 'lazy': d['id'] not in loaded, 'indent': '  ' * (d['depth'] - 1),
+            'lines': coverage_stat_cell(d['covered_lines'], d['total_lines']),
+            'funcs': coverage_stat_cell(d['covered_funcs'], d['total_funcs'])
+        })
+    for f in files:
+        children.setdefault(f['directory_id'], []).append({
+            'id': 'f%s' % f['id'], 'title': f['name'].split('/')[-1], 'path': f['name'], 'is_dir': False,
+            'parent_id': f['directory_id'] if f['directory_id'] != root_id else None,
+            'display': False, 'lazy': False, 'indent': '  ' * f['directory__depth'],
+            'lines': coverage_stat_cell(f['covered_lines'], f['total_lines']),
+            'funcs': coverage_stat_cell(f['covered_funcs'], f['total_funcs'])
+        })
+    for parent_id, rows in children.items():
+        # Top-level files and directories are sorted together
+        rows.sort(key=lambda x: (parent_id != root_id and not x['is_dir'], x['title']))
+
+    ordered_data = []
+    stack = [iter(children.get(start_id, []))]
+    while stack:
+        row = next(stack[-1], None)
+        if row is None:
+            stack.pop()
+            continue
+        ordered_data.append(row)
+        if row['is_dir']:
+            stack.append(iter(children.get(row['id'], [])))
+    return ordered_data
+
+
+DIRECTORY_FIELDS = ('id', 'parent_id', 'path', 'title', 'depth',
+                    'covered_lines', 'total_lines', 'covered_funcs', 'total_funcs')
+FILE_FIELDS = ('id', 'directory_id', 'directory__depth', 'name',
+               'covered_lines', 'total_lines', 'covered_funcs', 'total_funcs')
+
+
+class CreateCoverageTree:
+    def __init__(self, cov_arch, files_stat):
+        # files_stat is {<file name>: [<covered lines>, <total lines>, <covered funcs>, <total funcs>]}
+        self._cov_arch = cov_arch
+        self._directories = {None: [0, 0, 0, 0, 0]}
+        self.__aggregate(files_stat)
+        self.directories = self.__create_directories()
+
+    def __aggregate(self, files_stat):
+        # Coverage of each file is added to all its directories, so the tree is built in one pass over files
+        for fname, stat in files_stat.items():
+            path = fname.split('/')
+            for i in range(len(path)):
+                dir_path = '/'.join(path[:i]) if i > 0 else None
+                if dir_path not in self._directories:
+                    self._directories[dir_path] = [0, 0, 0, 0, 0]
+                dir_stat = self._directories[dir_path]
+                for j in range(4):
+                    dir_stat[j] += stat[j]
+                dir_stat[4] += 1
+
+    def __create_directories(self):
+        levels = {}
+        for dir_path in self._directories:
+            levels.setdefault(0 if dir_path is None else dir_path.count('/') + 1, []).append(dir_path)
+
+        dir_ids = {}
+        for depth in sorted(levels):
+            new_dirs = []
+            for dir_path in levels[depth]:
+                stat = self._directories[dir_path]
+                new_dirs.append(CoverageDirectory(
+                    archive=self._cov_arch, path=dir_path, title=dir_path.split('/')[-1] if depth else '',
+                    parent_id=dir_ids[file_directory(dir_path)] if depth else None, depth=depth,
+                    covered_lines=stat[0], total_lines=stat[1], covered_funcs=stat[2], total_funcs=stat[3],
+                    files=stat[4]
+                ))
+            CoverageDirectory.objects.bulk_create(new_dirs, batch_size=1000)
+            # Identifiers are not returned by bulk_create() for some databases
+            dir_ids.update(CoverageDirectory.objects.filter(archive=self._cov_arch, depth=depth)
+                           .values_list('path', 'id'))
+        return dir_ids
+
+
+def get_coverage_root(cov_arch):
+    # Archives which were cached before directories appeared get their tree on the first request
+    root = CoverageDirectory.objects.filter(archive=cov_arch, parent=None).first()
+    if root is not None:
+        return root
+    with transaction.atomic():
+        CoverageArchive.objects.select_for_update().get(id=cov_arch.id)
+        root = CoverageDirectory.objects.filter(archive=cov_arch, parent=None).first()
+        if root is None:
+            files_stat = {}
+            files_ids = {}
+            for f_id, name, c_lines, t_lines, c_funcs, t_funcs in CoverageFile.objects.filter(archive=cov_arch)\
+                    .values_list('id', 'name', 'covered_lines', 'total_lines', 'covered_funcs', 'total_funcs'):
+                files_stat[name] = [c_lines, t_lines, c_funcs, t_funcs]
+                files_ids.setdefault(file_directory(name), []).append(f_id)
+            dir_ids = CreateCoverageTree(cov_arch, files_stat).directories
+            for dir_path, ids in files_ids.items():
+                for i in range(0, len(ids), 1000):
+                    CoverageFile.objects.filter(id__in=ids[i:i + 1000]).update(directory_id=dir_ids[dir_path])
+            root = CoverageDirectory.objects.get(archive=cov_arch, parent=None)
+    return root
+
+
 class CoverageStatistics:
     def __init__(self, cov_arch, cur_page):
         self.cov_arch = cov_arch
@@ -451,121 +661,54 @@ class CoverageStatistics:
         self.table_data = self.__get_table_data()
 
     def __get_table_data(self):
-        coverage = {}
-        for c in CoverageFile.objects.filter(archive=self.cov_arch):
-            coverage[c.name] = c
-
-        hide_all = False
-        if len(coverage) > 30:
-            hide_all = True
-
-        cnt = 0
-        parents = {}
-        for fname in coverage:
-            display = False
-            if fname == self.cur_page:
-                display = True
-            path = fname.split('/')
-            for i in range(len(path)):
-                cnt += 1
-                curr_path = '/'.join(path[:(i + 1)])
-                if curr_path not in parents:
-                    parent_id = parent = None
-                    if i > 0:
-                        parent = '/'.join(path[:i])
-                        parent_id = parents[parent]['id']
-                    parents[curr_path] = {
-                        'id': cnt,
-                        'title': path[i],
-                        'parent': parent,
-                        'parent_id': parent_id,
-                        'display': display,
-                        'is_dir': (i != len(path) - 1),
-                        'path': curr_path,
-                        'lines': {'covered': 0, 'total': 0, 'percent': '-'},
-                        'funcs': {'covered': 0, 'total': 0, 'percent': '-'}
-                    }
-                    if display:
-                        cur_parent = parents[curr_path]
-                        while cur_parent:
-                            cur_parent['display'] = True
-                            cur_parent = parents.get(cur_parent['parent'])
-
-        for fname in coverage:
-            display = False
-            if not hide_all and any(fname.endswith(x) for x in ['.i', '.c', '.c.aux']):
-                display = True
-            covered_lines = coverage[fname].covered_lines
-            total_lines = coverage[fname].total_lines
-            covered_funcs = coverage[fname].covered_funcs
-            total_funcs = coverage[fname].total_funcs
-            parent = fname
-            while parent is not None:
-                parents[parent]['lines']['covered'] += covered_lines
-                parents[parent]['lines']['total'] += total_lines
-                parents[parent]['funcs']['covered'] += covered_funcs
-                parents[parent]['funcs']['total'] += total_funcs
-                if parents[parent]['is_dir'] and display or parents[parent]['parent'] is None and not hide_all:
-                    parents[parent]['display'] = True
-                parent = parents[parent]['parent']
-
-        for fname in parents:
-            if parents[fname]['lines']['total'] > 0:
-                div = parents[fname]['lines']['covered'] / parents[fname]['lines']['total']
-                parents[fname]['lines']['percent'] = '%s%%' % round(100 * div, 2)
-                color_id = int(div * len(TABLE_STAT_COLOR))
-                if color_id >= len(TABLE_STAT_COLOR):
-                    color_id = len(TABLE_STAT_COLOR) - 1
-                elif color_id < 0:
-                    color_id = 0
-                parents[fname]['lines']['color'] = TABLE_STAT_COLOR[color_id]
-            if parents[fname]['funcs']['total'] > 0:
-                div = parents[fname]['funcs']['covered'] / parents[fname]['funcs']['total']
-                parents[fname]['funcs']['percent'] = '%s%%' % round(100 * div, 2)
-                color_id = int(div * len(TABLE_STAT_COLOR))
-                if color_id >= len(TABLE_STAT_COLOR):
-                    color_id = len(TABLE_STAT_COLOR) - 1
-                elif color_id < 0:
-                    color_id = 0
-                parents[fname]['funcs']['color'] = TABLE_STAT_COLOR[color_id]
-
-        other_data = list(sorted(parents.values(), key=lambda x: (not x['is_dir'], x['title'])))
-
-        def __get_all_children(file_info, depth):
-            children = []
-            if not file_info['is_dir']:
-                return children
-            for fi in other_data:
-                if fi['parent_id'] == file_info['id']:
-                    fi['indent'] = '  ' * depth
-                    children.append(fi)
-                    children.extend(__get_all_children(fi, depth + 1))
-            return children
-
-        root_dirs = set()
-        for path in parents:
-            root_dirs.add(path.split(os.path.sep)[0])
-
-        first_lvl = []
-        for root_name in sorted(root_dirs):
-            if root_name in parents:
-                first_lvl.append(parents[root_name])
-
-        ordered_data = []
-        for fd in first_lvl:
-            if not fd['title'] == 'generated':
-                fd['display'] = True
-            ordered_data.append(fd)
-            ordered_data.extend(__get_all_children(fd, 1))
-        for fd in ordered_data:
-            if fd['title'] == self.cur_page:
-                fd['display'] = True
-        return ordered_data
+        root = get_coverage_root(self.cov_arch)
+        directories = CoverageDirectory.objects.filter(archive=self.cov_arch).exclude(id=root.id)
+        files = CoverageFile.objects.filter(archive=self.cov_arch)
+
+        cur_dirs = set(self.__get_parent_dirs(self.cur_page)) if self.cur_page else set()
+
+        if root.files <= COVERAGE_TREE_MAX_FILES:
+            directories = list(directories.values(*DIRECTORY_FIELDS))
+            files = list(files.values(*FILE_FIELDS))
+            loaded = set(d['id'] for d in directories)
+            dir_ids = dict((d['path'], d['id']) for d in directories)
+            expanded = set(d['id'] for d in directories if d['parent_id'] == root.id or d['path'] in cur_dirs)
+            for f in files:
+                if f['name'].endswith(COVERAGE_TREE_SOURCE_EXT):
+                    expanded |= set(dir_ids[d] for d in self.__get_parent_dirs(f['name']))
+        else:
+            # Only top-level directories and directories of the current file are expanded
+            expanded = set(directories.filter(Q(parent_id=root.id) & ~Q(title=COVERAGE_TREE_GENERATED) |
+                                              Q(path__in=cur_dirs)).values_list('id', flat=True))
+            loaded = expanded
+            directories = list(directories.filter(parent_id__in=expanded | {root.id}).values(*DIRECTORY_FIELDS))
+            files = list(files.filter(directory_id__in=expanded | {root.id}).values(*FILE_FIELDS))
+        return coverage_tree_rows(root.id, root.id, directories, files, expanded, loaded)
+
+    def __get_parent_dirs(self, fname):
+        self.__is_not_used()
+        path = fname.split('/')
+        return list('/'.join(path[:i]) for i in range(1, len(path)))
 
     def __is_not_used(self):
         pass
 
 
+class CoverageDirectoryStatistics:
+    def __init__(self, cov_arch, directory_id):
+        self.cov_arch = cov_arch
+        self.directory = CoverageDirectory.objects.get(archive=cov_arch, id=directory_id)
+        self.table_data = self.__get_table_data()
+
+    def __get_table_data(self):
+        root = get_coverage_root(self.cov_arch)
+        directories = list(CoverageDirectory.objects.filter(archive=self.cov_arch, parent=self.directory)
+                           .values(*DIRECTORY_FIELDS))
+        files = list(CoverageFile.objects.filter(archive=self.cov_arch, directory=self.directory)
+                     .values(*FILE_FIELDS))
+        return coverage_tree_rows(root.id, self.directory.id, directories, files, set(), set())
+
+
 class DataStatistic:
     def __init__(self, cov_arch_id):
         self.table_html = loader.get_template('reports/coverage/coverageDataStatistics.html') \
@@ -592,9 +735,14 @@ class CreateCoverageFiles:
         self._line_coverage = {}
         self._func_coverage = {}
         self._coverage_stat = {}
+        self._data = {}
         self.__get_coverage_data()
+        try:
+            self.__get_data()
+        except Exception as e:
+            logging.warning("Error during filling cached coverage data: ", str(e), exc_info=True)
+            self._data = {}
         self.__create_files()
-        self.files = self.__get_saved_files()
 
     def __get_coverage_data(self):
         for data in self._coverage['line coverage']:
@@ -617,18 +765,62 @@ class CreateCoverageFiles:
                     self._coverage_stat[fname][2] += self.__num_of_lines(data[1][fname])
                 self._coverage_stat[fname][3] += self.__num_of_lines(data[1][fname])
 
+    def __get_data(self):
+        for dataname in self._coverage:
+            if dataname in {'line coverage', 'function coverage'}:
+                continue
+            covdatastat = CoverageDataStatistics(archive=self._cov_arch, name=dataname)
+            covdatastat.data.save('CoverageData.html', NewFile(StringIO(
+                json_to_html(self._coverage[dataname]['statistics'])
+            )))
+
+            # Each distinct value is converted to html only once
+            values_html = {}
+            for data in self._coverage[dataname]['values']:
+                data_key = json.dumps(data[0], sort_keys=True)
+                if data_key not in values_html:
+                    dataval = json_to_html(data[0])
+                    values_html[data_key] = (hashlib.md5(dataval.encode('utf8')).hexdigest(), dataval)
+            data_values = self.__get_data_values(dataname, dict(values_html.values()))
+
+            for data in self._coverage[dataname]['values']:
+                data_id = data_values[values_html[json.dumps(data[0], sort_keys=True)][0]]
+                for fname in data[1]:
+                    if fname not in self._data:
+                        self._data[fname] = []
+                    for first, last in lines_ranges(data[1][fname]):
+                        self._data[fname].append((first, last, data_id))
+
+    def __get_data_values(self, dataname, values):
+        data_values = {}
+        hashsums = list(values)
+        for i in range(0, len(hashsums), 1000):
+            data_values.update(CoverageDataValue.objects.filter(name=dataname, hashsum__in=hashsums[i:i + 1000])
+                               .values_list('hashsum', 'id'))
+        new_values = list(hashsum for hashsum in values if hashsum not in data_values)
+        CoverageDataValue.objects.bulk_create(list(
+            CoverageDataValue(hashsum=hashsum, name=dataname, value=values[hashsum]) for hashsum in new_values
+        ))
+        for i in range(0, len(new_values), 1000):
+            data_values.update(CoverageDataValue.objects.filter(name=dataname, hashsum__in=new_values[i:i + 1000])
+                               .values_list('hashsum', 'id'))
+        return data_values
+
     @transaction.atomic
     def __create_files(self):
-        for fname in set(self._line_coverage) | set(self._func_coverage):
-            file_coverage = StringIO(json.dumps(
-                [self._line_coverage.get(fname, []), self._func_coverage.get(fname, [])]
+        files_stat = dict((fname, self._coverage_stat.get(fname, [0, 0, 0, 0]))
+                          for fname in set(self._line_coverage) | set(self._func_coverage) | set(self._data))
+        dir_ids = CreateCoverageTree(self._cov_arch, files_stat).directories
+        covfiles = []
+        for fname, stat in files_stat.items():
+            covfiles.append(CoverageFile(
+                archive=self._cov_arch, name=fname, directory_id=dir_ids[file_directory(fname)],
+                covered_lines=stat[0], total_lines=stat[1], covered_funcs=stat[2], total_funcs=stat[3],
+                lines=pack_coverage(coverage_ranges(self._line_coverage.get(fname, []))),
+                functions=pack_coverage(coverage_ranges(self._func_coverage.get(fname, []))),
+                data=pack_coverage(self._data.get(fname, []))
             ))
-            covfile = CoverageFile(
-                archive=self._cov_arch, name=fname,
-                covered_lines=self._coverage_stat[fname][0], total_lines=self._coverage_stat[fname][1],
-                covered_funcs=self._coverage_stat[fname][2], total_funcs=self._coverage_stat[fname][3]
-            )
-            covfile.file.save(COVERAGE_FILE, NewFile(file_coverage))
+        CoverageFile.objects.bulk_create(covfiles, batch_size=1000)
 
     def __num_of_lines(self, lines):
         self.__is_not_used()
@@ -641,12 +833,6 @@ class CreateCoverageFiles:
                 num += l[1] - l[0] + 1
         return num
 
-    def __get_saved_files(self):
-        files = {}
-        for f_id, fname in CoverageFile.objects.filter(archive=self._cov_arch).values_list('id', 'name'):
-            files[fname] = f_id
-        return files
-
     def __is_not_used(self):
         pass
 
@@ -654,14 +840,7 @@ class CreateCoverageFiles:
 class FillCoverageCache:
     def __init__(self, report):
         for cov_arch, data in self.__get_coverage_data(report):
-            self._data = data
-            self._cov_arch = cov_arch
-            self._files = CreateCoverageFiles(self._cov_arch, self._data).files
-            del self._data['line coverage'], self._data['function coverage']
-            try:
-                self.__fill_data()
-            except Exception as e:
-                logging.warning("Error during filling cached coverage data: ", str(e), exc_info=True)
+            CreateCoverageFiles(cov_arch, data)
 
     def __get_coverage_data(self, report):
         self.__is_not_used()
@@ -670,36 +849,5 @@ class FillCoverageCache:
                 with zipfile.ZipFile(fp, 'r') as zfp:
                     yield cov_arch, json.loads(zfp.read(COVERAGE_FILE).decode('utf8', errors='ignore'))
 
-    def __fill_data(self):
-        covdata = []
-        data_values = {}
-        for vid, dataname, hashsum in CoverageDataValue.objects.values_list('id', 'name', 'hashsum'):
-            data_values[(dataname, hashsum)] = vid
-
-        for dataname in self._data:
-            covdatastat = CoverageDataStatistics(archive=self._cov_arch, name=dataname)
-            covdatastat.data.save('CoverageData.html', NewFile(StringIO(
-                json_to_html(self._data[dataname]['statistics'])
-            )))
-            for data in self._data[dataname]['values']:
-                dataval = json_to_html(data[0])
-                hashsum = hashlib.md5(dataval.encode('utf8')).hexdigest()
-                if (dataname, hashsum) not in data_values:
-                    data_values[(dataname, hashsum)] = CoverageDataValue.objects \
-                        .create(hashsum=hashsum, name=dataname, value=dataval).id
-                data_id = data_values[(dataname, hashsum)]
-                for fname in data[1]:
-                    if fname not in self._files:
-                        self._files[fname] = CoverageFile.objects.create(archive=self._cov_arch, name=fname).id
-                    for line in data[1][fname]:
-                        if isinstance(line, int):
-                            covdata.append(CoverageData(covfile_id=self._files[fname], line=line, data_id=data_id))
-                        elif isinstance(line, list) and len(line) == 2:
-                            for i in range(*line):
-                                covdata.append(CoverageData(covfile_id=self._files[fname], line=i, data_id=data_id))
-                            covdata.append(CoverageData(covfile_id=self._files[fname], line=line[1], data_id=data_id))
-
-        CoverageData.objects.bulk_create(covdata)
-
     def __is_not_used(self):
         pass
@@ -19,6 +19,7 @@
 # limitations under the License.
 #
 
+import hashlib
 import json
 import os
 import re
@@ -26,6 +27,8 @@ import tempfile
 import uuid
 import zipfile
 
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
 from django.template.loader import render_to_string
 from pycparser import c_parser, c_generator, c_ast
 from sympy import sympify, symbols
@@ -57,6 +60,15 @@ THREAD_COLORS = [
     '#5f54cb', '#85ff47', '#69c8ff', '#ff5de5', '#dfa720', '#0b67bf', '#fa92ff', '#57bfa8', '#bf425a', '#7d909e'
 ]
 
+# Name of Django cache for rendered error traces (default cache is used if it is not configured).
+RENDERED_TRACES_CACHE = 'rendered_traces'
+# Version of rendered error traces, it should be increased on each change of their format.
+RENDERED_TRACES_VERSION = 1
+# Attributes of GetETV, which are cached for each error trace and user options.
+RENDERED_TRACE_ATTRIBUTES = (
+    'data', 'type', 'warnings', 'lines', 'err_trace_nodes', 'threads', 'html_trace', 'assumes', 'attributes'
+)
+
 
 class ScopeInfo:
     def __init__(self, cnt, thread_id):
@@ -538,6 +550,34 @@ class ParseErrorTrace:
         pass
 
 
+def rendered_traces_cache():
+    try:
+        return caches[RENDERED_TRACES_CACHE]
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def error_trace_checksum(error_trace: str) -> str:
+    return hashlib.sha256(error_trace.encode('utf8')).hexdigest()
+
+
+def render_cache_key(checksum: str, assumptions: bool, triangles: bool) -> str:
+    return 'etv:{}:{}:{:d}:{:d}'.format(RENDERED_TRACES_VERSION, checksum, bool(assumptions), bool(triangles))
+
+
+def witness_cache_key(checksum: str) -> str:
+    # Processed correctness witness does not depend on user options
+    return 'etv:{}:witness:{}'.format(RENDERED_TRACES_VERSION, checksum)
+
+
+def get_witness_lines(error_trace: str) -> dict:
+    # Highlighted lines of source code for correctness witness
+    witness = rendered_traces_cache().get(witness_cache_key(error_trace_checksum(error_trace)))
+    if witness is not None:
+        return witness['lines']
+    return GetETV(error_trace).lines
+
+
 class GetETV:
     def __init__(self, error_trace, user=None):
         if user:
@@ -546,18 +586,35 @@ class GetETV:
         else:
             self.include_assumptions = False
             self.triangles = False
+
+        # Error traces are addressed by their content, so edited error traces get new cache entries
+        checksum = error_trace_checksum(error_trace)
+        cache = rendered_traces_cache()
+        render_key = render_cache_key(checksum, self.include_assumptions, self.triangles)
+        rendered = cache.get(render_key)
+        if rendered is not None:
+            for name in RENDERED_TRACE_ATTRIBUTES:
+                setattr(self, name, rendered[name])
+            return
+
         self.data = json.loads(error_trace)
 
         self.type = self.data.get('type')
         self.warnings = self.data.get('warnings', [])
         self.lines = dict()
         if self.type == "correctness":
-            self.__process_correctness_witness()
+            witness = cache.get(witness_cache_key(checksum))
+            if witness is not None:
+                self.data, self.lines = witness['data'], witness['lines']
+            else:
+                self.__process_correctness_witness()
+                cache.set(witness_cache_key(checksum), {'data': self.data, 'lines': self.lines})
         self.err_trace_nodes = len(self.data['edges'])
         self.threads = []
         self._has_global = True
         self.html_trace, self.assumes = self.__html_trace()
         self.attributes = []
+        cache.set(render_key, dict((name, getattr(self, name)) for name in RENDERED_TRACE_ATTRIBUTES))
 
     @staticmethod
     def __get_invariants(inv_str):
@@ -1079,48 +1136,174 @@ class ArchiveFileContent:
                 return zfp.read(self._name)
 
 
+class HighlightSource:
+    # Highlights escaped lines of C source code in one pass, the state of comments and strings is kept between lines
+    code_re = re.compile(r'//|/\*|[\'"]')
+    number_re = re.compile(r'(?<=\W)\d+(?=\W)')
+    word_re = re.compile(r'[a-zA-Z0-9\-_#]+')
+    key1_words = set(KEY1_WORDS)
+    key2_words = set(KEY2_WORDS)
+
+    def __init__(self, lines):
+        self.is_comment = False
+        self.text_quote = None
+        self.lines = list(self.__highlight_line(line) for line in lines)
+
+    def __highlight_line(self, line):
+        result = []
+        pos = 0
+        while True:
+            if self.is_comment:
+                end = line.find('*/', pos)
+                if end < 0:
+                    result.append(self.__wrap(line[pos:], 'comment'))
+                    break
+                self.is_comment = False
+                result.append(self.__wrap(line[pos:end + 2], 'comment'))
+                pos = end + 2
+            elif self.text_quote:
+                end = self.__text_end(line, pos)
+                if end < 0:
+                    result.append(self.__wrap(line[pos:], 'text'))
+                    break
+                self.text_quote = None
+                result.append(self.__wrap(line[pos:end], 'text'))
+                pos = end
+            m = self.code_re.search(line, pos)
+            if m is None:
+                result.append(self.__highlight_code(line[pos:]))
+                break
+            result.append(self.__highlight_code(line[pos:m.start()]))
+            if m.group(0) == '//':
+                result.append(self.__wrap(line[m.start():], 'comment'))
+                break
+            if m.group(0) == '/*':
+                self.is_comment = True
+                end = line.find('*/', m.end())
+                if end < 0:
+                    result.append(self.__wrap(line[m.start():], 'comment'))
+                    break
+                self.is_comment = False
+                result.append(self.__wrap(line[m.start():end + 2], 'comment'))
+                pos = end + 2
+            else:
+                self.text_quote = m.group(0)
+                end = self.__text_end(line, m.end())
+                if end < 0:
+                    result.append(self.__wrap(line[m.start():], 'text'))
+                    break
+                self.text_quote = None
+                result.append(self.__wrap(line[m.start():end], 'text'))
+                pos = end
+        return ''.join(result)
+
+    def __text_end(self, line, pos):
+        # Position after the closing quote or -1
+        escaped = False
+        for i in range(pos, len(line)):
+            if escaped:
+                escaped = False
+            elif line[i] == '\\':
+                escaped = True
+            elif line[i] == self.text_quote:
+                return i + 1
+        return -1
+
+    def __highlight_code(self, code):
+        if not code:
+            return code
+        result = []
+        pos = 0
+        for m in self.number_re.finditer(code):
+            result.append(self.word_re.sub(self.__highlight_word, code[pos:m.start()]))
+            result.append(self.__wrap(m.group(0), 'number'))
+            pos = m.end()
+        result.append(self.word_re.sub(self.__highlight_word, code[pos:]))
+        return ''.join(result)
+
+    def __highlight_word(self, m):
+        word = m.group(0)
+        if word in self.key1_words:
+            return self.__wrap(word, 'key1')
+        if word in self.key2_words:
+            return self.__wrap(word, 'key2')
+        return word
+
+    def __wrap(self, text, text_type):
+        self.__is_not_used()
+        return '<span class="%s">%s</span>' % (SOURCE_CLASSES[text_type], text)
+
+    def __is_not_used(self):
+        pass
+
+
 class GetSource:
     def __init__(self, report, file_name, lines=dict(), edges=list()):
         if report:
             self.report = report
         else:
             self.report = None
-        self.is_comment = False
-        self.is_text = False
-        self.text_quote = None
         self.__lines = lines
         self.edges = edges
+        self.__edges_index = self.__get_edges_index()
         self.data = self.__get_source(file_name)
 
-    def __get_source(self, file_name):
-        data = ''
+    def __get_edges_index(self):
+        # Not taken conditions for each source line, so edges are not filtered for each line
+        edges_index = dict()
+        for edge in self.edges:
+            if edge['condition']:
+                continue
+            edge_lines = {edge['start line']}
+            if 'end line' in edge:
+                edge_lines.add(edge['end line'])
+            for line in edge_lines:
+                edges_index.setdefault(line, []).append(edge)
+        return edges_index
+
+    def __get_source_content(self, file_name):
         if self.report:
             if file_name.startswith('/'):
                 file_name = file_name[1:]
             try:
-                source_content = ArchiveFileContent(self.report.source, 'archive',
-                                                    file_name).content.decode('utf8',
-                                                                              errors="ignore")
+                return ArchiveFileContent(self.report.source, 'archive', file_name).content.decode(
+                    'utf8', errors="ignore")
             except Exception as e:
                 raise Exception(
                     "Error while extracting source from archive: %(error)s" % {'error': str(e)})
-        else:
-            if os.path.exists(file_name):
-                with open(file_name, encoding="utf8", errors='ignore') as fd:
-                    source_content = fd.read()
-            else:
-                source_content = ""
-        cnt = 1
-        lines = source_content.split('\n')
-        for line in lines:
-            line = line.replace('\t', ' ' * TAB_LENGTH).replace('&', '&amp;').replace('<', '&lt;'). \
-                replace('>', '&gt;')
+        if os.path.exists(file_name):
+            with open(file_name, encoding="utf8", errors='ignore') as fd:
+                return fd.read()
+        return ""
+
+    def __get_escaped_lines(self, file_name):
+        return list(
+            line.replace('\t', ' ' * TAB_LENGTH).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+            for line in self.__get_source_content(file_name).split('\n')
+        )
+
+    def __get_highlighted_lines(self, file_name):
+        # Highlighted source files do not depend on error traces, so they are cached for each sources archive
+        cache = key = None
+        if self.report:
+            source = self.report.source
+            cache = rendered_traces_cache()
+            key = 'etv:{}:src:{}:{}'.format(RENDERED_TRACES_VERSION, source.id, hashlib.md5(
+                '{}:{}'.format(source.archive.name, file_name).encode('utf8')).hexdigest())
+            highlighted = cache.get(key)
+            if highlighted is not None:
+                return highlighted
+        highlighted = HighlightSource(self.__get_escaped_lines(file_name)).lines
+        if cache is not None:
+            cache.set(key, highlighted)
+        return highlighted
+
+    def __get_source(self, file_name):
+        data = []
+        lines = self.__get_highlighted_lines(file_name)
+        escaped_lines = None
+        for cnt, parsed_line in enumerate(lines, start=1):
             line_num = ' ' * (len(str(len(lines))) - len(str(cnt))) + str(cnt)
-            parsed_line = self.__parse_line(line)
-            cur_edges = list(filter(
-                lambda edge: (edge['start line'] == int(line_num) or
-                              'end line' in edge and edge['end line'] == int(line_num)) and
-                             not edge['condition'], self.edges))
             if cnt in self.__lines:
                 val = self.__lines[cnt]
                 if len(val) == 1:
@@ -1129,104 +1312,30 @@ class GetSource:
                 else:
                     # color = '#adffadaa'
                     color = '#70dc70'
-                    if cur_edges:
-                        for cur_edge in cur_edges:
-                            src = cur_edge['source']
-                            if src[0] == '!':
-                                src = self.__parse_line(src)
-                                src = src[2:-1]
-                            elif ' == 0' in src and line.find(src) == -1:
-                                src = src.replace(' == 0', '')
-                                src = self.__parse_line(src)
-                            else:
-                                src = self.__parse_line(src)
-                            parsed_line = parsed_line.replace(src,
-                                                              "<span style=\"background-color: {}\">{}</span>".format(
-                                                                  '#dc7070', src))
+                    for cur_edge in self.__edges_index.get(cnt, []):
+                        src = cur_edge['source']
+                        if escaped_lines is None:
+                            escaped_lines = self.__get_escaped_lines(file_name)
+                        if src[0] == '!':
+                            src = self.__parse_line(src)
+                            src = src[2:-1]
+                        elif ' == 0' in src and escaped_lines[cnt - 1].find(src) == -1:
+                            src = src.replace(' == 0', '')
+                            src = self.__parse_line(src)
+                        else:
+                            src = self.__parse_line(src)
+                        parsed_line = parsed_line.replace(src,
+                                                          "<span style=\"background-color: {}\">{}</span>".format(
+                                                              '#dc7070', src))
                     parsed_line = "<span style=\"background-color: {}\">{}</span>".format(color,
                                                                                           parsed_line)
-            src_line = '%s %s' % (
-                self.__wrap_line(line_num, 'line', 'ETVSrcL_%s' % cnt), parsed_line)
-            data += '<span>%s</span><br>' % src_line
-            cnt += 1
-        return data
+            data.append('<span>%s %s</span><br>' % (self.__wrap_line(line_num, 'line', 'ETVSrcL_%s' % cnt),
+                                                    parsed_line))
+        return ''.join(data)
 
     def __parse_line(self, line):
-        if self.is_comment:
-            m = re.match('(.*?)\*/(.*)', line)
-            if m is None:
-                return self.__wrap_line(line, 'comment')
-            self.is_comment = False
-            new_line = self.__wrap_line(m.group(1) + '*/', 'comment')
-            return new_line + self.__parse_line(m.group(2))
-
-        if self.is_text:
-            before, after = self.__parse_text(line)
-            if after is None:
-                return self.__wrap_line(before, 'text')
-            self.is_text = False
-            return self.__wrap_line(before, 'text') + self.__parse_line(after)
-
-        m = re.match('(.*?)//(.*)', line)
-        if m is not None and m.group(1).find('"') == -1 and m.group(1).find("'") == -1:
-            new_line = self.__parse_line(m.group(1))
-            new_line += self.__wrap_line('//' + m.group(2), 'comment')
-            return new_line
-        m = re.match('(.*?)/\*(.*)', line)
-        if m is not None and m.group(1).find('"') == -1 and m.group(1).find("'") == -1:
-            new_line = self.__parse_line(m.group(1))
-            self.is_comment = True
-            new_line += self.__parse_line('/*' + m.group(2))
-            return new_line
-
-        m = re.match('(.*?)([\'\"])(.*)', line)
-        if m is not None:
-            new_line = self.__parse_line(m.group(1))
-            self.text_quote = m.group(2)
-            before, after = self.__parse_text(m.group(3))
-            new_line += self.__wrap_line(self.text_quote + before, 'text')
-            if after is None:
-                self.is_text = True
-                return new_line
-            self.is_text = False
-            return new_line + self.__parse_line(after)
-
-        m = re.match("(.*\W)(\d+)(\W.*)", line)
-        if m is not None:
-            new_line = self.__parse_line(m.group(1))
-            new_line += self.__wrap_line(m.group(2), 'number')
-            new_line += self.__parse_line(m.group(3))
-            return new_line
-        words = re.split('([^a-zA-Z0-9-_#])', line)
-        new_words = []
-        for word in words:
-            if word in KEY1_WORDS:
-                new_words.append(self.__wrap_line(word, 'key1'))
-            elif word in KEY2_WORDS:
-                new_words.append(self.__wrap_line(word, 'key2'))
-            else:
-                new_words.append(word)
-        return ''.join(new_words)
-
-    def __parse_text(self, text):
-        escaped = False
-        before = ''
-        after = ''
-        end_found = False
-        for c in text:
-            if end_found:
-                after += c
-                continue
-            if not escaped and c == self.text_quote:
-                end_found = True
-            elif escaped:
-                escaped = False
-            elif c == '\\':
-                escaped = True
-            before += c
-        if end_found:
-            return before, after
-        return before, None
+        self.__is_not_used()
+        return HighlightSource([line]).lines[0]
 
     def __wrap_line(self, line, text_type, line_id=None):
         self.__is_not_used()
@@ -1285,9 +1394,9 @@ def save_zip_trace(zip_trace_name: str, etv, src, assumptions):
 def convert_json_trace_to_html(json_trace: str, result_trace_name: str):
     src = dict()
     etv = GetETV(json_trace)
+    cond_edges = list(filter(lambda edge: 'condition' in edge, etv.data['edges']))
     for file in etv.data['files']:
         file_prep = re.sub(r'[^A-Za-z0-9_]+', '', str(file))
-        cond_edges = list(filter(lambda edge: 'condition' in edge, etv.data['edges']))
         cnt = GetSource(None, file, etv.lines, cond_edges).data
         src[file_prep] = cnt
     save_zip_trace(result_trace_name, etv, src, False)
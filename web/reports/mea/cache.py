@@ -0,0 +1,142 @@
+#
+# CVV is a continuous verification visualizer.
+# Copyright (c) 2019-2023 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Two-level cache of converted error traces: bounded LRU in the current process, which is backed by
+Django cache framework (shared between processes).
+Converted error traces are stored as JSON strings, since callers may change loaded error traces.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+
+# Name of Django cache for converted error traces (default cache is used if it is not configured).
+CONVERTED_TRACES_CACHE = 'converted_traces'
+# Key of the current version of converted error traces in the shared cache.
+CONVERTED_TRACES_VERSION_KEY = 'cet:version'
+
+
+class ConvertedTracesLRU:
+    """
+    Least recently used converted error traces, which total size is limited by max_size characters.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.__traces = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: str):
+        with self.__lock:
+            value = self.__traces.get(key)
+            if value is not None:
+                self.__traces.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        if len(value) > self.max_size:
+            return
+        with self.__lock:
+            if key in self.__traces:
+                self.size -= len(self.__traces.pop(key))
+            self.__traces[key] = value
+            self.size += len(value)
+            while self.size > self.max_size:
+                self.size -= len(self.__traces.popitem(last=False)[1])
+
+    def clear(self):
+        with self.__lock:
+            self.__traces.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self.__traces)
+
+
+converted_traces_lru = ConvertedTracesLRU(getattr(settings, 'CONVERTED_TRACES_CACHE_SIZE', 0))
+
+
+def __shared_cache():
+    try:
+        return caches[CONVERTED_TRACES_CACHE]
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def __shared_version(cache) -> int:
+    version = cache.get(CONVERTED_TRACES_VERSION_KEY)
+    if version is None:
+        version = 1
+        cache.add(CONVERTED_TRACES_VERSION_KEY, version, timeout=None)
+    return version
+
+
+def converted_trace_key(unsafe, conversion_function: str, args_str: str) -> str:
+    """
+    Key of converted error trace of unsafe report. Unique trace identifier is used in addition to report id,
+    so converted error traces of deleted reports can not be taken for new ones.
+    """
+    args_hash = hashlib.md5('{}:{}'.format(conversion_function, args_str).encode('utf8')).hexdigest()
+    return 'cet:{}:{}:{}'.format(unsafe.id, unsafe.trace_id, args_hash)
+
+
+def pattern_key(converted) -> str:
+    """
+    Key of converted error trace from ConvertedTraces table (e.g., edited error trace of mark).
+    Such files are addressed by their content, so they are never changed.
+    """
+    return 'cet:file:{}'.format(converted.hash_sum)
+
+
+def get_cached_trace(key: str):
+    """
+    Get converted error trace (JSON string) from the cache, returns None if it is not cached.
+    """
+    value = converted_traces_lru.get(key)
+    if value is None:
+        cache = __shared_cache()
+        value = cache.get(key, version=__shared_version(cache))
+        if value is not None:
+            converted_traces_lru.set(key, value)
+    return value
+
+
+def set_cached_trace(key: str, value: str):
+    converted_traces_lru.set(key, value)
+    cache = __shared_cache()
+    cache.set(key, value, version=__shared_version(cache))
+
+
+def clear_cached_traces():
+    """
+    Invalidate all cached converted error traces. Shared cache is invalidated by changing its version.
+    Other processes keep their in-process caches, which is safe, since converted error trace depends only
+    on error trace, conversion function and its arguments.
+    """
+    converted_traces_lru.clear()
+    cache = __shared_cache()
+    try:
+        cache.incr(CONVERTED_TRACES_VERSION_KEY)
+    except ValueError:
+        cache.set(CONVERTED_TRACES_VERSION_KEY, 2, timeout=None)
@@ -0,0 +1,162 @@
+#
+# CVV is a continuous verification visualizer.
+# Copyright (c) 2019-2023 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Clustering of error traces of any number of compared roots in a single pass.
+"""
+
+import json
+
+from reports.mea.core import compare_error_traces, is_equivalent
+from reports.mea.index import compute_fingerprint, may_be_equivalent
+
+
+class DisjointSets:
+    """
+    Union-find structure with path compression and union by size.
+    """
+
+    def __init__(self):
+        self.__parent = {}
+        self.__size = {}
+
+    def add(self, x):
+        if x not in self.__parent:
+            self.__parent[x] = x
+            self.__size[x] = 1
+
+    def find(self, x):
+        root = x
+        while self.__parent[root] != root:
+            root = self.__parent[root]
+        while self.__parent[x] != root:
+            self.__parent[x], x = root, self.__parent[x]
+        return root
+
+    def union(self, x, y):
+        x = self.find(x)
+        y = self.find(y)
+        if x == y:
+            return x
+        if self.__size[x] < self.__size[y]:
+            x, y = y, x
+        self.__parent[y] = x
+        self.__size[x] += self.__size[y]
+        return x
+
+
+class ErrorTracesClustering:
+    """
+    Divide error traces of compared roots into clusters of equivalent error traces.
+    Groups are given for each root as a dictionary {<attributes>: <report ids>}, only error traces with
+    the same attributes can be equivalent. Each error trace is converted and fingerprinted only once,
+    fingerprints are used to skip comparison of error traces that can not be equivalent.
+    Error traces of each root are clustered greedily in order of report ids (each new error trace joins
+    the first equivalent cluster), then clusters of each root are merged with the first equivalent cluster
+    of previous roots, which was not merged with this root yet.
+    Resulting clusters of each root are stored in self.clusters as a list of tuples
+    (<attributes>, <sorted report ids>, <component>). Clusters with the same component are equivalent,
+    self.components contains indexes of roots for each component.
+    """
+
+    def __init__(self, groups: list, get_trace, comparison_function: str, similarity_threshold: int):
+        self.__get_trace = get_trace
+        self.__comparison_function = comparison_function
+        self.__similarity_threshold = similarity_threshold
+        self.__traces = {}
+        self.__fingerprints = {}
+        self.__sets = DisjointSets()
+        self.clusters = []
+        self.components = []
+        self.__cluster(groups)
+
+    def __load(self, report_id):
+        converted_error_trace = self.__get_trace(report_id)
+        if isinstance(converted_error_trace, str):
+            converted_error_trace = json.loads(converted_error_trace)
+        self.__traces[report_id] = converted_error_trace
+        self.__fingerprints[report_id] = compute_fingerprint(converted_error_trace, normalize=False)
+
+    def __forget(self, report_id):
+        # Only error traces of the first reports of clusters are compared later
+        del self.__traces[report_id]
+        del self.__fingerprints[report_id]
+
+    def __is_equal(self, report_id_1, report_id_2) -> bool:
+        if not may_be_equivalent(self.__fingerprints[report_id_1], self.__fingerprints[report_id_2],
+                                 self.__comparison_function, self.__similarity_threshold):
+            return False
+        similarity = compare_error_traces(self.__traces[report_id_1], self.__traces[report_id_2],
+                                          self.__comparison_function)
+        return bool(is_equivalent(similarity, self.__similarity_threshold))
+
+    def __cluster_root(self, report_ids) -> list:
+        leaders = []
+        for report_id in sorted(report_ids):
+            self.__load(report_id)
+            self.__sets.add(report_id)
+            for leader in leaders:
+                if self.__is_equal(report_id, leader):
+                    self.__sets.union(leader, report_id)
+                    self.__forget(report_id)
+                    break
+            else:
+                leaders.append(report_id)
+        return leaders
+
+    def __cluster(self, groups: list):
+        # First report of the first cluster of each component for each attributes
+        components_leaders = {}
+        component_by_leader = {}
+        for root_index, group in enumerate(groups):
+            root_clusters = []
+            for attrs, report_ids in group.items():
+                leaders = self.__cluster_root(report_ids)
+                previous_leaders = components_leaders.setdefault(attrs, [])
+                merged = {}
+                for component_leader in previous_leaders:
+                    for leader in leaders:
+                        if leader not in merged and self.__is_equal(component_leader, leader):
+                            merged[leader] = component_leader
+                            self.__sets.union(component_leader, leader)
+                            break
+                for leader in leaders:
+                    if leader in merged:
+                        component = component_by_leader[merged[leader]]
+                    else:
+                        component = len(self.components)
+                        component_by_leader[leader] = component
+                        previous_leaders.append(leader)
+                        self.components.append(set())
+                    self.components[component].add(root_index)
+                    root_clusters.append([attrs, leader, component])
+            self.clusters.append(root_clusters)
+
+        # Reports of each cluster are its reports from the same root, which are in the same set
+        reports = {}
+        for root_index, group in enumerate(groups):
+            for report_ids in group.values():
+                for report_id in report_ids:
+                    reports.setdefault((root_index, self.__sets.find(report_id)), []).append(report_id)
+        for root_index, root_clusters in enumerate(self.clusters):
+            self.clusters[root_index] = list(
+                (attrs, sorted(reports[(root_index, self.__sets.find(leader))]), component)
+                for attrs, leader, component in root_clusters
+            )
+        self.__traces.clear()
+        self.__fingerprints.clear()
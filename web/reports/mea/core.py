@@ -142,6 +142,25 @@ def compare_error_traces(edited_error_trace: list, compared_error_trace: list,
     return __get_similarity_coefficient(et1_threaded, et2_threaded, equal_threads)
 
 
+def get_threads(converted_error_trace: list) -> dict:
+    """
+    Split converted error trace into threads (tuples of compared elements) in the same way as
+    compare_error_traces does it.
+    """
+    return __transform_to_threads(converted_error_trace, [])[0]
+
+
+def get_similarity_coefficient(threads_1: int, threads_2: int, common_threads: int) -> float:
+    """
+    Similarity coefficient for error traces with the given number of threads and common threads.
+    """
+    common_threads = min(common_threads, threads_1, threads_2)
+    diff_elements = threads_1 + threads_2 - common_threads
+    if diff_elements:
+        return round(common_threads / diff_elements, 2)
+    return 0.0
+
+
 # noinspection PyUnusedLocal
 def __convert_call_tree_filter(error_trace: dict, args: dict = None) -> list:
     # pylint: disable=unused-argument
@@ -541,7 +560,4 @@ def __compare_include_partial_ordered(edited_error_trace: dict, compared_error_t
 def __get_similarity_coefficient(et_threaded_1: dict, et_threaded_2: dict, common_elements: int) \
         -> float:
     # Currently represented only as Jaccard index.
-    diff_elements = len(et_threaded_1) + len(et_threaded_2) - common_elements
-    if diff_elements:
-        return round(common_elements / diff_elements, 2)
-    return 0.0
+    return get_similarity_coefficient(len(et_threaded_1), len(et_threaded_2), common_elements)
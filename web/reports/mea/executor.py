@@ -0,0 +1,107 @@
+#
+# CVV is a continuous verification visualizer.
+# Copyright (c) 2019-2023 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Executor, which compares edited error traces of marks with converted error traces of unsafes
+in several processes.
+"""
+
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+
+from web.vars import UNKNOWN_ERROR
+
+# Number of compared pairs (unsafe, mark), which are sent to a worker at once.
+COMPARISON_CHUNK_SIZE = 200
+# Maximum number of chunks in the queue for each worker (limits memory for loaded error traces).
+COMPARISON_CHUNKS_PER_WORKER = 2
+
+# Edited error traces, which are passed to each worker process only once.
+__edited_error_traces = {}
+
+
+def __set_edited_error_traces(edited_error_traces: dict):
+    global __edited_error_traces
+    __edited_error_traces = edited_error_traces
+
+
+def __init_worker(edited_error_traces: dict):
+    # Workers are started from a clean process, so models can be imported only after Django setup
+    django.setup()
+    __set_edited_error_traces(edited_error_traces)
+
+
+def __get_context():
+    # Processes must not be forked from the current one, since it can have other threads (e.g. caches
+    # recalculation or threaded web server), which hold locks at the moment of fork.
+    for method in ('forkserver', 'spawn'):
+        if method in multiprocessing.get_all_start_methods():
+            return multiprocessing.get_context(method)
+    return None
+
+
+def __compare_chunk(compared_error_traces: dict, pairs: list) -> list:
+    from reports.mea.wrapper import compare_edited_traces
+    from web.utils import logger, BridgeException
+
+    results = []
+    for unsafe_id, mark_id, key in pairs:
+        edited_error_trace, comparison_function, similarity_threshold = __edited_error_traces[mark_id]
+        try:
+            is_equal, similarity = compare_edited_traces(edited_error_trace, compared_error_traces[key],
+                                                         comparison_function, similarity_threshold)
+            results.append((unsafe_id, mark_id, bool(is_equal), similarity, None))
+        except BridgeException as e:
+            results.append((unsafe_id, mark_id, False, 0, str(e)))
+        except Exception as e:
+            logger.exception("Error traces comparison failed: %s" % e, exc_info=e)
+            results.append((unsafe_id, mark_id, False, 0, str(UNKNOWN_ERROR)))
+    return results
+
+
+def compare_error_traces_pairs(edited_error_traces: dict, chunks, workers: int = 1):
+    """
+    Compare edited error traces {<mark id>: (<edited error trace>, <comparison function>, <similarity threshold>)}
+    with converted error traces of unsafes. Each chunk is a tuple ({<key>: <converted error trace>},
+    [(<unsafe id>, <mark id>, <key>)]). Yields list of results (<unsafe id>, <mark id>, <is equal>,
+    <similarity>, <error>) for each chunk in the same order.
+    Workers are started by fork server (or spawned), so it is safe to call it from any thread. Each worker
+    sets up Django by itself. If only 1 worker is required, comparison is performed in the current process.
+    """
+    mp_context = __get_context()
+    if workers <= 1 or mp_context is None:
+        __set_edited_error_traces(edited_error_traces)
+        try:
+            for compared_error_traces, pairs in chunks:
+                yield __compare_chunk(compared_error_traces, pairs)
+        finally:
+            __set_edited_error_traces({})
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context,
+                             initializer=__init_worker, initargs=(edited_error_traces,)) as executor:
+        futures = deque()
+        for compared_error_traces, pairs in chunks:
+            futures.append(executor.submit(__compare_chunk, compared_error_traces, pairs))
+            if len(futures) >= workers * COMPARISON_CHUNKS_PER_WORKER:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
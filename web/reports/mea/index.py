@@ -0,0 +1,207 @@
+#
+# CVV is a continuous verification visualizer.
+# Copyright (c) 2019-2023 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Index of converted error traces fingerprints, which is used to skip comparison of error traces that
+can not be equivalent.
+"""
+
+import hashlib
+import json
+import re
+
+from marks.models import ErrorTraceFingerprint, EditedTraceFingerprint
+from reports.mea.core import *
+from reports.mea.wrapper import get_or_convert_error_trace, process_args, error_trace_pretty_parse, \
+    error_trace_pretty_print
+
+# Fingerprint tags.
+FP_THREADS = "threads"
+FP_THREAD_HASH = "hash"
+FP_THREAD_STRICT = "strict"
+FP_THREAD_ELEMENTS = "elements"
+FP_THREAD_NGRAMS = "ngrams"
+
+# Size of call n-grams.
+NGRAM_SIZE = 2
+
+# Comparison functions, for which contiguous parts of threads are compared.
+SUBLIST_COMPARISON_FUNCTIONS = {COMPARISON_FUNCTION_INCLUDE, COMPARISON_FUNCTION_INCLUDE_WITH_ERROR}
+# Comparison functions, for which each element of edited thread must be presented in compared thread.
+ELEMENTS_COMPARISON_FUNCTIONS = SUBLIST_COMPARISON_FUNCTIONS | {
+    COMPARISON_FUNCTION_INCLUDE_PARTIAL, COMPARISON_FUNCTION_INCLUDE_PARTIAL_ORDERED
+}
+
+
+def __canonical(elem: tuple) -> tuple:
+    # Equal elements must have equal hashes (e.g. True == 1 for compared tuples)
+    return tuple(float(x) if isinstance(x, (int, float)) else x for x in elem)
+
+
+def __hash(value) -> int:
+    return int.from_bytes(hashlib.blake2b(repr(value).encode('utf8'), digest_size=4).digest(), 'big')
+
+
+def __is_strict(thread: tuple) -> bool:
+    # Threads of calls are compared as joined strings, which are aligned by elements only for identifiers.
+    return all(len(elem) == 2 and elem[0] in {CET_OP_CALL, CET_OP_RETURN} and re.fullmatch(r'\w+', str(elem[1]))
+               for elem in thread)
+
+
+def compute_fingerprint(converted_error_trace, normalize: bool = True) -> dict:
+    """
+    Create fingerprint of converted error trace. Compared error traces (unlike edited ones) are normalized
+    before comparison, so the same should be done for their fingerprints.
+    """
+    if isinstance(converted_error_trace, str):
+        converted_error_trace = json.loads(converted_error_trace)
+    if normalize:
+        converted_error_trace = error_trace_pretty_parse(error_trace_pretty_print(converted_error_trace))
+    threads = []
+    for thread in get_threads(converted_error_trace).values():
+        strict = __is_strict(thread)
+        thread = tuple(__canonical(elem) for elem in thread)
+        ngrams = set(__hash(thread[i:i + NGRAM_SIZE]) for i in range(len(thread) - NGRAM_SIZE + 1))
+        threads.append({
+            FP_THREAD_HASH: __hash(thread),
+            FP_THREAD_STRICT: strict,
+            FP_THREAD_ELEMENTS: sorted(set(__hash(elem) for elem in thread)),
+            FP_THREAD_NGRAMS: sorted(ngrams)
+        })
+    return {FP_THREADS: threads}
+
+
+def __can_include(thread_1: dict, thread_2: dict, comparison_function: str) -> bool:
+    if comparison_function == COMPARISON_FUNCTION_EQUAL:
+        return thread_1[FP_THREAD_HASH] == thread_2[FP_THREAD_HASH]
+    if comparison_function in ELEMENTS_COMPARISON_FUNCTIONS:
+        if comparison_function in SUBLIST_COMPARISON_FUNCTIONS and \
+                not (thread_1[FP_THREAD_STRICT] and thread_2[FP_THREAD_STRICT]):
+            return True
+        if not set(thread_1[FP_THREAD_ELEMENTS]).issubset(thread_2[FP_THREAD_ELEMENTS]):
+            return False
+        if comparison_function in SUBLIST_COMPARISON_FUNCTIONS:
+            return set(thread_1[FP_THREAD_NGRAMS]).issubset(thread_2[FP_THREAD_NGRAMS])
+    return True
+
+
+def max_similarity(edited_fingerprint: dict, compared_fingerprint: dict, comparison_function: str) -> float:
+    """
+    Upper bound of similarity coefficient which compare_error_traces can return for error traces
+    with given fingerprints.
+    """
+    threads_1 = edited_fingerprint[FP_THREADS]
+    threads_2 = compared_fingerprint[FP_THREADS]
+    if not threads_1 and not threads_2:
+        return 1.0
+    if comparison_function in ELEMENTS_COMPARISON_FUNCTIONS | {COMPARISON_FUNCTION_EQUAL}:
+        matched_1 = set()
+        matched_2 = set()
+        for i, thread_1 in enumerate(threads_1):
+            for j, thread_2 in enumerate(threads_2):
+                if __can_include(thread_1, thread_2, comparison_function):
+                    matched_1.add(i)
+                    matched_2.add(j)
+        common = min(len(matched_1), len(matched_2))
+    else:
+        common = min(len(threads_1), len(threads_2))
+    return get_similarity_coefficient(len(threads_1), len(threads_2), common)
+
+
+def may_be_equivalent(edited_fingerprint: dict, compared_fingerprint: dict, comparison_function: str,
+                      similarity_threshold: int) -> bool:
+    """
+    Returns false only if error traces with given fingerprints can not be equivalent.
+    """
+    if edited_fingerprint is None or compared_fingerprint is None:
+        return True
+    return bool(is_equivalent(max_similarity(edited_fingerprint, compared_fingerprint, comparison_function),
+                              similarity_threshold))
+
+
+def __args_str(args: dict) -> str:
+    args = dict(args) if args else {}
+    process_args(args)
+    return json.dumps(args, sort_keys=True)
+
+
+def __load_fingerprint(obj) -> dict:
+    return {FP_THREADS: json.loads(obj.threads_data)}
+
+
+def __create_fingerprint(unsafe, conversion_function: str, args: dict, args_str: str) -> ErrorTraceFingerprint:
+    fingerprint = compute_fingerprint(get_or_convert_error_trace(unsafe, conversion_function, dict(args or {})))
+    return ErrorTraceFingerprint(
+        unsafe_id=unsafe.id, function=conversion_function, args=args_str, threads=len(fingerprint[FP_THREADS]),
+        threads_data=json.dumps(fingerprint[FP_THREADS])
+    )
+
+
+def get_fingerprints(unsafes, conversion_function: str, args: dict) -> dict:
+    """
+    Get fingerprints of converted error traces for the list of unsafes. Missed fingerprints are created.
+    Returns dictionary {<unsafe id>: <fingerprint>}, unsafes with broken error traces are absent.
+    """
+    args_str = __args_str(args)
+    fingerprints = {}
+    for obj in ErrorTraceFingerprint.objects.filter(
+            unsafe_id__in=list(u.id for u in unsafes), function=conversion_function, args=args_str):
+        fingerprints[obj.unsafe_id] = __load_fingerprint(obj)
+    new_fingerprints = []
+    for unsafe in unsafes:
+        if unsafe.id in fingerprints:
+            continue
+        try:
+            obj = __create_fingerprint(unsafe, conversion_function, args, args_str)
+        except Exception:
+            # Such error traces will be compared as usual to get the error
+            continue
+        new_fingerprints.append(obj)
+        fingerprints[unsafe.id] = __load_fingerprint(obj)
+    ErrorTraceFingerprint.objects.bulk_create(new_fingerprints)
+    return fingerprints
+
+
+def get_fingerprint(unsafe, conversion_function: str, args: dict):
+    return get_fingerprints([unsafe], conversion_function, args).get(unsafe.id)
+
+
+def get_edited_fingerprints(edited_error_traces: dict) -> dict:
+    """
+    Get fingerprints of edited error traces of marks by dictionary {<ConvertedTraces id>: <edited error trace>}.
+    Edited error traces are not changed after saving, so their fingerprints are created only once.
+    Returns dictionary {<ConvertedTraces id>: <fingerprint>}, broken edited error traces are absent.
+    """
+    fingerprints = {}
+    for obj in EditedTraceFingerprint.objects.filter(trace_id__in=list(edited_error_traces)):
+        fingerprints[obj.trace_id] = __load_fingerprint(obj)
+    new_fingerprints = []
+    for trace_id, edited_error_trace in edited_error_traces.items():
+        if trace_id in fingerprints:
+            continue
+        try:
+            fingerprint = compute_fingerprint(edited_error_trace, normalize=False)
+        except Exception:
+            # Edited error trace will be compared with each unsafe as usual.
+            continue
+        new_fingerprints.append(EditedTraceFingerprint(trace_id=trace_id,
+                                                       threads_data=json.dumps(fingerprint[FP_THREADS])))
+        fingerprints[trace_id] = fingerprint
+    # Fingerprint could be created by parallel upload of the same edited error trace
+    EditedTraceFingerprint.objects.bulk_create(new_fingerprints, ignore_conflicts=True)
+    return fingerprints
@@ -24,6 +24,7 @@ from io import BytesIO
 
 import reports
 from marks.models import ErrorTraceConvertionCache, ConvertedTraces, MarkUnsafe, MarkUnsafeReport
+from reports.mea.cache import converted_trace_key, pattern_key, get_cached_trace, set_cached_trace
 from reports.mea.core import *
 from reports.models import ReportUnsafe
 from web.utils import ArchiveFileContent, BridgeException, file_get_or_create
@@ -106,6 +107,10 @@ def get_or_convert_error_trace(unsafe, conversion_function: str, args: dict) ->
         return convert_error_trace(parsed_trace, conversion_function, args)
 
     if not DISABLE_CACHE:
+        cache_key = converted_trace_key(report_unsafe, conversion_function, args_str)
+        converted_error_trace = get_cached_trace(cache_key)
+        if converted_error_trace is not None:
+            return converted_error_trace
         try:
             with ErrorTraceConvertionCache.objects.filter(
                     unsafe=report_unsafe, function=conversion_function, args=args_str).last().converted.file as fp:
@@ -117,6 +122,9 @@ def get_or_convert_error_trace(unsafe, conversion_function: str, args: dict) ->
             et_file = dump_converted_error_trace(converted_error_trace)
             ErrorTraceConvertionCache.objects.create(unsafe=report_unsafe, function=conversion_function, converted=et_file,
                                                      args=args_str)
+            set_cached_trace(cache_key, json.dumps(converted_error_trace, sort_keys=True))
+        else:
+            set_cached_trace(cache_key, converted_error_trace)
     else:
         converted_error_trace = apply_new_conversion_function()
     return converted_error_trace
@@ -184,6 +192,10 @@ def get_or_convert_error_trace_auto(unsafe_id: int, conversion_function: str, ar
         return convert_error_trace(parsed_trace, conversion_function, args)
 
     if not DISABLE_CACHE:
+        cache_key = converted_trace_key(report_unsafe, conversion_function, args_str)
+        converted_error_trace = get_cached_trace(cache_key)
+        if converted_error_trace is not None:
+            return converted_error_trace
         try:
             with ErrorTraceConvertionCache.objects.filter(
                     unsafe=report_unsafe, function=conversion_function, args=args_str).last().converted.file as fp:
@@ -194,6 +206,7 @@ def get_or_convert_error_trace_auto(unsafe_id: int, conversion_function: str, ar
             converted_error_trace = json.dumps(converted_error_trace)
             ErrorTraceConvertionCache.objects.create(unsafe=report_unsafe, function=conversion_function,
                                                      converted=et_file, args=args_str)
+        set_cached_trace(cache_key, converted_error_trace)
     else:
         converted_error_trace = convert_error_trace_auto()
         converted_error_trace = json.dumps(converted_error_trace)
@@ -408,6 +421,22 @@ def error_trace_pretty_parse(pretty_error_trace: str) -> list:
     return converted_error_trace
 
 
+def get_converted_traces(converted_ids) -> dict:
+    """
+    Load converted error traces (JSON strings) from ConvertedTraces table by their ids.
+    """
+    converted_error_traces = {}
+    for converted in ConvertedTraces.objects.filter(id__in=set(converted_ids)):
+        cache_key = pattern_key(converted)
+        converted_error_trace = get_cached_trace(cache_key)
+        if converted_error_trace is None:
+            with converted.file as fp:
+                converted_error_trace = fp.read().decode('utf8')
+            set_cached_trace(cache_key, converted_error_trace)
+        converted_error_traces[converted.id] = converted_error_trace
+    return converted_error_traces
+
+
 def dump_converted_error_trace(converted_error_trace):
     """
     Print converted error trace into file.
@@ -25,13 +25,19 @@ import time
 from django.contrib.auth.models import User
 from django.core.files import File
 from django.db import models
+from django.db.models import Value, QuerySet, DEFERRED
+from django.db.models.functions import Concat, Substr
 from django.db.models.signals import pre_delete
 from django.dispatch.dispatcher import receiver
 from django.utils.timezone import now
 
 from jobs.models import Job
+from tools.files import blob_storage
 from web.utils import RemoveFilesBeforeDelete, logger
-from web.vars import UNSAFE_VERDICTS, SAFE_VERDICTS
+from web.vars import UNSAFE_VERDICTS, SAFE_VERDICTS, COMPARISON_CATEGORY
+
+
+REPORT_PATH_SEP = '/'
 
 
 def get_component_path(instance, filename):
@@ -67,6 +73,14 @@ def reportroot_delete_signal(**kwargs):
     logger.info('Deleting ReportRoot files took %s seconds.' % (time.time() - t1))
 
 
+def __is_deleted_with_root(kwargs):
+    # Files of all reports are released by the root before its deletion
+    origin = kwargs.get('origin')
+    if isinstance(origin, QuerySet):
+        return origin.model in {Job, ReportRoot}
+    return isinstance(origin, (Job, ReportRoot))
+
+
 class AttrName(models.Model):
     name = models.CharField(max_length=63, unique=True, db_index=True)
 
@@ -80,13 +94,63 @@ class Attr(models.Model):
 
     class Meta:
         db_table = 'attr'
-        index_together = ["name", "value"]
+        unique_together = ["name", "value"]
+
+
+class ReportQuerySet(models.QuerySet):
+    def ancestors(self, report):
+        return self.filter(id__in=report.ancestors_ids)
+
+    def descendants(self, report):
+        return self.filter(path__startswith=report.children_path)
 
 
 class Report(models.Model):
     root = models.ForeignKey(ReportRoot, models.CASCADE)
     parent = models.ForeignKey('self', models.CASCADE, null=True, related_name='children')
     identifier = models.CharField(max_length=255, unique=True)
+    # Identifiers of all ancestors from the top one to the parent, e.g. "/1/5/23/"
+    path = models.CharField(max_length=255, default=REPORT_PATH_SEP, db_index=True)
+
+    objects = ReportQuerySet.as_manager()
+
+    @property
+    def ancestors_ids(self):
+        return list(int(x) for x in self.path.split(REPORT_PATH_SEP) if x)
+
+    @property
+    def children_path(self):
+        return '%s%s%s' % (self.path, self.id, REPORT_PATH_SEP)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        report = super().from_db(db, field_names, values)
+        report._saved_parent_id = report.__dict__.get('parent_id', DEFERRED)
+        return report
+
+    def save(self, *args, **kwargs):
+        # Path is changed only for new reports and reports moved to another parent
+        old_children_path = None
+        if self.__is_moved():
+            if not self._state.adding:
+                old_children_path = self.children_path
+            # Parent instance is loaded only if it wasn't cached yet
+            self.path = self.parent.children_path if self.parent_id is not None else REPORT_PATH_SEP
+        super().save(*args, **kwargs)
+        self._saved_parent_id = self.parent_id
+        if old_children_path is not None and old_children_path != self.children_path:
+            # The report was moved, so paths of all its descendants are changed too
+            Report.objects.filter(path__startswith=old_children_path).update(path=Concat(
+                Value(self.children_path), Substr('path', len(old_children_path) + 1)
+            ))
+
+    def __is_moved(self):
+        if self._state.adding:
+            return True
+        # Deferred parent can't be changed without setting it
+        if 'parent_id' not in self.__dict__:
+            return False
+        return self.parent_id != getattr(self, '_saved_parent_id', DEFERRED)
 
     class Meta:
         db_table = 'report'
@@ -94,7 +158,7 @@ class Report(models.Model):
 
 class AttrFile(models.Model):
     root = models.ForeignKey(ReportRoot, models.CASCADE)
-    file = models.FileField(upload_to=get_attr_data_path)
+    file = models.FileField(upload_to=get_attr_data_path, storage=blob_storage)
 
     class Meta:
         db_table = 'report_attr_file'
@@ -102,6 +166,8 @@ class AttrFile(models.Model):
 
 @receiver(pre_delete, sender=AttrFile)
 def attrfile_delete_signal(**kwargs):
+    if __is_deleted_with_root(kwargs):
+        return
     source = kwargs['instance']
     source.file.storage.delete(source.file.path)
 
@@ -119,6 +185,8 @@ class ReportAttr(models.Model):
 
 class Computer(models.Model):
     description = models.TextField()
+    # Descriptions are too long for unique indexes, so computers are unique by sha256 of the description
+    hash_sum = models.CharField(max_length=64, unique=True)
 
     class Meta:
         db_table = 'computer'
@@ -143,10 +211,10 @@ class ReportComponent(Report):
     memory = models.BigIntegerField(null=True)
     start_date = models.DateTimeField()
     finish_date = models.DateTimeField(null=True)
-    log = models.FileField(upload_to=get_component_path, null=True)
+    log = models.FileField(upload_to=get_component_path, null=True, storage=blob_storage)
     covnum = models.PositiveSmallIntegerField(default=0)
-    verifier_input = models.FileField(upload_to=get_component_path, null=True)
-    data = models.FileField(upload_to=get_component_path, null=True)
+    verifier_input = models.FileField(upload_to=get_component_path, null=True, storage=blob_storage)
+    data = models.FileField(upload_to=get_component_path, null=True, storage=blob_storage)
 
     def new_data(self, fname, fp, save=False):
         self.data.save(fname, File(fp), save)
@@ -163,6 +231,8 @@ class ReportComponent(Report):
 
 @receiver(pre_delete, sender=ReportComponent)
 def report_component_delete_signal(**kwargs):
+    if __is_deleted_with_root(kwargs):
+        return
     report = kwargs['instance']
     if report.log:
         report.log.storage.delete(report.log.path)
@@ -175,7 +245,7 @@ def report_component_delete_signal(**kwargs):
 class CoverageArchive(models.Model):
     report = models.ForeignKey(ReportComponent, models.CASCADE, related_name='coverages')
     identifier = models.CharField(max_length=128, default='')
-    archive = models.FileField(upload_to=get_coverage_arch_dir)
+    archive = models.FileField(upload_to=get_coverage_arch_dir, storage=blob_storage)
     lines_percent = models.FloatField(default=0.0)
     functions_percent = models.FloatField(default=0.0)
 
@@ -188,13 +258,15 @@ class CoverageArchive(models.Model):
 
 @receiver(pre_delete, sender=CoverageArchive)
 def coverage_archive_delete_signal(**kwargs):
+    if __is_deleted_with_root(kwargs):
+        return
     arch = kwargs['instance']
     arch.archive.storage.delete(arch.archive.path)
 
 
 class ErrorTraceSource(models.Model):
     root = models.ForeignKey(ReportRoot, models.CASCADE)
-    archive = models.FileField(upload_to='Unsafes/Sources/%Y/%m')
+    archive = models.FileField(upload_to='Unsafes/Sources/%Y/%m', storage=blob_storage)
 
     def add_sources(self, fname, fp, save=False):
         self.archive.save(fname, File(fp), save)
@@ -205,13 +277,15 @@ class ErrorTraceSource(models.Model):
 
 @receiver(pre_delete, sender=ErrorTraceSource)
 def source_delete_signal(**kwargs):
+    if __is_deleted_with_root(kwargs):
+        return
     source = kwargs['instance']
     source.archive.storage.delete(source.archive.path)
 
 
 class ReportUnsafe(Report):
     trace_id = models.CharField(max_length=32, unique=True, db_index=True)
-    error_trace = models.FileField(upload_to='Unsafes/%Y/%m')
+    error_trace = models.FileField(upload_to='Unsafes/%Y/%m', storage=blob_storage)
     source = models.ForeignKey(ErrorTraceSource, models.CASCADE)
     verdict = models.CharField(max_length=1, choices=UNSAFE_VERDICTS, default='5')
     memory = models.BigIntegerField()
@@ -228,12 +302,14 @@ class ReportUnsafe(Report):
 
 @receiver(pre_delete, sender=ReportUnsafe)
 def unsafe_delete_signal(**kwargs):
+    if __is_deleted_with_root(kwargs):
+        return
     unsafe = kwargs['instance']
     unsafe.error_trace.storage.delete(unsafe.error_trace.path)
 
 
 class ReportSafe(Report):
-    proof = models.FileField(upload_to='Safes/%Y/%m', null=True)
+    proof = models.FileField(upload_to='Safes/%Y/%m', null=True, storage=blob_storage)
     source = models.ForeignKey(ErrorTraceSource, models.CASCADE, null=True)
     verdict = models.CharField(max_length=1, choices=SAFE_VERDICTS, default='4')
     memory = models.BigIntegerField()
@@ -250,6 +326,8 @@ class ReportSafe(Report):
 
 @receiver(pre_delete, sender=ReportSafe)
 def safe_delete_signal(**kwargs):
+    if __is_deleted_with_root(kwargs):
+        return
     safe = kwargs['instance']
     if safe.proof:
         safe.proof.storage.delete(safe.proof.path)
@@ -257,7 +335,7 @@ def safe_delete_signal(**kwargs):
 
 class ReportUnknown(Report):
     component = models.ForeignKey(Component, models.PROTECT)
-    problem_description = models.FileField(upload_to='Unknowns/%Y/%m')
+    problem_description = models.FileField(upload_to='Unknowns/%Y/%m', storage=blob_storage)
     memory = models.BigIntegerField(null=True)
     cpu_time = models.BigIntegerField(null=True)
     wall_time = models.BigIntegerField(null=True)
@@ -271,6 +349,8 @@ class ReportUnknown(Report):
 
 @receiver(pre_delete, sender=ReportUnknown)
 def unknown_delete_signal(**kwargs):
+    if __is_deleted_with_root(kwargs):
+        return
     unknown = kwargs['instance']
     unknown.problem_description.storage.delete(unknown.problem_description.path)
 
@@ -327,14 +407,83 @@ class ComponentInstances(models.Model):
         db_table = 'cache_report_component_instances'
 
 
+class DirtyReport(models.Model):
+    # Component report, which subtree was changed after the last recalculation of its caches
+    report = models.OneToOneField(ReportComponent, models.CASCADE, related_name='+')
+    root = models.ForeignKey(ReportRoot, models.CASCADE, related_name='+')
+
+    class Meta:
+        db_table = 'cache_dirty_report'
+
+
+def mark_reports_dirty(reports):
+    # Caches of subtrees of component reports will be recalculated by "dirty" recalculation,
+    # subtrees of parents are recalculated for leaves
+    DirtyReport.objects.bulk_create(list(
+        DirtyReport(report_id=report.id if isinstance(report, ReportComponent) else report.parent_id,
+                    root_id=report.root_id) for report in reports if report is not None
+    ), ignore_conflicts=True)
+
+
+class ComparisonSnapshot(models.Model):
+    root1 = models.ForeignKey(ReportRoot, models.CASCADE, related_name='+')
+    root2 = models.ForeignKey(ReportRoot, models.CASCADE, related_name='+')
+    # Hash of comparison arguments
+    options = models.CharField(max_length=32)
+    # Numbers of reports and marks associations of both roots, which were compared (see get_comparison_state)
+    state = models.CharField(max_length=255)
+    date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'cache_report_comparison'
+        unique_together = ['root1', 'root2', 'options']
+
+
+class ComparisonSnapshotLeaf(models.Model):
+    snapshot = models.ForeignKey(ComparisonSnapshot, models.CASCADE, related_name='leaves')
+    report = models.ForeignKey(ReportUnsafe, models.CASCADE, related_name='+')
+    cluster = models.PositiveIntegerField()
+    category = models.CharField(max_length=1, choices=COMPARISON_CATEGORY)
+    # The first report of cluster represents it in tables
+    representative = models.BooleanField(default=False)
+
+    class Meta:
+        db_table = 'cache_report_comparison_leaf'
+        index_together = ['snapshot', 'category']
+
+
+class CoverageDirectory(models.Model):
+    archive = models.ForeignKey(CoverageArchive, models.CASCADE)
+    # Root directory of the archive has null path and parent
+    path = models.CharField(max_length=1024, null=True)
+    parent = models.ForeignKey('self', models.CASCADE, null=True, related_name='children')
+    title = models.CharField(max_length=1024)
+    depth = models.PositiveIntegerField(default=0)
+    covered_lines = models.PositiveIntegerField(default=0)
+    covered_funcs = models.PositiveIntegerField(default=0)
+    total_lines = models.PositiveIntegerField(default=0)
+    total_funcs = models.PositiveIntegerField(default=0)
+    # Number of files in the directory and its subdirectories
+    files = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'cache_report_coverage_directory'
+        index_together = ['archive', 'parent']
+
+
 class CoverageFile(models.Model):
     archive = models.ForeignKey(CoverageArchive, models.CASCADE)
+    directory = models.ForeignKey(CoverageDirectory, models.CASCADE, null=True)
     name = models.CharField(max_length=1024)
     file = models.FileField(upload_to=get_coverage_dir, null=True)
     covered_lines = models.PositiveIntegerField(default=0)
     covered_funcs = models.PositiveIntegerField(default=0)
     total_lines = models.PositiveIntegerField(default=0)
     total_funcs = models.PositiveIntegerField(default=0)
+    # Packed coverage (see reports.coverage.pack_coverage), file is used only by old caches.
+    lines = models.BinaryField(null=True)
+    functions = models.BinaryField(null=True)
+    data = models.BinaryField(null=True)
 
     class Meta:
         db_table = 'cache_report_coverage_file'
@@ -342,6 +491,8 @@ class CoverageFile(models.Model):
 
 @receiver(pre_delete, sender=CoverageFile)
 def coverage_file_delete_signal(**kwargs):
+    if __is_deleted_with_root(kwargs):
+        return
     covfile = kwargs['instance']
     if covfile.file:
         covfile.file.storage.delete(covfile.file.path)
@@ -376,6 +527,8 @@ class CoverageDataStatistics(models.Model):
 
 @receiver(pre_delete, sender=CoverageDataStatistics)
 def coverage_data_stat_delete_signal(**kwargs):
+    if __is_deleted_with_root(kwargs):
+        return
     covdatastat = kwargs['instance']
     covdatastat.data.storage.delete(covdatastat.data.path)
 
@@ -25,7 +25,7 @@ from django.utils.functional import cached_property
 from marks.models import MarkSafeReport, MarkUnsafeReport, MarkUnknownReport, SafeTag, UnsafeTag, \
     SafeReportTag, UnsafeReportTag, UnknownProblem
 from reports.models import Component, Report, ReportSafe, ReportUnsafe, ReportUnknown, ReportComponentLeaf, \
-    ReportAttr, Attr, AttrName
+    ReportAttr, Attr, AttrName, ComparisonSnapshotLeaf
 from web.rawQuery import RawQuery, EmptyQuery
 from web.utils import logger
 from web.vars import ASSOCIATION_TYPE
@@ -352,6 +352,19 @@ class LeavesQuery:
         if self.model != ReportUnknown and self.kwargs.get('confirmed', False):
             self.sql.where('{0} = %s', 'has_confirmed', args_list=[True])
 
+    def __filter_by_comparison(self):
+        # Only representatives of clusters from the given category of jobs comparison snapshot
+        if self.model != ReportUnsafe or self.kwargs.get('comparison') is None:
+            return
+        snapshot, category = self.kwargs['comparison']
+        subquery = RawQuery(ComparisonSnapshotLeaf)
+        subquery.select('report_id')
+        subquery.where('{0} = %s', 'snapshot_id', args_list=[snapshot.id])
+        subquery.where('{0} = %s', 'category', args_list=[category])
+        subquery.where('{0} = %s', 'representative', args_list=[True])
+        subquery.group_by('report_id')
+        self.sql.join('INNER', subquery, 'report_id', 'id', table_to=Report)
+
     def __get_tags(self, tags_string):
         tags_model = SafeTag if self.model == ReportSafe else UnsafeTag
         view_tags = set(x.strip() for x in tags_string.split(';'))
@@ -385,6 +398,7 @@ class LeavesQuery:
         self.__process_component()
         self.__process_problems()
         self.__filter_by_has_confirmed()
+        self.__filter_by_comparison()
 
     def get_objects(self):
         if self._objects is None:
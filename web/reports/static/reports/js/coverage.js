@@ -71,6 +71,27 @@ $(document).ready(function () {
                 $(this).removeClass('open');
                 tr.removeClass('tg-expanded');
             }
+            else if (tr.attr('data-tg-lazy') === '1') {
+                // Children of directory are loaded only on its first expanding
+                var expander = $(this), shift = event.shiftKey || with_shift;
+                tr.removeAttr('data-tg-lazy');
+                $.ajax({
+                    method: 'post',
+                    url: '/reports/get-coverage-dir/' + $('#cov_arch_id').val() + '/',
+                    dataType: 'json',
+                    data: {directory: tr_id},
+                    success: function(data) {
+                        if (data.error) {
+                            tr.attr('data-tg-lazy', '1');
+                            err_notify(data.error);
+                            return false;
+                        }
+                        tr.after(data['rows']);
+                        expander.trigger("click", [shift, rec]);
+                    }
+                });
+                return;
+            }
             else {
                 table.find('tr[data-tg-parent="' + tr_id + '"]').show();
                 $(this).addClass('open');
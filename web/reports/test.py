@@ -22,19 +22,42 @@
 import json
 import os
 import random
+import tempfile
 import time
+import zipfile
+from datetime import timedelta
 from io import BytesIO
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.db.models import Q
+from django.db import connection, transaction, IntegrityError
 from django.test import Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.timezone import now
 
 from jobs.models import Job
+from marks.models import MarkUnsafe, MarkUnsafeReport, MarkUnknown, MarkUnknownReport, UnknownProblem, \
+    MarkUnsafeReview
+from reports.comparison import get_comparison_state
+from reports.coverage import CreateCoverageFiles, CoverageStatistics, CoverageDirectoryStatistics, pack_coverage, \
+    unpack_coverage, coverage_ranges, expand_coverage, COVERAGE_TREE_MAX_FILES
 from reports.models import ReportSafe, ReportUnsafe, ReportUnknown, ReportComponent, CoverageArchive, \
-    CoverageFile, ReportAttr
-from users.models import User
+    CoverageFile, ReportAttr, ReportRoot, Component, Computer, ComponentInstances, ComponentResource, \
+    ReportComponentLeaf, Report, CoverageDataValue, CoverageDirectory, ErrorTraceSource
+from reports.UploadReport import UploadReportsBatch, CheckErrorTraces, get_computer
+from reports.utils import UnsafesTable
+from reports.etv import GetETV, GetSource, HighlightSource, get_witness_lines, rendered_traces_cache, \
+    render_cache_key, error_trace_checksum, RENDERED_TRACE_ATTRIBUTES
+from reports.mea.cache import ConvertedTracesLRU, converted_traces_lru, get_cached_trace, set_cached_trace, \
+    clear_cached_traces
+from reports.mea.clustering import DisjointSets, ErrorTracesClustering
+from reports.mea.executor import compare_error_traces_pairs
+from tools.models import FileReference
+from tools.utils import RecalculateReportsPaths
+from users.models import User, Extended
 from web.populate import populate_users
 from web.utils import CVTestCase
 from web.vars import JOB_STATUS, FORMAT
@@ -419,6 +442,15 @@ class TestReports(CVTestCase):
         self.assertNotIn('error', res)
         self.assertEqual(set(res), {'content', 'data', 'legend'})
 
+        # Get statistics of coverage directory
+        self.assertIsNotNone(cfile.directory)
+        response = self.client.post('/reports/get-coverage-dir/%s/' % carch.id, {'directory': cfile.directory_id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        res = json.loads(str(response.content, encoding='utf8'))
+        self.assertNotIn('error', res)
+        self.assertIn('data-path="%s"' % cfile.name, res['rows'])
+
     def test_upload_reports(self):
         self.job = Job.objects.order_by('parent').first()
         if self.job is None:
@@ -1209,3 +1241,503 @@ class DecideJobs:
 
     def __is_not_used(self):
         pass
+
+
+def create_decided_job(identifier):
+    job = Job.objects.create(identifier=identifier, name=identifier, change_date=now(), status=JOB_STATUS[2][0])
+    root = ReportRoot.objects.create(job=job)
+    core = ReportComponent.objects.create(
+        root=root, identifier=identifier + '/', component=Component.objects.get_or_create(name='Core')[0],
+        computer=get_computer(identifier), start_date=now()
+    )
+    ComponentInstances.objects.create(report=core, component=core.component, in_progress=1, total=1)
+    return job, root, core
+
+
+def zip_archive(name, content=b'{}'):
+    buf = BytesIO()
+    with zipfile.ZipFile(buf, mode='w') as zfp:
+        zfp.writestr(name, content)
+    return SimpleUploadedFile(name + '.zip', buf.getvalue())
+
+
+class TestReportsBatch(CVTestCase):
+    def setUp(self):
+        super().setUp()
+        self.job, self.root, self.core = create_decided_job('batch_job')
+
+    def __archives(self):
+        return {'log.zip': zip_archive('log.txt', b'log'), 'desc.zip': zip_archive('problem desc.txt', b'Fail')}
+
+    def test_batch(self):
+        reports = [
+            {'type': 'verification', 'id': '/v1', 'parent id': '/', 'name': 'RP', 'log': 'log.zip',
+             'attrs': [{'name': 'Requirement', 'value': 'mutex'}],
+             'resources': {'CPU time': 10, 'wall time': 20, 'memory size': 30}},
+            {'type': 'verification', 'id': '/v2', 'parent id': '/', 'name': 'RP',
+             'attrs': [{'name': 'Requirement', 'value': 'spin'}],
+             'resources': {'CPU time': 1, 'wall time': 2, 'memory size': 300}},
+            {'type': 'safe', 'id': '/v1/safe', 'parent id': '/v1', 'attrs': []},
+            {'type': 'unknown', 'id': '/v2/unknown', 'parent id': '/v2', 'problem desc': 'desc.zip'},
+            {'type': 'verification finish', 'id': '/v1'},
+            {'type': 'verification finish', 'id': '/v2'}
+        ]
+        self.assertIsNone(UploadReportsBatch(self.job, reports, self.__archives()).error)
+        self.assertEqual(ReportComponent.objects.filter(root=self.root, verification=True, finish_date=None).count(), 0)
+        self.assertEqual(ReportSafe.objects.get(root=self.root).cpu_time, 10)
+        self.assertEqual(ReportUnknown.objects.filter(root=self.root).count(), 1)
+        self.assertEqual(ReportComponentLeaf.objects.filter(report=self.core).count(), 2)
+
+        resources = ComponentResource.objects.get(report=self.core, component__name='RP')
+        self.assertEqual((resources.cpu_time, resources.wall_time, resources.memory), (11, 22, 300))
+        instances = ComponentInstances.objects.get(report=self.core, component__name='RP')
+        self.assertEqual((instances.in_progress, instances.total), (0, 2))
+
+        # Reports with the same identifiers are rejected
+        self.assertIsNotNone(UploadReportsBatch(self.job, reports[2:3], self.__archives()).error)
+
+    def test_failed_batch(self):
+        reports = [
+            {'type': 'verification', 'id': '/v1', 'parent id': '/', 'name': 'RP', 'log': 'log.zip', 'attrs': [],
+             'resources': {'CPU time': 10, 'wall time': 20, 'memory size': 30}},
+            {'type': 'unknown', 'id': '/v2/unknown', 'parent id': '/v2', 'problem desc': 'desc.zip'}
+        ]
+        self.assertIsNotNone(UploadReportsBatch(self.job, reports, self.__archives()).error)
+        self.assertFalse(ReportComponent.objects.filter(root=self.root, verification=True).exists())
+        self.assertFalse(ComponentResource.objects.filter(report=self.core).exists())
+
+        # Saved log archive is released
+        self.assertEqual(list(FileReference.objects.values_list('refs', flat=True)), [0])
+
+    def test_computers(self):
+        comp = [{'node name': 'node'}, {'cpus': 4}]
+        reports = [
+            {'type': 'verification', 'id': '/v%s' % i, 'parent id': '/', 'name': 'RP', 'attrs': [], 'comp': comp,
+             'resources': {'CPU time': 10, 'wall time': 20, 'memory size': 30}} for i in range(2)
+        ]
+        self.assertIsNone(UploadReportsBatch(self.job, reports, {}).error)
+        computer = get_computer(json.dumps(comp, ensure_ascii=False, sort_keys=True, indent=4))
+        self.assertEqual(set(ReportComponent.objects.filter(root=self.root, verification=True)
+                             .values_list('computer_id', flat=True)), {computer.id})
+
+        # Computers with the same description can't be created by concurrent uploads
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Computer.objects.create(description=computer.description, hash_sum=computer.hash_sum)
+        self.assertEqual(get_computer(computer.description).id, computer.id)
+        self.assertEqual(Computer.objects.count(), 2)
+
+
+class TestReportsPaths(CVTestCase):
+    def setUp(self):
+        super().setUp()
+        self.job, self.root, self.core = create_decided_job('paths_job')
+
+    def __add_component(self, parent, identifier):
+        return ReportComponent.objects.create(
+            root=self.root, parent=parent, identifier=self.job.identifier + identifier, component=self.core.component,
+            computer=self.core.computer, start_date=now()
+        )
+
+    def __add_safe(self, parent, identifier):
+        return ReportSafe.objects.create(root=self.root, parent=parent, identifier=self.job.identifier + identifier,
+                                         cpu_time=1, wall_time=1, memory=1)
+
+    def test_paths(self):
+        child = self.__add_component(self.core, '/child')
+        safe = self.__add_safe(child, '/child/safe')
+        self.assertEqual(safe.path, '/%s/%s/' % (self.core.id, child.id))
+        self.assertEqual(set(Report.objects.descendants(self.core).values_list('id', flat=True)), {child.id, safe.id})
+        self.assertEqual(set(r.id for r in Report.objects.ancestors(safe)), {self.core.id, child.id})
+
+        # Paths of descendants are changed when the report is moved
+        other = self.__add_component(self.core, '/other')
+        child = ReportComponent.objects.get(id=child.id)
+        child.parent = other
+        child.save()
+        safe.refresh_from_db()
+        self.assertEqual(safe.path, '/%s/%s/%s/' % (self.core.id, other.id, child.id))
+
+        # Parent is not loaded on saving if it was not changed
+        child = ReportComponent.objects.get(id=child.id)
+        with self.assertNumQueries(1):
+            child.save(update_fields=['finish_date'])
+
+        Report.objects.filter(root=self.root).update(path='/')
+        RecalculateReportsPaths([self.root])
+        safe.refresh_from_db()
+        self.assertEqual(safe.path, '/%s/%s/%s/' % (self.core.id, other.id, child.id))
+
+
+def calls_error_trace(*functions, thread='1'):
+    error_trace = []
+    for name in functions:
+        error_trace.append({'op': 'CALL', 'thread': thread, 'source': 'x', 'name': name, 'id': 0, 'line': 1})
+        error_trace.append({'op': 'RET', 'thread': thread, 'source': None, 'name': name, 'id': 0, 'line': 1})
+    return error_trace
+
+
+class TestComparisonExecutor(CVTestCase):
+    def test_workers(self):
+        edited_error_traces = {
+            1: (calls_error_trace('a', 'b'), 'include', 100),
+            2: (calls_error_trace('c'), 'equal', 100)
+        }
+
+        def chunks():
+            for i in range(5):
+                key = 'u%s' % i
+                compared = calls_error_trace('a', 'b', 'c') if i % 2 else calls_error_trace('c')
+                yield {key: compared}, [(i, 1, key), (i, 2, key)]
+
+        results = {}
+        for workers in (1, 2):
+            results[workers] = list(result for chunk_results in compare_error_traces_pairs(
+                edited_error_traces, chunks(), workers
+            ) for result in chunk_results)
+        # Worker processes are started without fork and return results in the same order
+        self.assertEqual(results[1], results[2])
+        self.assertEqual(list((u_id, m_id) for u_id, m_id, is_equal, similarity, error in results[1] if is_equal),
+                         [(0, 2), (1, 1), (2, 2), (3, 1), (4, 2)])
+
+
+class TestConvertedTracesCache(CVTestCase):
+    def tearDown(self):
+        clear_cached_traces()
+        super().tearDown()
+
+    def test_lru(self):
+        lru = ConvertedTracesLRU(10)
+        lru.set('a', '1234')
+        lru.set('b', '1234')
+        self.assertEqual(lru.get('a'), '1234')
+        # The least recently used trace is removed
+        lru.set('c', '1234')
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), ('1234', None, '1234'))
+        self.assertEqual((len(lru), lru.size), (2, 8))
+
+        lru.set('a', '12')
+        self.assertEqual((len(lru), lru.size), (2, 6))
+        lru.set('d', 'x' * 11)
+        self.assertIsNone(lru.get('d'))
+        lru.clear()
+        self.assertEqual((len(lru), lru.size), (0, 0))
+
+    def test_shared(self):
+        set_cached_trace('cet:test', '[1]')
+        converted_traces_lru.clear()
+        # Trace is loaded from the shared cache and is put into the process cache again
+        self.assertEqual(get_cached_trace('cet:test'), '[1]')
+        self.assertEqual(converted_traces_lru.get('cet:test'), '[1]')
+
+        clear_cached_traces()
+        self.assertIsNone(get_cached_trace('cet:test'))
+        set_cached_trace('cet:test', '[2]')
+        converted_traces_lru.clear()
+        self.assertEqual(get_cached_trace('cet:test'), '[2]')
+
+
+class TestCoverageFiles(CVTestCase):
+    def test_packed(self):
+        ranges = [(1, 1, 2), (3, 5, 0), (7, 7, 1 << 40), (8, 8, -1)]
+        self.assertEqual(unpack_coverage(pack_coverage(ranges)), [(1, 1, 2), (3, 5, 0), (7, 7, 0xFFFFFFFF), (8, 8, 0)])
+        self.assertEqual(unpack_coverage(pack_coverage([])), [])
+
+        # Consecutive lines with the same value are joined, later values override earlier ones
+        ranges = coverage_ranges([[2, [1, [3, 5]]], [0, [[6, 8], 4]], [1, [[10, 9]]]])
+        self.assertEqual(ranges, [[1, 1, 2], [3, 3, 2], [4, 4, 0], [5, 5, 2], [6, 8, 0], [9, 9, 1]])
+        self.assertEqual(expand_coverage(pack_coverage(ranges)),
+                         {1: 2, 3: 2, 4: 0, 5: 2, 6: 0, 7: 0, 8: 0, 9: 1})
+
+    def test_create(self):
+        job, root, core = create_decided_job('coverage_job')
+        coverage = {
+            'line coverage': [[2, {'a/b.c': [1, [3, 5]]}], [0, {'a/b.c': [[6, 8], 4], 'd/e.c': [1]}]],
+            'function coverage': {'coverage': [[1, {'a/b.c': [1]}], [0, {'a/b.c': [6]}]], 'statistics': {}},
+            'Data': {'statistics': {'x': 1}, 'values': [
+                [{'v': 1}, {'a/b.c': [[2, 3]], 'z.c': [1]}], [{'v': 2}, {'a/b.c': [3]}], [{'v': 1}, {'a/b.c': [9]}]
+            ]}
+        }
+        cov_arch = CoverageArchive.objects.create(report=core, identifier='first', archive='first.zip')
+        CreateCoverageFiles(cov_arch, coverage)
+        self.assertEqual(set(CoverageFile.objects.filter(archive=cov_arch).values_list('name', flat=True)),
+                         {'a/b.c', 'd/e.c', 'z.c'})
+
+        covfile = CoverageFile.objects.get(archive=cov_arch, name='a/b.c')
+        self.assertEqual(unpack_coverage(covfile.lines), [(1, 1, 2), (3, 3, 2), (4, 4, 0), (5, 5, 2), (6, 8, 0)])
+        self.assertEqual(unpack_coverage(covfile.functions), [(1, 1, 1), (6, 6, 0)])
+        self.assertEqual(list(line for first, last, value in unpack_coverage(covfile.data)
+                              for line in range(first, last + 1)), [2, 3, 3, 9])
+        self.assertEqual((covfile.covered_lines, covfile.total_lines, covfile.covered_funcs, covfile.total_funcs),
+                         (4, 8, 1, 2))
+
+        # Equal data values are stored once
+        self.assertEqual(CoverageDataValue.objects.count(), 2)
+        CreateCoverageFiles(CoverageArchive.objects.create(report=core, identifier='second', archive='second.zip'),
+                            coverage)
+        self.assertEqual(CoverageDataValue.objects.count(), 2)
+
+
+class TestCoverageTree(CVTestCase):
+    def setUp(self):
+        super().setUp()
+        job, root, self.core = create_decided_job('coverage_tree_job')
+
+    def __create_archive(self, identifier, names):
+        coverage = {
+            'line coverage': [[1, dict((name, [[1, 3]]) for name in names)], [0, dict((name, [4]) for name in names)]],
+            'function coverage': {'coverage': [[1, dict((name, [1]) for name in names)]], 'statistics': {}}
+        }
+        cov_arch = CoverageArchive.objects.create(report=self.core, identifier=identifier, archive=identifier)
+        CreateCoverageFiles(cov_arch, coverage)
+        return cov_arch
+
+    def test_small(self):
+        cov_arch = self.__create_archive('small', ['src/a/x.c', 'src/a/y.h', 'src/b.c', 'top.c'])
+        root = CoverageDirectory.objects.get(archive=cov_arch, parent=None)
+        self.assertEqual((root.files, root.covered_lines, root.total_lines, root.total_funcs), (4, 12, 16, 4))
+        self.assertEqual(CoverageDirectory.objects.get(archive=cov_arch, path='src/a').files, 2)
+
+        rows = CoverageStatistics(cov_arch, None).table_data
+        self.assertEqual(list(row['path'] for row in rows),
+                         ['src', 'src/a', 'src/a/x.c', 'src/a/y.h', 'src/b.c', 'top.c'])
+        self.assertEqual(rows[1]['lines'], {'covered': 6, 'total': 8, 'percent': '75.0%', 'color': '#e4f495'})
+        self.assertTrue(all(row['display'] and not row['lazy'] for row in rows if row['is_dir']))
+
+        # Archives cached before directories appeared get them on the first request
+        CoverageFile.objects.filter(archive=cov_arch).update(directory=None)
+        CoverageDirectory.objects.filter(archive=cov_arch).delete()
+        self.assertEqual(list((row['path'], row['lines'], row['funcs']) for row in rows),
+                         list((row['path'], row['lines'], row['funcs'])
+                              for row in CoverageStatistics(cov_arch, None).table_data))
+
+    def test_large(self):
+        names = list('dir%s/sub%s/file%s.c' % (i % 3, i % 2, i) for i in range(COVERAGE_TREE_MAX_FILES + 1))
+        cov_arch = self.__create_archive('large', names)
+        rows = CoverageStatistics(cov_arch, None).table_data
+        # Only top-level directories are expanded, their subdirectories are loaded on expanding
+        self.assertEqual(list(row['path'] for row in rows), [
+            'dir0', 'dir0/sub0', 'dir0/sub1', 'dir1', 'dir1/sub0', 'dir1/sub1', 'dir2', 'dir2/sub0', 'dir2/sub1'
+        ])
+        self.assertEqual(list(row['path'] for row in rows if row['lazy']), list(
+            row['path'] for row in rows if row['parent_id'] is not None
+        ))
+
+        # Directories of the current file are expanded
+        rows = CoverageStatistics(cov_arch, 'dir1/sub1/file1.c').table_data
+        self.assertEqual(list(row['path'] for row in rows if not row['is_dir']), [
+            'dir1/sub1/file1.c', 'dir1/sub1/file13.c', 'dir1/sub1/file19.c', 'dir1/sub1/file25.c', 'dir1/sub1/file7.c'
+        ])
+
+        directory = CoverageDirectory.objects.get(archive=cov_arch, path='dir2/sub0')
+        rows = CoverageDirectoryStatistics(cov_arch, directory.id).table_data
+        self.assertEqual(sorted(row['path'] for row in rows), sorted(name for name in names
+                                                                     if name.startswith('dir2/sub0/')))
+
+
+class TestRenderedTraces(CVTestCase):
+    witness = json.dumps({
+        'type': 'correctness', 'files': ['a.c'], 'funcs': ['main'],
+        'edges': [
+            {'thread': 1, 'file': 0, 'start line': 3, 'source': 'x > 0', 'condition': True, 'enter': 0},
+            {'thread': 1, 'file': 0, 'start line': 3, 'source': '!(x > 0)', 'condition': False},
+            {'thread': 1, 'file': 0, 'start line': 5, 'source': '', 'invariants': '(x == 1 && y != 2) || x == 3'},
+            {'thread': 1, 'file': 0, 'start line': 7, 'source': '', 'invariants': 'x == 1 && z < 4'}
+        ]
+    })
+    violation = json.dumps({
+        'type': 'violation', 'files': ['a.c'], 'funcs': ['main', 'f'], 'warnings': ['w'],
+        'edges': [
+            {'thread': 1, 'file': 0, 'start line': 1, 'source': 'main()', 'enter': 0},
+            {'thread': 1, 'file': 0, 'start line': 2, 'source': 'f()', 'enter': 1, 'note': 'n'},
+            {'thread': 1, 'file': 0, 'start line': 3, 'source': 'x = 1;', 'return': 1},
+            {'thread': 2, 'file': 0, 'start line': 4, 'source': 'y = 1;', 'warn': 'bug'}
+        ]
+    })
+
+    def setUp(self):
+        super().setUp()
+        rendered_traces_cache().clear()
+
+    def tearDown(self):
+        rendered_traces_cache().clear()
+        super().tearDown()
+
+    def test_cached(self):
+        for error_trace in (self.witness, self.violation):
+            rendered = GetETV(error_trace)
+            cached = GetETV(error_trace)
+            for name in RENDERED_TRACE_ATTRIBUTES:
+                self.assertEqual(getattr(cached, name), getattr(rendered, name))
+            self.assertEqual(rendered.type, json.loads(error_trace)['type'])
+            self.assertTrue(rendered.html_trace)
+
+    def test_witness_lines(self):
+        lines = get_witness_lines(self.witness)
+        self.assertIn(5, lines)
+        self.assertEqual(GetETV(self.witness).lines, lines)
+        # Lines are taken from the cache of rendered error trace
+        rendered_traces_cache().clear()
+        GetETV(self.witness)
+        self.assertEqual(get_witness_lines(self.witness), lines)
+
+    def test_rendered_at_upload(self):
+        populate_users(manager={'username': 'manager', 'password': 'manager'})
+        user = User.objects.create(username='user')
+        Extended.objects.create(user=user, assumptions=True, triangles=True)
+        traces = {'trace.zip': BytesIO()}
+        with zipfile.ZipFile(traces['trace.zip'], mode='w') as zfp:
+            zfp.writestr('error trace.json', self.violation)
+        sources = BytesIO()
+        with zipfile.ZipFile(sources, mode='w') as zfp:
+            zfp.writestr('a.c', 'int main() {}')
+        CheckErrorTraces(traces, sources)
+
+        # Error trace is rendered for options of all users
+        checksum = error_trace_checksum(self.violation)
+        options = set(Extended.objects.values_list('assumptions', 'triangles'))
+        self.assertEqual(len(options), 2)
+        for assumptions, triangles in options:
+            self.assertIsNotNone(rendered_traces_cache().get(render_cache_key(checksum, assumptions, triangles)))
+
+
+class TestSourceHighlighting(CVTestCase):
+    def test_highlight(self):
+        lines = HighlightSource(['int x = 12; /* a', 'b */ return "s\\"t"; // c', '#define A (1)']).lines
+        self.assertEqual(lines, [
+            '<span class="ETVKey2">int</span> x = <span class="ETVNumber">12</span>; '
+            '<span class="ETVComment">/* a</span>',
+            '<span class="ETVComment">b */</span> <span class="ETVKey2">return</span> '
+            '<span class="ETVText">"s\\"t"</span>; <span class="ETVComment">// c</span>',
+            '<span class="ETVKey1">#define</span> A (<span class="ETVNumber">1</span>)'
+        ])
+
+    def test_source(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.c') as fp:
+            fp.write('int x;\nif (x == y)\n  return;\n')
+            fp.flush()
+            edges = [
+                {'start line': 2, 'condition': False, 'source': 'x == y'},
+                {'start line': 2, 'condition': True, 'source': 'if'}
+            ]
+            data = GetSource(None, fp.name, {1: {'a'}, 2: {'a', 'b'}}, edges).data
+        self.assertEqual(data.count('<br>'), 4)
+        self.assertIn('<span style="background-color: #adebadaa"><span class="ETVKey2">int</span> x;</span>', data)
+        # Only not taken conditions are highlighted in the line
+        self.assertIn('<span style="background-color: #70dc70"><span class="ETVKey2">if</span> '
+                      '(<span style="background-color: #dc7070">x == y</span>)</span>', data)
+
+
+class TestComparisonState(CVTestCase):
+    def test_state(self):
+        job1, root1, core1 = create_decided_job('state_job1')
+        job2, root2, core2 = create_decided_job('state_job2')
+        unsafe = ReportUnsafe.objects.create(
+            root=root1, parent=core1, identifier='state_job1/unsafe', trace_id='state_trace', memory=0, cpu_time=0,
+            wall_time=0, error_trace='unsafe.zip', source=ErrorTraceSource.objects.create(root=root1, archive='src.zip')
+        )
+        unknown = ReportUnknown.objects.create(root=root2, parent=core2, identifier='state_job2/unknown',
+                                               component=core2.component, problem_description='problem.zip')
+        states = [get_comparison_state(root1, root2)]
+
+        mark = MarkUnsafe.objects.create(identifier='state_mark', change_date=now())
+        MarkUnsafeReport.objects.create(mark=mark, report=unsafe, result=1)
+        states.append(get_comparison_state(root1, root2))
+
+        # Associations are not changed, but the mark is
+        MarkUnsafe.objects.filter(id=mark.id).update(change_date=now() + timedelta(seconds=1))
+        states.append(get_comparison_state(root1, root2))
+
+        unknown_mark = MarkUnknown.objects.create(identifier='state_unknown_mark', change_date=now(),
+                                                  component=core2.component, function='.*')
+        association = MarkUnknownReport.objects.create(
+            mark=unknown_mark, report=unknown, problem=UnknownProblem.objects.create(name='Problem')
+        )
+        states.append(get_comparison_state(root1, root2))
+
+        # Recreated association with the same mark
+        association.delete()
+        MarkUnknownReport.objects.create(mark=unknown_mark, report=unknown, problem=association.problem)
+        states.append(get_comparison_state(root1, root2))
+
+        self.assertEqual(len(set(states)), len(states))
+        self.assertEqual(get_comparison_state(root1, root2), states[-1])
+
+
+class TestErrorTracesClustering(CVTestCase):
+    def test_sets(self):
+        sets = DisjointSets()
+        for x in range(5):
+            sets.add(x)
+        sets.union(0, 1)
+        sets.union(3, 4)
+        sets.union(1, 4)
+        self.assertEqual(len(set(sets.find(x) for x in range(4))), 2)
+        self.assertEqual(sets.find(0), sets.find(3))
+        self.assertNotEqual(sets.find(2), sets.find(0))
+
+    def test_clusters(self):
+        traces = {
+            1: calls_error_trace('a', 'b'), 2: calls_error_trace('a', 'b'), 3: calls_error_trace('c'),
+            4: calls_error_trace('a', 'b'), 5: calls_error_trace('d'),
+            6: calls_error_trace('c'), 7: json.dumps(calls_error_trace('a', 'b'))
+        }
+        groups = [{'x': {2, 1, 3}}, {'x': {4, 5}}, {'x': {6}, 'y': {7}}]
+        clustering = ErrorTracesClustering(groups, traces.get, 'equal', 100)
+        self.assertEqual(clustering.clusters, [
+            [('x', [1, 2], 0), ('x', [3], 1)],
+            [('x', [4], 0), ('x', [5], 2)],
+            # Only error traces with the same attributes can be equivalent
+            [('x', [6], 1), ('y', [7], 3)]
+        ])
+        self.assertEqual(clustering.components, [{0, 1}, {0, 2}, {1}, {2}])
+
+
+class TestUnsafesTable(CVTestCase):
+    def setUp(self):
+        super().setUp()
+        self.job, self.root, self.core = create_decided_job('unsafes_table_job')
+        self.user = User.objects.create(username='unsafes_table_user')
+        self.other = User.objects.create(username='unsafes_table_other')
+        self.marks = [
+            MarkUnsafe.objects.create(identifier='unsafes_table_mark1', change_date=now(), status='0'),
+            MarkUnsafe.objects.create(identifier='unsafes_table_mark2', change_date=now(), status='1')
+        ]
+        self.source = ErrorTraceSource.objects.create(root=self.root, archive='src.zip')
+        self.number = 0
+
+    def __add_unsafes(self, number):
+        for i in range(number):
+            self.number += 1
+            unsafe = ReportUnsafe.objects.create(
+                root=self.root, parent=self.core, identifier='unsafe%s' % self.number, source=self.source,
+                trace_id='trace%s' % self.number, memory=0, cpu_time=0, wall_time=0, error_trace='unsafe.zip'
+            )
+            ReportComponentLeaf.objects.create(report=self.core, unsafe=unsafe)
+            if i % 2:
+                MarkUnsafeReport.objects.create(mark=self.marks[0], report=unsafe, result=1)
+                MarkUnsafeReview.objects.create(mark=self.marks[0], report=unsafe, author=self.user)
+            if i % 3 == 0:
+                MarkUnsafeReport.objects.create(mark=self.marks[1], report=unsafe, result=1)
+                MarkUnsafeReview.objects.create(mark=self.marks[1], report=unsafe, author=self.other)
+
+    def __get_table(self):
+        view = {'columns': ['marks_number', 'mark_status', 'reviewed']}
+        with CaptureQueriesContext(connection) as context:
+            table = UnsafesTable(self.user, self.core, view, {})
+        return table, len(context.captured_queries)
+
+    def test_queries(self):
+        self.__add_unsafes(4)
+        table, queries = self.__get_table()
+        values = list(list(cell['value'] for cell in row[1:]) for row in table.table_data['values'])
+        self.assertEqual(sorted(values), sorted([
+            ['0 (0)', '-', 'No (in total 0)'], ['0 (1)', 'Reported', 'No (in total 1)'],
+            ['0 (1)', 'Unreported', 'Yes (in total 1)'], ['0 (2)', 'Multiple', 'Yes (in total 2)']
+        ]))
+
+        # The number of queries does not depend on the number of rows
+        self.__add_unsafes(20)
+        table, more_queries = self.__get_table()
+        self.assertEqual(len(table.table_data['values']), 24)
+        self.assertEqual(more_queries, queries)
@@ -60,6 +60,7 @@ urlpatterns = [
     path('coverage/<int:report_id>/', views.CoverageView.as_view(), name='coverage'),
     path('coverage-light/<int:report_id>/', views.CoverageLightView.as_view(), name='coverage_light'),
     path('get-coverage-src/<int:archive_id>/', views.CoverageSrcView.as_view()),
+    path('get-coverage-dir/<int:archive_id>/', views.CoverageDirectoryView.as_view()),
     path('download_coverage/<int:pk>/', views.DownloadCoverageView.as_view(), name='download_coverage'),
 
     # Utils
@@ -35,9 +35,10 @@ from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
 from jobs.utils import get_resource_data, get_user_time, get_user_memory
+from marks.attributes import invalidate_attribute_values
 from marks.models import UnknownProblem, SafeTag, UnsafeTag, MarkUnsafeReport, MarkUnsafeReview
 from marks.utils import SAFE_COLOR, UNSAFE_COLOR, SAFE_LINK_CLASS, UNSAFE_LINK_CLASS, STATUS_COLOR
-from reports.comparison import JobsComparison
+from reports.comparison import get_comparison_snapshot
 from reports.etv import save_zip_trace
 from reports.models import ReportComponent, AttrFile, Attr, AttrName, ReportAttr, ReportUnsafe, ReportSafe, \
     ReportUnknown, ReportRoot
@@ -46,7 +47,7 @@ from users.utils import ALL_ATTRS
 from web.ZipGenerator import ZipStream
 from web.tableHead import Header
 from web.utils import ArchiveFileContent, logger, extract_archive, BridgeException
-from web.vars import ERROR_TRACE_FILE, UNSAFE_VERDICTS, SAFE_VERDICTS, MARK_STATUS
+from web.vars import ERROR_TRACE_FILE, UNSAFE_VERDICTS, SAFE_VERDICTS, MARK_STATUS, COMPARISON_CATEGORY
 
 REP_MARK_TITLES = {
     'mark_num': _('Mark'),
@@ -501,27 +502,20 @@ class UnsafesTable:
         if ALL_ATTRS in columns:
             columns.remove(ALL_ATTRS)
 
+        if "cmp" in self._kwargs:
+            root_1 = get_root_report_by_job(self.report.root.job.id)
+            root_2 = get_root_report_by_job(self._kwargs["cmp"])
+            snapshot = get_comparison_snapshot(root_1, root_2)
+            # Clusters which are only in the first job (all unsafes are shown if there are no such clusters)
+            if snapshot.leaves.filter(category=COMPARISON_CATEGORY[1][0], representative=True).exists():
+                self._kwargs['comparison'] = (snapshot, COMPARISON_CATEGORY[1][0])
+
         query = LeavesQuery(ReportUnsafe, self.view, **self._kwargs)
         objects, cnt = self.__paginate_objects(query.get_objects())
 
         unsafes = {}
         ordered_ids = []
-
-        new_reports_only = []
-
-        if "cmp" in self._kwargs:
-            root_1 = get_root_report_by_job(self.report.root.job.id)
-            root_2 = get_root_report_by_job(self._kwargs["cmp"])
-            data = JobsComparison([root_1, root_2], {}, [], []).comparison[1]["clusters"]
-            for elem in data:
-                report = elem["reports"]
-                is_in_1 = "reports_0" in elem
-                is_in_2 = "reports_1" in elem
-                if is_in_1 and not is_in_2:
-                    new_reports_only.append(report)
         for unsafe_data in objects:
-            if new_reports_only and unsafe_data['id'] not in new_reports_only:
-                continue
             ordered_ids.append(unsafe_data['id'])
             unsafes[unsafe_data['id']] = unsafe_data
             if unsafe_data.get('tags'):
@@ -532,16 +526,6 @@ class UnsafesTable:
                 unsafe_data['marks_number'] = 0
             if 'confirmed' in unsafe_data and unsafe_data['confirmed'] is None:
                 unsafe_data['confirmed'] = 0
-            if 'mark_status' in columns:
-                marks = list(set(v_id for v_id, in MarkUnsafeReport.objects.filter(
-                    report__id=unsafe_data['id']).values_list("mark__status")))
-                number_of_applied_marks = len(marks)
-                if number_of_applied_marks == 0:
-                    unsafe_data['mark_status'] = '-'
-                elif number_of_applied_marks == 1:
-                    unsafe_data['mark_status'] = marks[0]
-                else:
-                    unsafe_data['mark_status'] = _('Multiple')
 
         if 'tag' in self._kwargs and self._kwargs['tag'] == -1:
             new_ids = []
@@ -551,6 +535,21 @@ class UnsafesTable:
                 new_ids.extend(identifier)
             ordered_ids = new_ids
 
+        if 'mark_status' in columns:
+            marks_statuses = self.__get_marks_statuses(ordered_ids)
+            for rep_id in ordered_ids:
+                marks = list(marks_statuses.get(rep_id, set()))
+                if len(marks) == 0:
+                    unsafes[rep_id]['mark_status'] = '-'
+                elif len(marks) == 1:
+                    unsafes[rep_id]['mark_status'] = marks[0]
+                else:
+                    unsafes[rep_id]['mark_status'] = _('Multiple')
+
+        reviews = {}
+        if 'reviewed' in columns:
+            reviews = self.__get_reviews(ordered_ids)
+
         attributes = {}
         for r_id, a_name, a_value, a_assoc in ReportAttr.objects.filter(report_id__in=ordered_ids).order_by('id') \
                 .values_list('report_id', 'attr__name__name', 'attr__value', 'associate'):
@@ -607,12 +606,7 @@ class UnsafesTable:
                 elif col == 'verifiers:memory':
                     val = get_user_memory(self.user, unsafes[rep_id]['memory'])
                 elif col == 'reviewed':
-                    reviews_total = 0
-                    reviews_by_me = "No"
-                    for review in MarkUnsafeReview.objects.filter(report_id=rep_id):
-                        if review.author == self.user:
-                            reviews_by_me = "Yes"
-                        reviews_total += 1
+                    reviews_total, reviews_by_me = reviews.get(rep_id, (0, "No"))
                     val = f"{reviews_by_me} (in total {reviews_total})"
                     if reviews_by_me == "No":
                         style = "red-pale-link"
@@ -623,6 +617,23 @@ class UnsafesTable:
         self.available_columns = [item for item in self.available_columns if item.get('value') not in columns]
         return columns, values_data
 
+    def __get_marks_statuses(self, report_ids):
+        marks_statuses = {}
+        for report_id, status in MarkUnsafeReport.objects.filter(report_id__in=report_ids) \
+                .values_list('report_id', 'mark__status'):
+            marks_statuses.setdefault(report_id, set()).add(status)
+        return marks_statuses
+
+    def __get_reviews(self, report_ids):
+        reviews = {}
+        for report_id, author_id in MarkUnsafeReview.objects.filter(report_id__in=report_ids) \
+                .values_list('report_id', 'author_id'):
+            reviews_total, reviews_by_me = reviews.get(report_id, (0, "No"))
+            if author_id == self.user.id:
+                reviews_by_me = "Yes"
+            reviews[report_id] = (reviews_total + 1, reviews_by_me)
+        return reviews
+
     def __is_not_used(self):
         pass
 
@@ -900,11 +911,15 @@ class AttrData:
         ReportAttr.objects.bulk_create(list(ReportAttr(
             report_id=d[0], attr_id=self._attrs[(d[1], d[2])], compare=d[3], associate=d[4], data_id=d[5]
         ) for d in self._data))
-        self.__init__(self._root_id, None)
+        # Uploaded attributes files are kept for next uploads
+        self._data = []
+        self._name = {}
+        self._attrs = {}
 
     def __upload_names(self):
         names_to_create = set(self._name) - set(n.name for n in AttrName.objects.filter(name__in=self._name))
-        AttrName.objects.bulk_create(list(AttrName(name=name) for name in names_to_create))
+        # Names and attributes can be created by concurrent uploads, so existing ones are skipped
+        AttrName.objects.bulk_create(list(AttrName(name=name) for name in names_to_create), ignore_conflicts=True)
         for n in AttrName.objects.filter(name__in=self._name):
             self._name[n.name] = n.id
 
@@ -916,7 +931,8 @@ class AttrData:
         for attr in self._attrs:
             if self._attrs[attr] is None and attr[0] in self._name:
                 attrs_to_create.append(Attr(name_id=self._name[attr[0]], value=attr[1]))
-        Attr.objects.bulk_create(attrs_to_create)
+        Attr.objects.bulk_create(attrs_to_create, ignore_conflicts=True)
+        invalidate_attribute_values(set(attr[0] for attr in self._attrs if self._attrs[attr] is None))
         for a in Attr.objects.filter(value__in=list(attr[1] for attr in self._attrs)).select_related('name'):
             if (a.name.name, a.value) in self._attrs:
                 self._attrs[(a.name.name, a.value)] = a.id
@@ -29,6 +29,7 @@ from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ObjectDoesNotExist
 from django.http import HttpResponseRedirect
+from django.template import loader
 from django.template.defaulttags import register
 from django.utils.decorators import method_decorator
 from django.utils.translation import gettext as _, override
@@ -42,12 +43,12 @@ from jobs.ViewJobData import ViewJobData
 from jobs.models import Job
 from jobs.utils import JobAccess, get_job_children
 from marks.tables import ReportMarkTable
-from reports.UploadReport import UploadReport
+from reports.UploadReport import UploadReport, UploadReportsBatch
 from reports.comparison import JobsComparison
-from reports.coverage import GetCoverage, GetCoverageSrcHTML
-from reports.etv import GetSource, GetETV
-from reports.models import ReportRoot, Report, ReportComponent, ReportSafe, ReportUnknown, ReportUnsafe, \
-    AttrName, ReportAttr, CoverageArchive
+from reports.coverage import GetCoverage, GetCoverageSrcHTML, CoverageDirectoryStatistics
+from reports.etv import GetSource, GetETV, get_witness_lines
+from reports.models import ReportRoot, Report, ReportComponent, ReportSafe, ReportUnknown, ReportUnsafe, ReportAttr, \
+    CoverageArchive, Computer
 from reports.utils import get_edited_error_trace, get_error_trace_content, modify_error_trace, get_html_error_trace, \
     get_root_report_by_job
 from service.models import Task
@@ -545,8 +546,7 @@ class SourceCodeView(LoggedCallMixin, Bview.JsonView):
         try:
             if witness_type == 'correctness':
                 report = ReportSafe.objects.get(id=report_id)
-                proof = GetETV(get_error_trace_content(report), self.request.user)
-                lines = proof.lines
+                lines = get_witness_lines(get_error_trace_content(report))
             else:
                 # Violation
                 report = ReportUnsafe.objects.get(id=report_id)
@@ -772,6 +772,16 @@ class CoverageSrcView(LoggedCallMixin, Bview.JsonDetailPostView):
         return {'content': res.src_html, 'data': res.data_html, 'legend': res.legend}
 
 
+class CoverageDirectoryView(LoggedCallMixin, Bview.JsonDetailPostView):
+    model = CoverageArchive
+    pk_url_kwarg = 'archive_id'
+
+    def get_context_data(self, **kwargs):
+        res = CoverageDirectoryStatistics(self.object, int(self.request.POST['directory']))
+        return {'rows': loader.get_template('reports/coverage/coverageStatisticsRows.html')
+                .render({'TableData': res.table_data})}
+
+
 @method_decorator(login_required, name='dispatch')
 class DownloadCoverageView(LoggedCallMixin, SingleObjectMixin, Bview.StreamingResponseView):
     model = CoverageArchive
@@ -786,7 +796,13 @@ class DownloadCoverageView(LoggedCallMixin, SingleObjectMixin, Bview.StreamingRe
 
 class UploadReportView(LoggedCallMixin, Bview.JsonDetailPostView):
     model = Job
-    unparallel = [ReportRoot, AttrName, Task]
+    # Reports of different jobs are uploaded in parallel, but not together with views, which lock these models
+    # (removal of jobs, changes of marks, recalculation of caches and removal of unused computers)
+    shared_unparallel = [ReportRoot, Computer, Task]
+
+    def get_unparallel(self):
+        # Only reports of the same job are uploaded one by one
+        return ['ReportRoot:%s' % self.request.session.get('job id')]
 
     def dispatch(self, request, *args, **kwargs):
         with override(settings.DEFAULT_LANGUAGE):
@@ -820,10 +836,9 @@ class UploadReportView(LoggedCallMixin, Bview.JsonDetailPostView):
             data = json.loads(self.request.POST['reports'])
             if not isinstance(data, list):
                 raise BridgeException('Wrong format of reports data')
-            for d in data:
-                err = UploadReport(self.object, d, archives).error
-                if err is not None:
-                    raise BridgeException(err)
+            err = UploadReportsBatch(self.object, data, archives).error
+            if err is not None:
+                raise BridgeException(err)
         else:
             raise BridgeException('Report json data is required')
         return {}
@@ -0,0 +1,39 @@
+#
+# CVV is a continuous verification visualizer.
+# Copyright (c) 2023 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from django.core.management.base import BaseCommand, CommandError
+
+from service.utils import run_launch_workers, LAUNCH_QUEUE_INTERVAL
+from web.vars import MAX_PROCESSING_JOBS
+
+
+class Command(BaseCommand):
+    help = 'Launches queued jobs in several worker processes. It should be run as a service.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', dest='workers', type=int, default=MAX_PROCESSING_JOBS,
+                            help='Number of worker processes, i.e. maximum number of simultaneous launches')
+        parser.add_argument('--interval', dest='interval', type=float, default=LAUNCH_QUEUE_INTERVAL,
+                            help='Number of seconds between checks of the empty queue')
+        parser.add_argument('--once', dest='once', default=False, action='store_true',
+                            help='Exit when the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('Number of workers must be positive')
+        run_launch_workers(options['workers'], options['interval'], options['once'])
@@ -22,6 +22,7 @@
 from django.db import models
 from django.db.models.signals import pre_delete, post_init
 from django.dispatch.dispatcher import receiver
+from django.utils.timezone import now
 
 from jobs.models import Job, JobFile
 from web.utils import RemoveFilesBeforeDelete
@@ -74,6 +75,23 @@ class JobProgress(models.Model):
     gag_text_ts = models.CharField(max_length=128, null=True)
 
 
+class TaskQueue(models.Model):
+    # Launches of jobs, which are processed by workers (see service/management/commands/LaunchWorkers.py)
+    job = models.ForeignKey(Job, models.CASCADE, related_name='+')
+    benchmark = models.BooleanField(default=False)
+    priority = models.CharField(max_length=6, choices=PRIORITY)
+    status = models.CharField(max_length=10, choices=TASK_STATUS, default='PENDING', db_index=True)
+    error = models.CharField(max_length=1024, null=True)
+    launcher_dir = models.CharField(max_length=1024)
+    environment = models.TextField()
+    date = models.DateTimeField(default=now)
+    start_date = models.DateTimeField(null=True)
+    finish_date = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'task_queue'
+
+
 class Task(models.Model):
     progress = models.ForeignKey(SolvingProgress, models.CASCADE)
     status = models.CharField(max_length=10, choices=TASK_STATUS, default='PENDING')
@@ -21,19 +21,26 @@
 
 import json
 import os
+import shutil
+import stat
+import tempfile
+import zipfile
+from datetime import timedelta
 
 from django.conf import settings
 from django.db.models import Q
-from django.test import Client
+from django.test import Client, override_settings
 from django.urls import reverse
+from django.utils.timezone import now
 
 from jobs.models import Job
 from reports.test import COMPUTER
-from service.models import SolvingProgress, Task, Solution
+from service.models import SolvingProgress, Task, Solution, TaskQueue
+from service.utils import get_queued_launch, fail_stale_launches, process_launch_queue, LaunchQueuedJob, StopDecision
 from users.models import User
 from web.populate import populate_users
 from web.utils import CVTestCase
-from web.vars import JOB_STATUS, PRIORITY
+from web.vars import JOB_STATUS, PRIORITY, MAX_PROCESSING_JOBS
 
 TEST_JSON = {
     'tasks': {
@@ -212,3 +219,145 @@ class TestService(CVTestCase):
         self.assertEqual(progress.tasks_pending, 1)
         self.assertEqual(progress.tasks_finished, 1)
         self.assertEqual(progress.tasks_cancelled, 1)
+
+
+def launcher_archive(path, files, links=None):
+    # Archive with executable files and symbolic links {<name>: <target>}
+    with zipfile.ZipFile(path, mode='w') as zfp:
+        for name, content in files.items():
+            info = zipfile.ZipInfo(name)
+            info.external_attr = (stat.S_IFREG | 0o755) << 16
+            zfp.writestr(info, content)
+        for name, target in (links or {}).items():
+            info = zipfile.ZipInfo(name)
+            info.external_attr = (stat.S_IFLNK | 0o777) << 16
+            zfp.writestr(info, target)
+
+
+class TestLaunchQueue(CVTestCase):
+    def setUp(self):
+        super(TestLaunchQueue, self).setUp()
+        # Launcher directories are placed near the generic launcher like in DEFAULT_LAUNCHER_DIR
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+        self.__generic_launcher('#!/bin/sh\necho "$launch" >> ../launches.txt\n')
+        self.job = Job.objects.create(identifier='queued', name='queued', change_date=now(),
+                                      status=JOB_STATUS[1][0])
+
+    def __generic_launcher(self, content):
+        path = os.path.join(self.base_dir, 'generic.sh')
+        with open(path, mode='w') as fp:
+            fp.write(content)
+        os.chmod(path, 0o755)
+
+    def __queue(self, name, priority=PRIORITY[2][0], benchmark=True, **kwargs):
+        launcher_dir = os.path.join(self.base_dir, name)
+        os.makedirs(launcher_dir)
+        return TaskQueue.objects.create(job=self.job, benchmark=benchmark, priority=priority,
+                                        launcher_dir=launcher_dir, environment=json.dumps({'launch': name}), **kwargs)
+
+    def __launches(self):
+        path = os.path.join(self.base_dir, 'launches.txt')
+        if not os.path.exists(path):
+            return []
+        with open(path) as fp:
+            return fp.read().split()
+
+    def test_order(self):
+        for name, priority in [('idle', PRIORITY[3][0]), ('low1', PRIORITY[2][0]), ('urgent', PRIORITY[0][0]),
+                               ('low2', PRIORITY[2][0])]:
+            self.__queue(name, priority)
+        launch = get_queued_launch()
+        self.assertEqual((launch.launcher_dir, launch.status), (os.path.join(self.base_dir, 'urgent'), 'PROCESSING'))
+        LaunchQueuedJob(launch)
+        process_launch_queue(once=True)
+        self.assertEqual(self.__launches(), ['urgent', 'low1', 'low2', 'idle'])
+        self.assertEqual(set(TaskQueue.objects.values_list('status', flat=True)), {'FINISHED'})
+        self.assertIsNone(get_queued_launch())
+
+    def test_processing_jobs_limit(self):
+        jobs = list(Job.objects.create(identifier='running%s' % i, name='running%s' % i, change_date=now(),
+                                       status=JOB_STATUS[2][0]) for i in range(MAX_PROCESSING_JOBS))
+        launch = self.__queue('waiting', benchmark=False)
+        # Launches are not taken while the maximum number of jobs is processing
+        self.assertIsNone(get_queued_launch())
+        process_launch_queue(once=True)
+        launch.refresh_from_db()
+        self.assertEqual(launch.status, 'PENDING')
+        self.assertEqual(self.__launches(), [])
+
+        Job.objects.filter(id=jobs[0].id).update(status=JOB_STATUS[3][0])
+        process_launch_queue(once=True)
+        launch.refresh_from_db()
+        self.assertEqual(launch.status, 'FINISHED')
+        self.assertEqual(self.__launches(), ['waiting'])
+        self.assertEqual(Job.objects.filter(status=JOB_STATUS[2][0]).count(), MAX_PROCESSING_JOBS)
+
+    def test_job_status(self):
+        launch = self.__queue('job', benchmark=False)
+        process_launch_queue(once=True)
+        launch.refresh_from_db()
+        self.assertEqual(launch.status, 'FINISHED')
+        self.assertEqual(Job.objects.get(id=self.job.id).status, JOB_STATUS[2][0])
+
+        # Failed launcher fails the job
+        self.__generic_launcher('#!/bin/sh\nexit 1\n')
+        Job.objects.filter(id=self.job.id).update(status=JOB_STATUS[1][0])
+        launch = self.__queue('failed', benchmark=False)
+        process_launch_queue(once=True)
+        launch.refresh_from_db()
+        self.assertEqual(launch.status, 'ERROR')
+        self.assertIn('returned non-zero exit status 1', launch.error)
+        self.assertEqual(Job.objects.get(id=self.job.id).status, JOB_STATUS[4][0])
+
+    def test_stopped_job(self):
+        launch = self.__queue('stopped', benchmark=False)
+        StopDecision(self.job)
+        launch.refresh_from_db()
+        self.assertEqual(launch.status, 'CANCELLED')
+        self.assertEqual(Job.objects.get(id=self.job.id).status, JOB_STATUS[7][0])
+
+        # The job is not launched if it was stopped after the launch was taken by the worker
+        launch = self.__queue('taken', benchmark=False)
+        launch = get_queued_launch()
+        LaunchQueuedJob(launch)
+        launch.refresh_from_db()
+        self.assertEqual(launch.status, 'CANCELLED')
+        self.assertEqual(self.__launches(), [])
+        self.assertEqual(Job.objects.get(id=self.job.id).status, JOB_STATUS[7][0])
+
+    def test_archives(self):
+        launch = self.__queue('archives')
+        launcher_archive(os.path.join(launch.launcher_dir, 'verifier.zip'), {'bin/run.sh': '#!/bin/sh\n'},
+                         {'run': 'bin/run.sh', 'bin/link': 'run.sh'})
+        process_launch_queue(once=True)
+        launch.refresh_from_db()
+        self.assertEqual(launch.status, 'FINISHED', launch.error)
+        verifier_dir = os.path.join(launch.launcher_dir, 'verifier')
+        self.assertTrue(os.access(os.path.join(verifier_dir, 'bin', 'run.sh'), os.X_OK))
+        self.assertEqual(os.readlink(os.path.join(verifier_dir, 'run')), 'bin/run.sh')
+        self.assertEqual(os.readlink(os.path.join(verifier_dir, 'bin', 'link')), 'run.sh')
+        self.assertFalse(os.path.exists(os.path.join(launch.launcher_dir, 'verifier.zip')))
+
+    def test_unsafe_links(self):
+        for name, links in [('absolute', {'link': '/etc'}), ('parent', {'bin/link': '../../generic.sh'}),
+                            ('chain', {'dir': '.', 'dir/link': '..'})]:
+            launch = self.__queue(name)
+            launcher_archive(os.path.join(launch.launcher_dir, 'tasks.zip'), {'bin/task': 'task'}, links)
+            LaunchQueuedJob(get_queued_launch())
+            launch.refresh_from_db()
+            self.assertEqual(launch.status, 'ERROR')
+            self.assertIn('points outside of the archive', launch.error)
+            # The launcher is not started
+            self.assertEqual(self.__launches(), [])
+
+    def test_stale_launches(self):
+        Job.objects.filter(id=self.job.id).update(status=JOB_STATUS[2][0])
+        stale = self.__queue('stale', benchmark=False, status='PROCESSING', start_date=now() - timedelta(hours=2))
+        recent = self.__queue('recent', benchmark=False, status='PROCESSING', start_date=now())
+        with override_settings(LAUNCH_TIMEOUT=3600):
+            self.assertEqual(fail_stale_launches(), 1)
+        stale.refresh_from_db()
+        recent.refresh_from_db()
+        self.assertEqual((stale.status, recent.status), ('ERROR', 'PROCESSING'))
+        self.assertEqual(Job.objects.get(id=self.job.id).status, JOB_STATUS[4][0])
@@ -21,19 +21,23 @@
 
 import datetime
 import glob
+import json
+import multiprocessing
 import os
-import shutil
+import signal
+import stat
 import subprocess
+import sys
 import time
+import zipfile
 from io import BytesIO
 from typing import Optional
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.files import File as NewFile
-from django.core.files.base import ContentFile
-from django.core.files.storage import default_storage
-from django.db.models import Q
+from django.db import connection, connections, transaction
+from django.db.models import Q, Case, When, IntegerField
 from django.http import HttpRequest
 from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
@@ -41,16 +45,22 @@ from django.utils.translation import gettext_lazy as _
 from jobs.models import Job, JobFile, RunHistory
 from jobs.utils import JobAccess, change_job_status, create_job
 from reports.models import ReportRoot
-from service.models import SolvingProgress
+from service.models import SolvingProgress, TaskQueue
 from web.utils import logger, BridgeException, file_checksum
 from web.vars import JOB_STATUS, DEFAULT_LAUNCHER_DIR, \
     GENERIC_LAUNCHER_COMMAND, MAX_PROCESSING_JOBS, USER_ROLES, DEFAULT_CONFIGS_DIR, JSON_EXTENSION, \
-    VERIFIER_CONFIGURATIONS, PID_FILE
+    VERIFIER_CONFIGURATIONS, PID_FILE, PRIORITY, TASK_STATUS
 
 DEFAULT_VERIFIER_DIR = "verifier"
 DEFAULT_TASKS_DIR = "tasks"
 DEFAULT_BENCHMARK_FILE = "benchmark.xml"
 
+# Uploaded archives are extracted into directories with the same names by queue workers
+LAUNCHER_ARCHIVES = [DEFAULT_VERIFIER_DIR, DEFAULT_TASKS_DIR]
+
+# Number of seconds, which workers wait before the next check of the empty queue
+LAUNCH_QUEUE_INTERVAL = 5
+
 
 def get_launcher_dir() -> str:
     return os.path.normpath(os.path.join(settings.BASE_DIR, os.pardir, DEFAULT_LAUNCHER_DIR))
@@ -62,7 +72,6 @@ class LaunchTask:
         self.launcher_dir = os.path.join(get_launcher_dir(), "results_{}".format(timestamp))
         self.specific_config = None
         self.verifiers = {}
-        self.cur_dir = os.getcwd()
         self.error = None
         self.new_job = None
         self.parent = None
@@ -80,7 +89,7 @@ class LaunchTask:
             self.__schedule_job()
         os.makedirs(self.launcher_dir)
         self.__process_files(request)
-        self.__solve_job(data)
+        self.__queue_job(data)
 
     def __process_files(self, request):
         if request.FILES:
@@ -88,19 +97,15 @@ class LaunchTask:
             os.makedirs(files_dir)
             for file_id in request.FILES:
                 for file in request.FILES.getlist(file_id):
-                    path = default_storage.save('tmp', ContentFile(file.read()))
-                    tmp_file = os.path.join(settings.MEDIA_ROOT, path)
-                    stored_file = None
                     if file_id == "upload_config":
                         stored_file = os.path.join(files_dir, "config.json")
                         self.specific_config = stored_file
                     elif file_id == "upload_benchmark_file":
                         stored_file = os.path.join(self.launcher_dir, DEFAULT_BENCHMARK_FILE)
                     elif file_id == "upload_verifier":
-                        os.system("unzip {} -d {}".format(tmp_file, os.path.join(self.launcher_dir,
-                                                                                 DEFAULT_VERIFIER_DIR)))
+                        stored_file = os.path.join(self.launcher_dir, DEFAULT_VERIFIER_DIR + ".zip")
                     elif file_id == "upload_tasks":
-                        os.system("unzip {} -d {}".format(tmp_file, os.path.join(self.launcher_dir, DEFAULT_TASKS_DIR)))
+                        stored_file = os.path.join(self.launcher_dir, DEFAULT_TASKS_DIR + ".zip")
                     elif str(file_id).startswith('upload_verifier_'):
                         verifier_type = file_id[len('upload_verifier_'):]
                         stored_file = os.path.join(files_dir, verifier_type + ".zip")
@@ -110,13 +115,10 @@ class LaunchTask:
                         stored_file = os.path.join(files_dir, dst_file)
                     else:
                         logger.warning("Unknown type of uploaded file {}".format(file_id))
-                        os.remove(tmp_file)
-                        stored_file = None
-                    if stored_file:
-                        shutil.move(tmp_file, stored_file)
-                    else:
-                        if os.path.exists(tmp_file):
-                            os.remove(tmp_file)
+                        continue
+                    with open(stored_file, mode='wb') as fp:
+                        for chunk in file.chunks():
+                            fp.write(chunk)
 
     def __is_benchmark(self):
         if self.type == 'benchmark':
@@ -125,11 +127,6 @@ class LaunchTask:
             return False
 
     def __is_good(self) -> bool:
-        # check for maximal processed tasks
-        number_of_processing_jobs = Job.objects.filter(status=JOB_STATUS[2][0]).count()
-        if number_of_processing_jobs > MAX_PROCESSING_JOBS:
-            self.error = _('Exceeded max number of processed jobs')
-            return False
         # check for user permissions
         if self.user.extended.role not in [USER_ROLES[1][0], USER_ROLES[2][0], USER_ROLES[4][0]]:
             self.error = _('No access')
@@ -160,33 +157,195 @@ class LaunchTask:
                            'comment': self.launcher_dir})
 
     def __schedule_job(self):
-        # TODO: Add to pending jobs in case of MAX_PROCESSING_JOBS violated.
-        change_job_status(self.new_job, JOB_STATUS[2][0])
+        # The job is pending until a queue worker launches it
+        change_job_status(self.new_job, JOB_STATUS[1][0])
+
+    def __queue_job(self, data):
+        # Only variables of the launch are saved, the worker adds them to its own environment
+        launcher_env = {}
+        if not self.__is_benchmark():
+            launcher_env["job_id"] = self.new_job.identifier
+        else:
+            launcher_env["job_id"] = self.parent.identifier
+            launcher_env["job_name"] = data['new_job_name']
+        launcher_env["type"] = self.type
+        if self.specific_config:
+            launcher_env["specific_config"] = self.specific_config
+        for verifier_type, arch in self.verifiers.items():
+            launcher_env["{}_{}".format("verifier", verifier_type)] = arch
+        for key, val in data.items():
+            if key:
+                if key == "reuse_tools" and self.verifiers:
+                    val = "false"
+                launcher_env[key] = val
+        priority = data.get('priority')
+        if priority not in set(p[0] for p in PRIORITY):
+            priority = PRIORITY[3][0]
+        TaskQueue.objects.create(
+            job=self.parent if self.__is_benchmark() else self.new_job, benchmark=self.__is_benchmark(),
+            priority=priority, launcher_dir=self.launcher_dir, environment=json.dumps(launcher_env)
+        )
 
-    def __solve_job(self, data):
+
+def fail_stale_launches():
+    # Launches, which are processed longer than the launcher can work, were lost by killed workers.
+    # They are not queued again, since their archives were extracted and the launcher could be started.
+    timeout = getattr(settings, 'LAUNCH_TIMEOUT', 3600)
+    stale = list(TaskQueue.objects.filter(
+        status=TASK_STATUS[1][0], start_date__lt=now() - datetime.timedelta(seconds=timeout)
+    ))
+    for launch in stale:
+        if TaskQueue.objects.filter(id=launch.id, status=TASK_STATUS[1][0]).update(
+                status=TASK_STATUS[3][0], error='The worker was stopped during the launch', finish_date=now()):
+            LaunchQueuedJob.fail_job(launch)
+    return len(stale)
+
+
+def get_queued_launch() -> Optional[TaskQueue]:
+    # Launches are taken by priority and then in order of queueing, rows locked by other workers are skipped
+    if Job.objects.filter(status=JOB_STATUS[2][0]).count() >= MAX_PROCESSING_JOBS:
+        # The launcher solves jobs in the background, so launches wait until some of running jobs are finished
+        return None
+    order = Case(*list(When(priority=p[0], then=i) for i, p in enumerate(PRIORITY)), output_field=IntegerField())
+    while True:
+        with transaction.atomic():
+            queryset = TaskQueue.objects.filter(status=TASK_STATUS[0][0]).order_by(order, 'id')
+            if connection.features.has_select_for_update_skip_locked:
+                queryset = queryset.select_for_update(skip_locked=True)
+            launch = queryset.first()
+            if launch is None:
+                return None
+            # Without row locks (e.g., in SQLite) the launch can be taken by another worker meanwhile
+            launch.start_date = now()
+            if TaskQueue.objects.filter(id=launch.id, status=TASK_STATUS[0][0])\
+                    .update(status=TASK_STATUS[1][0], start_date=launch.start_date):
+                launch.status = TASK_STATUS[1][0]
+                return launch
+
+
+class LaunchQueuedJob:
+    def __init__(self, launch: TaskQueue):
+        self._launch = launch
+        if not self.__start_job():
+            self.__finish(TASK_STATUS[4][0])
+            return
         try:
-            os.chdir(self.launcher_dir)
-            launcher_env = os.environ.copy()
-            if not self.__is_benchmark():
-                launcher_env["job_id"] = self.new_job.identifier
-            else:
-                launcher_env["job_id"] = self.parent.identifier
-                launcher_env["job_name"] = data['new_job_name']
-            launcher_env["type"] = self.type
-            if self.specific_config:
-                launcher_env["specific_config"] = self.specific_config
-            for verifier_type, arch in self.verifiers.items():
-                launcher_env["{}_{}".format("verifier", verifier_type)] = arch
-            for key, val in data.items():
-                if key:
-                    if key == "reuse_tools" and self.verifiers:
-                        val = "false"
-                    launcher_env[key] = val
-            subprocess.run(GENERIC_LAUNCHER_COMMAND, shell=True, check=True, env=launcher_env)
-            os.chdir(self.cur_dir)
+            self.__extract_archives()
+            self.__solve_job()
         except Exception as e:
             logger.exception(e)
-            self.error = str(e)
+            self.__finish(TASK_STATUS[3][0], str(e)[:1024])
+            self.fail_job(self._launch)
+        else:
+            self.__finish(TASK_STATUS[2][0])
+
+    def __start_job(self):
+        if self._launch.benchmark:
+            return True
+        with transaction.atomic():
+            # The row is locked, so the job can't be stopped between the check and the status change
+            job = Job.objects.select_for_update().get(id=self._launch.job_id)
+            if job.status != JOB_STATUS[1][0]:
+                # The job was stopped before it was launched
+                return False
+            change_job_status(job, JOB_STATUS[2][0])
+        return True
+
+    def __extract_archives(self):
+        for dir_name in LAUNCHER_ARCHIVES:
+            archive = os.path.join(self._launch.launcher_dir, dir_name + ".zip")
+            if not os.path.exists(archive):
+                continue
+            directory = os.path.realpath(os.path.join(self._launch.launcher_dir, dir_name))
+            with zipfile.ZipFile(archive, mode='r') as zfp:
+                links = []
+                for info in zfp.infolist():
+                    # Permissions and symbolic links are restored like unzip does
+                    mode = info.external_attr >> 16
+                    if stat.S_ISLNK(mode):
+                        links.append(info)
+                        continue
+                    path = zfp.extract(info, directory)
+                    if stat.S_IMODE(mode) and not info.is_dir():
+                        os.chmod(path, stat.S_IMODE(mode))
+                # Links are created after regular files, so files are never written through them
+                for info in links:
+                    self.__create_link(directory, info.filename, zfp.read(info).decode('utf8'))
+            os.remove(archive)
+
+    def __create_link(self, directory, name, target):
+        path = os.path.normpath(os.path.join(directory, name))
+        if os.path.isabs(target) or not self.__is_inside(directory, path) or \
+                not self.__is_inside(directory, os.path.join(os.path.realpath(os.path.dirname(path)), target)):
+            raise ValueError('Symbolic link {} points outside of the archive'.format(name))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.lexists(path):
+            os.remove(path)
+        os.symlink(target, path)
+
+    def __is_inside(self, directory, path):
+        self.__is_not_used()
+        return os.path.commonpath([directory, os.path.realpath(path)]) == directory
+
+    def __solve_job(self):
+        launcher_env = os.environ.copy()
+        launcher_env.update(json.loads(self._launch.environment))
+        subprocess.run(GENERIC_LAUNCHER_COMMAND, shell=True, check=True, env=launcher_env,
+                       cwd=self._launch.launcher_dir, timeout=getattr(settings, 'LAUNCH_TIMEOUT', 3600))
+
+    @staticmethod
+    def fail_job(launch):
+        if launch.benchmark:
+            return
+        with transaction.atomic():
+            job = Job.objects.select_for_update().get(id=launch.job_id)
+            if job.status == JOB_STATUS[2][0]:
+                change_job_status(job, JOB_STATUS[4][0])
+
+    def __finish(self, status, error=None):
+        self._launch.status = status
+        self._launch.error = error
+        self._launch.finish_date = now()
+        self._launch.save()
+
+    def __is_not_used(self):
+        pass
+
+
+def process_launch_queue(interval=LAUNCH_QUEUE_INTERVAL, once=False):
+    # Queued launches are processed one by one until the queue is empty (if once is True) or forever
+    while True:
+        fail_stale_launches()
+        launch = get_queued_launch()
+        if launch is not None:
+            LaunchQueuedJob(launch)
+        elif once:
+            break
+        else:
+            time.sleep(interval)
+
+
+def run_launch_workers(workers, interval=LAUNCH_QUEUE_INTERVAL, once=False):
+    # Workers are forked from the current process, so they inherit loaded Django settings
+    if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        process_launch_queue(interval, once)
+        return
+    # Database connections can't be shared between processes
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    processes = list(context.Process(target=process_launch_queue, args=(interval, once)) for _ in range(workers))
+    for process in processes:
+        process.start()
+    # Workers are stopped with the main process (e.g., by stop.sh)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for process in processes:
+            process.join()
+    except (KeyboardInterrupt, SystemExit):
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
 
 
 class LauncherData:
@@ -240,8 +399,14 @@ class CoreStartDecision:
 
 class StopDecision:
     def __init__(self, job):
-        if job.status not in [JOB_STATUS[1][0], JOB_STATUS[2][0]]:
-            raise BridgeException(_("Only pending and processing jobs can be stopped"))
+        with transaction.atomic():
+            # The row is locked, so a queue worker can't launch the job meanwhile
+            job = Job.objects.select_for_update().get(id=job.id)
+            if job.status not in [JOB_STATUS[1][0], JOB_STATUS[2][0]]:
+                raise BridgeException(_("Only pending and processing jobs can be stopped"))
+            change_job_status(job, JOB_STATUS[7][0])
+            TaskQueue.objects.filter(job=job, benchmark=False, status=TASK_STATUS[0][0])\
+                .update(status=TASK_STATUS[4][0], finish_date=now())
         try:
             work_dir = job.versions.last().comment
             with open(os.path.join(work_dir, PID_FILE)) as fd:
@@ -252,8 +417,6 @@ class StopDecision:
         except Exception as e:
             logger.exception(str(e))
 
-        change_job_status(job, JOB_STATUS[7][0])
-
 
 class StartJobDecision:
     def __init__(self, user, job_id, configuration, fake=False):
@@ -0,0 +1,297 @@
+#
+# CVV is a continuous verification visualizer.
+# Copyright (c) 2023 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import models, transaction
+from django.db.models import F
+from django.utils.timezone import now
+
+from tools.models import FileReference
+from web.utils import logger
+
+# Number of paths, which are changed in the ledger by one query
+FILES_BATCH_SIZE = 500
+
+# Directory in MEDIA_ROOT with files stored by their content (see BlobStorage)
+BLOBS_DIR = 'Blobs'
+
+# Size of blocks, which are read from files to compute checksums
+BLOB_READ_SIZE = 1024 * 1024
+
+
+# Names of files, which are saved in the current thread inside SavedFiles blocks
+_saved_files = threading.local()
+
+
+class SavedFiles:
+    # Files saved inside the block are released if it fails. References to them are added in the block,
+    # so they are lost when its transaction is rolled back, and unreferenced files would stay on disk forever.
+    def __enter__(self):
+        self._outer = getattr(_saved_files, 'names', None)
+        _saved_files.names = []
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        names = _saved_files.names
+        _saved_files.names = self._outer
+        if exc_type is None:
+            SavedFiles.register(names)
+            return
+        FileReference.objects.bulk_create(
+            list(FileReference(path=name, refs=0) for name in set(names)),
+            batch_size=FILES_BATCH_SIZE, ignore_conflicts=True
+        )
+
+    @staticmethod
+    def register(names):
+        saved = getattr(_saved_files, 'names', None)
+        if saved is not None:
+            saved.extend(names)
+
+
+def __batches(paths):
+    # Equal paths are counted, since stored by content files can be shared by several objects
+    paths = list(Counter(paths).items())
+    for i in range(0, len(paths), FILES_BATCH_SIZE):
+        batch = {}
+        for path, number in paths[i:i + FILES_BATCH_SIZE]:
+            batch.setdefault(number, []).append(path)
+        yield batch
+
+
+def add_file_references(paths):
+    paths = list(paths)
+    SavedFiles.register(paths)
+    for batch in __batches(paths):
+        with transaction.atomic():
+            for number, batch_paths in batch.items():
+                existing = set(FileReference.objects.filter(path__in=batch_paths).values_list('path', flat=True))
+                if existing:
+                    FileReference.objects.filter(path__in=existing).update(refs=F('refs') + number, changed=now())
+                FileReference.objects.bulk_create(list(
+                    FileReference(path=path, refs=number) for path in batch_paths if path not in existing
+                ), ignore_conflicts=True)
+
+
+def release_files(paths):
+    # Files are not removed here, it is done by collect_released_files() later
+    for batch in __batches(paths):
+        for number, batch_paths in batch.items():
+            FileReference.objects.filter(path__in=batch_paths).update(refs=F('refs') - number, changed=now())
+
+
+def get_released_border(delay=None):
+    if delay is None:
+        delay = getattr(settings, 'FILES_GC_DELAY', 0)
+    return now() - timedelta(seconds=delay)
+
+
+def collect_released_files(delay=None):
+    # Files without references, which were released more than delay seconds ago, are removed
+    border = get_released_border(delay)
+    removed = 0
+    while True:
+        # Rows are locked until files are removed, so blobs can't be referenced again meanwhile
+        with transaction.atomic():
+            batch = list(FileReference.objects.select_for_update().filter(refs__lte=0, changed__lt=border)
+                         .values_list('id', 'path')[:FILES_BATCH_SIZE])
+            if not batch:
+                break
+            for ref_id, path in batch:
+                try:
+                    os.remove(os.path.join(settings.MEDIA_ROOT, path))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.exception(e)
+            FileReference.objects.filter(id__in=list(ref_id for ref_id, path in batch), refs__lte=0).delete()
+        removed += len(batch)
+    return removed
+
+
+class ReconcileFiles:
+    # The ledger is checked with file fields of all models and with files on disk
+    def __init__(self, delay=None):
+        self._border = get_released_border(delay)
+        # Directories in MEDIA_ROOT, where stored files are placed
+        self._directories = set()
+        self._refs = self.__get_db_references()
+        self.__update_ledger()
+        self.__scan_media()
+
+    def __get_db_references(self):
+        refs = {}
+        for model in apps.get_models():
+            meta = getattr(model, '_meta')
+            if meta.proxy:
+                continue
+            fields = list(f for f in meta.local_concrete_fields if isinstance(f, models.FileField))
+            if not fields:
+                continue
+            for field in fields:
+                if isinstance(field.upload_to, str) and field.upload_to:
+                    self._directories.add(field.upload_to.split('/')[0])
+            for paths in getattr(model, '_default_manager').values_list(*list(f.attname for f in fields)).iterator():
+                for path in paths:
+                    if path:
+                        refs[path] = refs.get(path, 0) + 1
+                        if '/' in path:
+                            self._directories.add(path.split('/')[0])
+        return refs
+
+    def __update_ledger(self):
+        # Recently changed references are skipped since their DB rows can be not saved yet
+        self._ledger = set()
+        changed = []
+        for ref in FileReference.objects.only('id', 'path', 'refs', 'changed').iterator():
+            self._ledger.add(ref.path)
+            refs = self._refs.get(ref.path, 0)
+            if ref.refs != refs and ref.changed < self._border:
+                ref.refs = refs
+                changed.append(ref)
+        FileReference.objects.bulk_update(changed, ['refs'], batch_size=FILES_BATCH_SIZE)
+        add_file_references(path for path in self._refs if path not in self._ledger)
+        self._ledger.update(self._refs)
+
+    def __scan_media(self):
+        # Only directories with referenced files are scanned, unknown files there are released
+        unknown = []
+        for directory in self._directories:
+            for path, mtime in self.__scan(os.path.join(settings.MEDIA_ROOT, directory)):
+                name = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+                if name not in self._ledger and mtime < self._border.timestamp():
+                    unknown.append(FileReference(path=name, refs=0, changed=self._border))
+        FileReference.objects.bulk_create(unknown, batch_size=FILES_BATCH_SIZE, ignore_conflicts=True)
+
+    def __scan(self, directory):
+        try:
+            entries = os.scandir(directory)
+        except FileNotFoundError:
+            return
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self.__scan(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry.path, entry.stat(follow_symlinks=False).st_mtime
+
+
+class LedgerStorage(FileSystemStorage):
+    # Stored files are counted in the ledger, deleted files are removed later by collect_released_files()
+    def _save(self, name, content):
+        name = super()._save(name, content)
+        add_file_references([name])
+        return name
+
+    def add_references(self, names):
+        add_file_references(names)
+
+    def delete(self, name):
+        if os.path.isabs(name):
+            name = os.path.relpath(name, self.location).replace(os.sep, '/')
+        release_files([name])
+
+
+class BlobStorage(LedgerStorage):
+    # Files are stored once by sha256 of their content, so equal archives of different reports share one file.
+    # The ledger counts references to each blob, the blob is removed when all its references are released.
+    def get_available_name(self, name, max_length=None):
+        # The name is chosen by the content in _save(), so it is not checked here
+        return name
+
+    def _save(self, name, content):
+        temporary_file_path = getattr(content, 'temporary_file_path', None)
+        if callable(temporary_file_path):
+            # Uploaded file is already on disk, it is linked or copied after the checksum is computed
+            return self.save_from_path(name, temporary_file_path())
+
+        blobs_dir = self.path(BLOBS_DIR)
+        os.makedirs(blobs_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='tmp', dir=blobs_dir)
+        try:
+            # Checksum is computed while the content is written to disk
+            sha256 = hashlib.sha256()
+            with os.fdopen(fd, mode='wb') as fp:
+                for chunk in content.chunks():
+                    sha256.update(chunk)
+                    fp.write(chunk)
+            return self.__add_blob(self.__get_blob_name(name, sha256.hexdigest()), tmp_path, True)
+        finally:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+
+    def save_from_path(self, name, path):
+        sha256 = hashlib.sha256()
+        with open(path, mode='rb') as fp:
+            while True:
+                data = fp.read(BLOB_READ_SIZE)
+                if not data:
+                    break
+                sha256.update(data)
+        return self.__add_blob(self.__get_blob_name(name, sha256.hexdigest()), path, False)
+
+    def __get_blob_name(self, name, check_sum):
+        # Extension is kept since it is used for downloaded files names
+        ext = os.path.splitext(name)[-1]
+        if len(ext) > 10:
+            ext = ''
+        return '/'.join([BLOBS_DIR, check_sum[:2], check_sum[2:4], check_sum + ext])
+
+    def __add_blob(self, name, path, is_temporary):
+        full_path = self.path(name)
+        with transaction.atomic():
+            # The row stays locked until the file is placed, so collect_released_files() can't remove it meanwhile
+            while not FileReference.objects.filter(path=name).update(refs=F('refs') + 1, changed=now()):
+                FileReference.objects.bulk_create([FileReference(path=name, refs=0)], ignore_conflicts=True)
+            SavedFiles.register([name])
+            if os.path.isfile(full_path):
+                return name
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            if is_temporary:
+                os.replace(path, full_path)
+                return name
+            try:
+                os.link(path, full_path)
+            except FileExistsError:
+                pass
+            except OSError:
+                # The file and storage are on different file systems
+                fd, tmp_path = tempfile.mkstemp(prefix='tmp', dir=self.path(BLOBS_DIR))
+                os.close(fd)
+                try:
+                    shutil.copyfile(path, tmp_path)
+                    os.replace(tmp_path, full_path)
+                except Exception:
+                    os.remove(tmp_path)
+                    raise
+        return name
+
+
+blob_storage = BlobStorage()
@@ -0,0 +1,40 @@
+#
+# CVV is a continuous verification visualizer.
+# Copyright (c) 2023 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tools.files import collect_released_files, ReconcileFiles
+
+
+class Command(BaseCommand):
+    help = 'Removes files, which are not referenced in DB. It should be run periodically (e.g., by cron).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delay', dest='delay', type=int, default=None,
+                            help='Remove files released more than this number of seconds ago')
+        parser.add_argument('--reconcile', dest='reconcile', default=False, action='store_true',
+                            help='Check references of files with DB and files in the media directory before')
+
+    def handle(self, *args, **options):
+        try:
+            if options['reconcile']:
+                ReconcileFiles(options['delay'])
+            removed = collect_released_files(options['delay'])
+        except Exception as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS('%s files were removed' % removed))
@@ -0,0 +1,53 @@
+#
+# CVV is a continuous verification visualizer.
+# Copyright (c) 2023 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from jobs.models import Job
+from tools.profiling import ExecLocker
+from tools.utils import Recalculation, RECALCULATION_TYPES
+from web.utils import BridgeException
+
+
+class Command(BaseCommand):
+    help = 'Recalculates caches of reports. It should be run periodically (e.g., by start.sh) for "dirty" caches, ' \
+           'which are left by changes of reports subtrees and marks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', dest='type', default='dirty', choices=list(RECALCULATION_TYPES),
+                            help='Type of recalculation (default is "dirty")')
+        parser.add_argument('--jobs', dest='jobs', type=int, nargs='+', default=None,
+                            help='Identifiers of jobs, caches of all jobs are recalculated by default')
+
+    def handle(self, *args, **options):
+        # Caches are recalculated exclusively with other views like in the manager panel
+        locker = ExecLocker('RecalculateCaches', [Job])
+        locker.lock()
+        try:
+            locker.save_exec_time()
+            recalculation = Recalculation(options['type'], json.dumps(options['jobs']) if options['jobs'] else None)
+        except BridgeException as e:
+            locker.unlock(False)
+            raise CommandError(str(e.message))
+        except Exception as e:
+            locker.unlock(True)
+            raise CommandError(str(e))
+        locker.unlock(False)
+        self.stdout.write(self.style.SUCCESS('Caches were recalculated in %0.3f s' % sum(recalculation.timings.values())))
@@ -0,0 +1,144 @@
+#
+# CVV is a continuous verification visualizer.
+# Copyright (c) 2023 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from bisect import bisect_left
+
+from django.db import connection, transaction
+from django.db.models import F, Sum, Max
+from django.db.models.functions import Greatest
+
+from tools.models import CallStatistic, CallHistogram
+
+# Upper bounds (in seconds) of histogram buckets, the last bucket contains all greater times
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300]
+
+HISTOGRAM_EXEC = 'exec'
+HISTOGRAM_WAIT = 'wait'
+
+PERCENTILES = [50, 95, 99]
+
+
+def get_bucket(value):
+    return bisect_left(LATENCY_BUCKETS, value)
+
+
+def __upsert(model, keys, added, maximums=None):
+    # Values are added to the row with given keys (or the row is created), maximums are updated
+    maximums = maximums or {}
+    table = getattr(model, '_meta').db_table
+    columns = list(keys) + list(added) + list(maximums)
+    params = list(keys.values()) + list(added.values()) + list(maximums.values())
+    insert_sql = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+        table, ', '.join(columns), ', '.join(['%s'] * len(columns))
+    )
+    if connection.vendor in {'postgresql', 'sqlite'}:
+        greatest = 'GREATEST' if connection.vendor == 'postgresql' else 'MAX'
+        updates = list('{1} = {0}.{1} + EXCLUDED.{1}'.format(table, c) for c in added) + \
+            list('{1} = {2}({0}.{1}, EXCLUDED.{1})'.format(table, c, greatest) for c in maximums)
+        sql = '{0} ON CONFLICT ({1}) DO UPDATE SET {2}'.format(insert_sql, ', '.join(keys), ', '.join(updates))
+    elif connection.vendor == 'mysql':
+        updates = list('{0} = {0} + VALUES({0})'.format(c) for c in added) + \
+            list('{0} = GREATEST({0}, VALUES({0}))'.format(c) for c in maximums)
+        sql = '{0} ON DUPLICATE KEY UPDATE {1}'.format(insert_sql, ', '.join(updates))
+    else:
+        with transaction.atomic():
+            obj, created = model.objects.get_or_create(**keys, defaults=dict(added, **maximums))
+            if not created:
+                model.objects.filter(id=obj.id).update(
+                    **dict((c, F(c) + v) for c, v in added.items()),
+                    **dict((c, Greatest(F(c), v)) for c, v in maximums.items())
+                )
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def record_call(name, enter_time, execution_delta, wait1, wait2, is_failed):
+    # Call is added to the statistic and histograms of its minute
+    minute = int(enter_time // 60)
+    __upsert(CallStatistic, {'name': name, 'minute': minute}, {
+        'calls': 1, 'failed': int(is_failed), 'total_exec': execution_delta, 'total_wait': wait1 + wait2
+    }, {
+        'max_exec': execution_delta, 'max_wait1': wait1, 'max_wait2': wait2
+    })
+    for kind, value in [(HISTOGRAM_EXEC, execution_delta), (HISTOGRAM_WAIT, wait1 + wait2)]:
+        __upsert(CallHistogram, {'name': name, 'minute': minute, 'kind': kind, 'bucket': get_bucket(value)},
+                 {'calls': 1})
+
+
+def get_percentile(buckets, percentile):
+    # Returns upper bound of the bucket, which contains the percentile, and if it is greater than all bounds
+    total = sum(buckets.values())
+    if total == 0:
+        return 0, False
+    count = 0
+    for bucket in sorted(buckets):
+        count += buckets[bucket]
+        if count * 100 >= total * percentile:
+            if bucket < len(LATENCY_BUCKETS):
+                return LATENCY_BUCKETS[bucket], False
+            break
+    return LATENCY_BUCKETS[-1], True
+
+
+def get_call_statistic(date1=None, date2=None, func_name=None):
+    # Statistic is aggregated by the database, only summed histograms buckets are loaded
+    filters = {}
+    if isinstance(date1, float):
+        filters['minute__gte'] = int(date1 // 60)
+    if isinstance(date2, float):
+        filters['minute__lte'] = int(date2 // 60)
+    if isinstance(func_name, str):
+        filters['name'] = func_name
+
+    data = {}
+    for stat in CallStatistic.objects.filter(**filters).values('name').annotate(
+            sum_calls=Sum('calls'), sum_failed=Sum('failed'), sum_exec=Sum('total_exec'), sum_wait=Sum('total_wait'),
+            max_max_exec=Max('max_exec'), max_max_wait1=Max('max_wait1'), max_max_wait2=Max('max_wait2')):
+        data[stat['name']] = {
+            'name': stat['name'],
+            'calls': stat['sum_calls'],
+            'failed': stat['sum_failed'],
+            'total_exec': stat['sum_exec'],
+            'average_exec': stat['sum_exec'] / stat['sum_calls'] if stat['sum_calls'] else 0,
+            'max_exec': stat['max_max_exec'],
+            'waiting': stat['sum_wait'],
+            'max_wait1': stat['max_max_wait1'],
+            'max_wait2': stat['max_max_wait2'],
+            HISTOGRAM_EXEC: {},
+            HISTOGRAM_WAIT: {}
+        }
+
+    for hist in CallHistogram.objects.filter(**filters).values('name', 'kind', 'bucket')\
+            .annotate(sum_calls=Sum('calls')):
+        if hist['name'] in data:
+            data[hist['name']][hist['kind']][hist['bucket']] = hist['sum_calls']
+
+    for func in data.values():
+        for kind in [HISTOGRAM_EXEC, HISTOGRAM_WAIT]:
+            buckets = func.pop(kind)
+            func['{0}_percentiles'.format(kind)] = list(
+                (percentile,) + get_percentile(buckets, percentile) for percentile in PERCENTILES
+            )
+    return list(data[fname] for fname in sorted(data))
+
+
+def clear_old_statistic(border_time):
+    minute = int(border_time // 60)
+    CallStatistic.objects.filter(minute__lt=minute).delete()
+    CallHistogram.objects.filter(minute__lt=minute).delete()
@@ -20,11 +20,14 @@
 #
 
 from django.db import models
+from django.utils.timezone import now
 
 
 class LockTable(models.Model):
     name = models.CharField(max_length=64, unique=True, db_index=True)
     locked = models.BooleanField(default=False)
+    # Number of requests, which hold the shared lock
+    shared = models.PositiveIntegerField(default=0)
 
     class Meta:
         db_table = 'lock_table'
@@ -45,3 +48,42 @@ class CallLogs(models.Model):
 
     class Meta:
         db_table = 'tools_call_logs'
+
+
+class CallStatistic(models.Model):
+    name = models.CharField(max_length=64)
+    # Number of minutes since the epoch
+    minute = models.IntegerField()
+    calls = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    total_exec = models.FloatField(default=0)
+    max_exec = models.FloatField(default=0)
+    total_wait = models.FloatField(default=0)
+    max_wait1 = models.FloatField(default=0)
+    max_wait2 = models.FloatField(default=0)
+
+    class Meta:
+        db_table = 'tools_call_statistic'
+        unique_together = ['name', 'minute']
+
+
+class CallHistogram(models.Model):
+    name = models.CharField(max_length=64)
+    minute = models.IntegerField()
+    kind = models.CharField(max_length=4)
+    bucket = models.PositiveSmallIntegerField()
+    calls = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'tools_call_histogram'
+        unique_together = ['name', 'minute', 'kind', 'bucket']
+
+
+class FileReference(models.Model):
+    # Path of the stored file relative to MEDIA_ROOT and number of its references in DB
+    path = models.CharField(max_length=255, unique=True)
+    refs = models.IntegerField(default=0)
+    changed = models.DateTimeField(default=now, db_index=True)
+
+    class Meta:
+        db_table = 'tools_file_reference'
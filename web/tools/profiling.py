@@ -19,15 +19,22 @@
 # limitations under the License.
 #
 
+import hashlib
+import math
 import os
+import random
 import time
+from abc import ABC, abstractmethod
 from datetime import datetime
 
 from django.conf import settings
+from django.db import connection, transaction, DatabaseError, OperationalError
+from django.db.models import F, Q
 from django.db.models.base import ModelBase
 
+from tools.metrics import record_call, get_call_statistic, clear_old_statistic
 from tools.models import LockTable, CallLogs
-from web.utils import BridgeException
+from web.utils import logger, BridgeException
 
 # Waiting while other function try to lock with DB table + try to lock with DB table
 # So maximum waiting time is (MAX_WAITING * 2) in seconds.
@@ -45,19 +52,19 @@ def get_time():
             pass
 
 
-class ExecLocker:
+class TableLock:
+    # Names are locked with rows of LockTable, the file lock is used while rows are checked and locked.
+    # Shared names are counted, they can be locked by several requests but not together with exclusive locks.
     lockfile = os.path.join(settings.BASE_DIR, 'media', '.lock')
 
-    def __init__(self, name, groups):
-        self.call_log = CallLogs.objects.create(name=name, enter_time=get_time())
-        self.names = self.__get_affected_models(groups)
+    def __init__(self, names, waiting_time, shared_names=()):
+        self.names = set(names)
+        self.shared_names = set(shared_names) - self.names
+        self.waiting_time = waiting_time
         self.lock_ids = set()
-        # wait1 and wait2
-        self.waiting_time = [0, 0]
+        self.shared_ids = set()
 
-    def lock(self):
-        if len(self.names) == 0:
-            return
+    def acquire(self):
         # Lock with file while we locking with DB table
         while True:
             try:
@@ -83,47 +90,197 @@ class ExecLocker:
             except FileNotFoundError:
                 pass
 
+    def release(self, is_failed):
+        if not is_failed or settings.UNLOCK_FAILED_REQUESTS:
+            if len(self.lock_ids) > 0:
+                LockTable.objects.filter(id__in=self.lock_ids).update(locked=False)
+            if len(self.shared_ids) > 0:
+                LockTable.objects.filter(id__in=self.shared_ids, shared__gt=0).update(shared=F('shared') - 1)
+
+    def __lock_names(self):
+        names_in_db = set()
+        # Get all created models in table with names in self.block
+        for l in LockTable.objects.filter(name__in=self.names | self.shared_names):
+            names_in_db.add(l.name)
+            if l.name in self.names:
+                self.lock_ids.add(l.id)
+            else:
+                self.shared_ids.add(l.id)
+
+        # Are there models which aren't created yet?
+        # Will be executed maximum 1 time per view function
+        for l_name in self.names - names_in_db:
+            self.lock_ids.add(LockTable.objects.create(name=l_name).id)
+        for l_name in self.shared_names - names_in_db:
+            self.shared_ids.add(LockTable.objects.create(name=l_name).id)
+
+        busy = Q(id__in=self.lock_ids | self.shared_ids, locked=True) | Q(id__in=self.lock_ids, shared__gt=0)
+        while LockTable.objects.filter(busy).exists():
+            time.sleep(0.2)
+            self.waiting_time[1] += 0.2
+            if self.waiting_time[1] > MAX_WAITING:
+                if settings.UNLOCK_FAILED_REQUESTS:
+                    break
+                raise RuntimeError('Not enough time to lock execution of view')
+        # Lock
+        LockTable.objects.filter(id__in=self.lock_ids).update(locked=True)
+        LockTable.objects.filter(id__in=self.shared_ids).update(shared=F('shared') + 1)
+
+
+class AdvisoryLock(ABC):
+    # Names are locked with advisory locks of the database session. All requests acquire them in the same order,
+    # so they can't deadlock. The database waits for the lock itself and releases locks of closed connections,
+    # so failed requests never keep their locks.
+
+    def __init__(self, names, waiting_time, shared_names=()):
+        self.shared_names = set(shared_names) - set(names)
+        self.names = sorted(set(names) | self.shared_names)
+        self.waiting_time = waiting_time
+        self._locked = []
+
+    def acquire(self):
+        start_time = get_time()
+        try:
+            with connection.cursor() as cursor:
+                for name in self.names:
+                    timeout = MAX_WAITING - (get_time() - start_time)
+                    if timeout > 0 and self.lock_name(cursor, name, timeout, name in self.shared_names):
+                        self._locked.append(name)
+                    elif settings.UNLOCK_FAILED_REQUESTS:
+                        break
+                    else:
+                        self.release(True)
+                        raise RuntimeError('Not enough time to lock execution of view')
+        finally:
+            self.waiting_time[1] += get_time() - start_time
+
+    def release(self, is_failed):
+        try:
+            with connection.cursor() as cursor:
+                for name in reversed(self._locked):
+                    if not self.unlock_name(cursor, name, name in self.shared_names):
+                        raise DatabaseError('The lock "%s" is not held by the session' % name)
+        except DatabaseError as e:
+            # Locks which were not released would be kept by the session until its connection is closed
+            logger.error("Can't release locks of the view: %s" % e)
+            self.close_session()
+        finally:
+            self._locked = []
+
+    def close_session(self):
+        # Rollback of the current transaction can't release locks of the session, so the connection is closed
+        self.__is_not_used()
+        connection.close()
+
+    @abstractmethod
+    def lock_name(self, cursor, name, timeout, shared):
+        pass
+
+    @abstractmethod
+    def unlock_name(self, cursor, name, shared):
+        pass
+
+    def __is_not_used(self):
+        pass
+
+
+class PostgresLock(AdvisoryLock):
+    def lock_name(self, cursor, name, timeout, shared):
+        key = self.__get_key(name)
+        mode = '_shared' if shared else ''
+        cursor.execute('SELECT pg_try_advisory_lock%s(%%s)' % mode, [key])
+        if cursor.fetchone()[0]:
+            return True
+        # The lock is busy, so wait for it no more than the timeout
+        cursor.execute("SELECT current_setting('lock_timeout')")
+        lock_timeout = cursor.fetchone()[0]
+        try:
+            with transaction.atomic():
+                cursor.execute("SELECT set_config('lock_timeout', %s, true)", ['%dms' % max(1, timeout * 1000)])
+                cursor.execute('SELECT pg_advisory_lock%s(%%s)' % mode, [key])
+                cursor.execute("SELECT set_config('lock_timeout', %s, true)", [lock_timeout])
+        except OperationalError:
+            return False
+        return True
+
+    def unlock_name(self, cursor, name, shared):
+        cursor.execute('SELECT pg_advisory_unlock%s(%%s)' % ('_shared' if shared else ''), [self.__get_key(name)])
+        return cursor.fetchone()[0]
+
+    def __get_key(self, name):
+        # Signed 64-bit key of the lock
+        self.__is_not_used()
+        return int.from_bytes(hashlib.md5(('cvv.' + name).encode('utf8')).digest()[:8], 'big', signed=True)
+
+    def __is_not_used(self):
+        pass
+
+
+class MySQLLock(AdvisoryLock):
+    # MySQL doesn't have shared named locks, so shared names are locked exclusively
+    def lock_name(self, cursor, name, timeout, shared):
+        cursor.execute('SELECT GET_LOCK(%s, %s)', [self.__get_key(name), math.ceil(timeout)])
+        return cursor.fetchone()[0] == 1
+
+    def unlock_name(self, cursor, name, shared):
+        cursor.execute('SELECT RELEASE_LOCK(%s)', [self.__get_key(name)])
+        return cursor.fetchone()[0] == 1
+
+    def __get_key(self, name):
+        # Names of locks are limited by 64 symbols
+        self.__is_not_used()
+        return 'cvv.' + hashlib.md5(name.encode('utf8')).hexdigest()
+
+    def __is_not_used(self):
+        pass
+
+
+def get_lock_backend():
+    if getattr(settings, 'EXEC_LOCK_BACKEND', 'auto') != 'table':
+        if connection.vendor == 'postgresql':
+            return PostgresLock
+        if connection.vendor == 'mysql':
+            return MySQLLock
+    return TableLock
+
+
+class ExecLocker:
+    def __init__(self, name, groups, shared_groups=()):
+        # Only sampled calls are logged, statistic is collected for all calls
+        self.is_sampled = random.random() < getattr(settings, 'CALL_LOGS_SAMPLE_RATE', 1)
+        self.call_log = CallLogs(name=name, enter_time=get_time())
+        if self.is_sampled:
+            self.call_log.save()
+        self.names = self.__get_affected_models(groups)
+        # Shared names can be locked by several requests at once, but not together with exclusive ones
+        self.shared_names = self.__get_affected_models(shared_groups) - self.names
+        # wait1 and wait2
+        self.waiting_time = [0, 0]
+        self.backend = get_lock_backend()(self.names, self.waiting_time, self.shared_names)
+
+    def lock(self):
+        if len(self.names) == 0 and len(self.shared_names) == 0:
+            return
+        self.backend.acquire()
+
     def unlock(self, is_failed):
         self.call_log.execution_delta = get_time() - self.call_log.execution_time
         self.call_log.is_failed = is_failed
 
-        if (not is_failed or settings.UNLOCK_FAILED_REQUESTS) and len(self.lock_ids) > 0:
-            LockTable.objects.filter(id__in=self.lock_ids).update(locked=False)
+        if len(self.names) > 0 or len(self.shared_names) > 0:
+            self.backend.release(is_failed)
         self.call_log.return_time = get_time()
-        self.call_log.save()
+        if self.is_sampled:
+            self.call_log.save()
+        record_call(self.call_log.name, self.call_log.enter_time, self.call_log.execution_delta,
+                    self.call_log.wait1, self.call_log.wait2, is_failed)
 
     def save_exec_time(self):
         self.call_log.execution_time = get_time()
         self.call_log.wait1 = self.waiting_time[0]
         self.call_log.wait2 = self.waiting_time[1]
-        self.call_log.save()
-
-    def __lock_names(self):
-        can_lock = True
-        names_in_db = set()
-        # Get all created models in table with names in self.block
-        for l in LockTable.objects.filter(name__in=self.names):
-            names_in_db.add(l.name)
-            self.lock_ids.add(l.id)
-            if l.locked:
-                can_lock = False
-
-        # Are there models which aren't created yet?
-        if len(names_in_db) < len(self.names):
-            # Will be executed maximum 1 time per view function
-            for l_name in set(self.names) - set(names_in_db):
-                self.lock_ids.add(LockTable.objects.create(name=l_name).id)
-
-        if not can_lock:
-            while LockTable.objects.filter(id__in=self.lock_ids, locked=True).count() > 0:
-                time.sleep(0.2)
-                self.waiting_time[1] += 0.2
-                if self.waiting_time[1] > MAX_WAITING:
-                    if settings.UNLOCK_FAILED_REQUESTS:
-                        break
-                    raise RuntimeError('Not enough time to lock execution of view')
-        # Lock
-        LockTable.objects.filter(id__in=self.lock_ids).update(locked=True)
+        if self.is_sampled:
+            self.call_log.save()
 
     def __get_affected_models(self, groups):
         block = set()
@@ -174,6 +331,7 @@ def unparallel_group(groups):
 
 class LoggedCallMixin:
     unparallel = []
+    shared_unparallel = []
 
     def dispatch(self, request, *args, **kwargs):
         if not hasattr(super(), 'dispatch'):
@@ -184,7 +342,7 @@ class LoggedCallMixin:
         if callable(get_unparallel):
             self.unparallel = get_unparallel()
 
-        locker = ExecLocker(type(self).__name__, self.unparallel)
+        locker = ExecLocker(type(self).__name__, self.unparallel, self.shared_unparallel)
         locker.lock()
         try:
             locker.save_exec_time()
@@ -208,12 +366,12 @@ class ProfileData:
         date = self.__date_stamp(date)
         if date is None:
             raise ValueError('Wrong date format')
-        return self.__collect_statistic(date - delta_seconds, date + delta_seconds, None)
+        return get_call_statistic(date - delta_seconds, date + delta_seconds)
 
     def get_statistic(self, date1=None, date2=None, func_name=None):
         date1 = self.__date_stamp(date1)
         date2 = self.__date_stamp(date2)
-        return self.__collect_statistic(date1, date2, func_name)
+        return get_call_statistic(date1, date2, func_name)
 
     def get_log_around(self, date, delta_seconds=300):
         date = self.__date_stamp(date)
@@ -256,42 +414,6 @@ class ProfileData:
             })
         return data
 
-    def __collect_statistic(self, date1, date2, func_name):
-        self.__is_not_used()
-        data = {}
-        filters = {}
-        if isinstance(date1, float):
-            filters['enter_time__gt'] = date1
-        if isinstance(date2, float):
-            filters['enter_time__lt'] = date2
-        if isinstance(func_name, str):
-            filters['name'] = func_name
-
-        for call_data in CallLogs.objects.filter(**filters).order_by('id'):
-            if call_data.name not in data:
-                data[call_data.name] = {
-                    'name': call_data.name,
-                    'total_exec': call_data.execution_delta,
-                    'max_exec': call_data.execution_delta,
-                    'waiting': call_data.wait1 + call_data.wait2,
-                    'max_wait1': call_data.wait1,
-                    'max_wait2': call_data.wait2,
-                    'calls': 1,
-                    'failed': 1 if call_data.is_failed else 0
-                }
-            else:
-                data[call_data.name]['total_exec'] += call_data.execution_delta
-                data[call_data.name]['waiting'] += call_data.wait1 + call_data.wait2
-                data[call_data.name]['max_exec'] = max(data[call_data.name]['max_exec'], call_data.execution_delta)
-                data[call_data.name]['max_wait1'] = max(data[call_data.name]['max_wait1'], call_data.wait1)
-                data[call_data.name]['max_wait2'] = max(data[call_data.name]['max_wait2'], call_data.wait2)
-                data[call_data.name]['calls'] += 1
-                if call_data.is_failed:
-                    data[call_data.name]['failed'] += 1
-        for func in data:
-            data[func]['average_exec'] = data[func]['total_exec'] / data[func]['calls']
-        return list(data[fname] for fname in sorted(data))
-
     def __date_stamp(self, date):
         self.__is_not_used()
         if isinstance(date, datetime):
@@ -310,3 +432,5 @@ def clear_old_logs():
     # 30 days exactly
     border_time = time.time() - 2592000
     CallLogs.objects.filter(enter_time__lt=border_time).delete()
+    # Statistic is kept for a year
+    clear_old_statistic(time.time() - 31536000)
@@ -0,0 +1,465 @@
+#
+# CVV is a continuous verification visualizer.
+# Copyright (c) 2019-2023 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import hashlib
+import json
+import os
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.management import call_command
+from django.db.models import Q
+from django.test import override_settings
+
+from jobs.models import Job, JobFile
+from marks.models import MarkSafe, MarkUnsafe, MarkUnknown, MarkSafeReport, MarkUnsafeReport, MarkUnknownReport, \
+    ConvertedTraces, UnknownProblem
+from reports.models import Report, ReportComponent, ReportComponentLeaf, ReportSafe, Component, ComponentInstances, \
+    Computer, DirtyReport, mark_reports_dirty
+from reports.views import UploadReportView
+from reports.test import create_decided_job
+from tools.files import SavedFiles, ReconcileFiles, collect_released_files, release_files, blob_storage, BLOBS_DIR
+from tools.metrics import record_call, get_call_statistic, clear_old_statistic
+from tools.models import LockTable, CallStatistic, CallHistogram, FileReference
+from tools.profiling import AdvisoryLock, TableLock, ExecLocker, get_lock_backend
+from tools.utils import Recalculation, RecalculateLeaves, get_recalculation_tasks, RECALCULATION_TYPES, \
+    RECALCULATION_SHARED_STAGES
+from web.utils import CVTestCase, BridgeException
+
+
+class TestRecalculation(CVTestCase):
+    def setUp(self):
+        super().setUp()
+        component = Component.objects.get_or_create(name='Sub')[0]
+        self.jobs = []
+        for i in range(3):
+            job, root, core = create_decided_job('job%s' % i)
+            parent = core
+            for j in range(3):
+                parent = ReportComponent.objects.create(
+                    root=root, parent=parent, identifier='job%s/%s' % (i, j), component=component,
+                    computer=core.computer, start_date=core.start_date
+                )
+            ReportSafe.objects.create(root=root, parent=parent, identifier='job%s/safe' % i,
+                                      cpu_time=1, wall_time=1, memory=1)
+            self.jobs.append(job)
+
+    def __caches(self):
+        return (
+            sorted(Report.objects.values_list('id', 'path')),
+            sorted(ReportComponentLeaf.objects.values_list('report_id', 'safe_id', 'unsafe_id', 'unknown_id')),
+            sorted(ComponentInstances.objects.values_list('report_id', 'component_id', 'total'))
+        )
+
+    def test_all(self):
+        recalculation = Recalculation('all')
+        self.assertEqual(set(recalculation.timings), set(RECALCULATION_TYPES['all']))
+        caches = self.__caches()
+        self.assertEqual(ReportComponentLeaf.objects.count(), 12)
+
+        Report.objects.update(path='')
+        ReportComponentLeaf.objects.all().delete()
+        ComponentInstances.objects.all().delete()
+        Recalculation('all', json.dumps(list(job.id for job in self.jobs)))
+        self.assertEqual(self.__caches(), caches)
+
+    def test_dirty(self):
+        Recalculation('all')
+        root = self.jobs[0].reportroot
+        other_leaves = set(ReportComponentLeaf.objects.exclude(report__root=root).values_list('id', flat=True))
+        other_instances = set(ComponentInstances.objects.exclude(report__root=root).values_list('id', flat=True))
+
+        parent = ReportComponent.objects.get(identifier='job0/1')
+        safe = ReportSafe.objects.create(root=root, parent=parent, identifier='job0/safe2',
+                                         cpu_time=1, wall_time=1, memory=1)
+        mark_reports_dirty([safe])
+        self.assertEqual(list(DirtyReport.objects.values_list('report_id', flat=True)), [parent.id])
+
+        recalculation = Recalculation('dirty')
+        self.assertEqual(set(recalculation.timings), set(RECALCULATION_TYPES['dirty']))
+        self.assertEqual(DirtyReport.objects.count(), 0)
+        # Caches of other jobs are not recalculated
+        self.assertEqual(set(ReportComponentLeaf.objects.exclude(report__root=root)
+                             .values_list('id', flat=True)), other_leaves)
+        self.assertEqual(set(ComponentInstances.objects.exclude(report__root=root)
+                             .values_list('id', flat=True)), other_instances)
+        # The new leaf is added to the dirty report and all its ancestors
+        self.assertEqual(set(ReportComponentLeaf.objects.filter(safe=safe)
+                             .values_list('report__identifier', flat=True)), {'job0/', 'job0/0', 'job0/1'})
+        caches = self.__caches()
+        Recalculation('all')
+        self.assertEqual(self.__caches(), caches)
+
+    def test_dirty_during_recalculation(self):
+        Recalculation('all')
+        first, second = list(ReportComponent.objects.filter(identifier__in=['job0/2', 'job1/2']).order_by('id'))
+        mark_reports_dirty([first])
+
+        def recalculate_leaves(roots, reports=None):
+            # Report is marked dirty by an upload while the caches are recalculated
+            mark_reports_dirty([first, second])
+            return RecalculateLeaves(roots, reports)
+        with mock.patch('tools.utils.RecalculateLeaves', side_effect=recalculate_leaves):
+            Recalculation('dirty')
+        self.assertEqual(set(DirtyReport.objects.values_list('report_id', flat=True)), {first.id, second.id})
+
+        # Dirty reports are kept if the recalculation fails
+        with mock.patch('tools.utils.RecalculateLeaves', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                Recalculation('dirty')
+        self.assertEqual(set(DirtyReport.objects.values_list('report_id', flat=True)), {first.id, second.id})
+
+        out = StringIO()
+        call_command('RecalculateCaches', stdout=out)
+        self.assertIn('Caches were recalculated', out.getvalue())
+        self.assertEqual(DirtyReport.objects.count(), 0)
+        caches = self.__caches()
+        call_command('RecalculateCaches', type='all', jobs=[self.jobs[0].id], stdout=StringIO())
+        self.assertEqual(self.__caches(), caches)
+
+    def test_tasks(self):
+        roots = list(job.reportroot for job in self.jobs)
+        tasks = get_recalculation_tasks(RECALCULATION_TYPES['all'], roots)
+        # Marks associations are recalculated for all roots by one task, so marks are loaded once
+        for stage in RECALCULATION_TYPES['all']:
+            stage_tasks = list(task_roots for task_stage, task_roots in tasks if task_stage == stage)
+            if stage in RECALCULATION_SHARED_STAGES:
+                self.assertEqual(stage_tasks, [tuple(roots)])
+            else:
+                self.assertEqual(stage_tasks, list((root,) for root in roots))
+
+    def test_errors(self):
+        with self.assertRaises(BridgeException):
+            Recalculation('unsupported')
+        with self.assertRaises(BridgeException):
+            Recalculation('all', json.dumps([self.jobs[0].id, 0]))
+
+
+class MemoryLock(AdvisoryLock):
+    # Advisory locks, which are kept in memory, so the common part of advisory backends can be checked on any database
+    # {<name>: {<holder>: <is shared>}}
+    held = {}
+
+    def __init__(self, names, waiting_time, shared_names=(), fail_unlock=False):
+        super().__init__(names, waiting_time, shared_names)
+        self.fail_unlock = fail_unlock
+        self.history = []
+        self.closed = False
+
+    def lock_name(self, cursor, name, timeout, shared):
+        holders = self.held.get(name, {})
+        if len(holders) > 0 and not (shared and all(holders.values())):
+            return False
+        self.held.setdefault(name, {})[self] = shared
+        self.history.append(('lock', name))
+        return True
+
+    def unlock_name(self, cursor, name, shared):
+        if self.fail_unlock:
+            return False
+        self.history.append(('unlock', name))
+        holders = self.held.get(name, {})
+        is_held = holders.get(self) == shared
+        holders.pop(self, None)
+        if len(holders) == 0:
+            self.held.pop(name, None)
+        return is_held
+
+    def close_session(self):
+        # The database releases all locks of the closed session
+        self.closed = True
+        for name in list(self.held):
+            self.held[name].pop(self, None)
+            if len(self.held[name]) == 0:
+                del self.held[name]
+
+
+class TestLockBackends(CVTestCase):
+    def tearDown(self):
+        MemoryLock.held.clear()
+        super().tearDown()
+
+    def test_backend(self):
+        self.assertIs(get_lock_backend(), TableLock)
+        with self.assertRaises(TypeError):
+            AdvisoryLock(['Job'], [0, 0])
+
+    def test_table_lock(self):
+        lock = TableLock({'Job', 'Report'}, [0, 0])
+        lock.acquire()
+        self.assertEqual(set(LockTable.objects.filter(locked=True).values_list('name', flat=True)), {'Job', 'Report'})
+        with override_settings(UNLOCK_FAILED_REQUESTS=False):
+            lock.release(True)
+        self.assertEqual(LockTable.objects.filter(locked=True).count(), 2)
+        lock.release(False)
+        self.assertEqual(LockTable.objects.filter(locked=True).count(), 0)
+
+    def test_advisory_lock(self):
+        lock = MemoryLock({'Report', 'Job', 'Mark'}, [0, 0])
+        lock.acquire()
+        lock.release(False)
+
+        # Names are locked in the same order by all requests and released in the reverse order
+        self.assertEqual(lock.history, [
+            ('lock', 'Job'), ('lock', 'Mark'), ('lock', 'Report'),
+            ('unlock', 'Report'), ('unlock', 'Mark'), ('unlock', 'Job')
+        ])
+        self.assertEqual(MemoryLock.held, {})
+        self.assertFalse(lock.closed)
+
+    def test_busy_lock(self):
+        other_lock = MemoryLock({'Mark'}, [0, 0])
+        other_lock.acquire()
+        lock = MemoryLock({'Job', 'Mark'}, [0, 0])
+        with override_settings(UNLOCK_FAILED_REQUESTS=False):
+            with self.assertRaises(RuntimeError):
+                lock.acquire()
+        self.assertEqual(MemoryLock.held, {'Mark': {other_lock: False}})
+
+    def test_unlock_failure(self):
+        lock = MemoryLock({'Job'}, [0, 0], {'Mark'}, fail_unlock=True)
+        lock.acquire()
+        lock.release(False)
+        self.assertTrue(lock.closed)
+        self.assertEqual(MemoryLock.held, {})
+
+        # The lock can be acquired again after the session was closed
+        lock = MemoryLock({'Job'}, [0, 0])
+        lock.acquire()
+        self.assertEqual(MemoryLock.held, {'Job': {lock: False}})
+
+    def test_shared_advisory_lock(self):
+        upload1 = MemoryLock({'ReportRoot:1'}, [0, 0], {'ReportRoot', 'Report'})
+        upload2 = MemoryLock({'ReportRoot:2'}, [0, 0], {'ReportRoot', 'Report'})
+        upload1.acquire()
+        upload2.acquire()
+        self.assertEqual(MemoryLock.held['ReportRoot'], {upload1: True, upload2: True})
+
+        # Exclusive locks wait for all shared ones
+        with override_settings(UNLOCK_FAILED_REQUESTS=False):
+            with self.assertRaises(RuntimeError):
+                MemoryLock({'Report'}, [0, 0]).acquire()
+        upload1.release(False)
+        upload2.release(False)
+        self.assertEqual(MemoryLock.held, {})
+
+        job_delete = MemoryLock({'ReportRoot'}, [0, 0])
+        job_delete.acquire()
+        with override_settings(UNLOCK_FAILED_REQUESTS=False):
+            with self.assertRaises(RuntimeError):
+                MemoryLock({'ReportRoot:1'}, [0, 0], {'ReportRoot', 'Report'}).acquire()
+        self.assertEqual(MemoryLock.held, {'ReportRoot': {job_delete: False}})
+
+    def test_shared_table_lock(self):
+        upload1 = TableLock({'ReportRoot:1'}, [0, 0], {'ReportRoot', 'Report'})
+        upload2 = TableLock({'ReportRoot:2'}, [0, 0], {'ReportRoot', 'Report'})
+        upload1.acquire()
+        upload2.acquire()
+        self.assertEqual(dict(LockTable.objects.values_list('name', 'shared')),
+                         {'ReportRoot:1': 0, 'ReportRoot:2': 0, 'ReportRoot': 2, 'Report': 2})
+        self.assertEqual(set(LockTable.objects.filter(locked=True).values_list('name', flat=True)),
+                         {'ReportRoot:1', 'ReportRoot:2'})
+        upload1.release(False)
+        upload2.release(False)
+        self.assertEqual(LockTable.objects.filter(Q(locked=True) | Q(shared__gt=0)).count(), 0)
+
+    def test_upload_conflicts(self):
+        # Uploads of different jobs don't conflict, but wait for views, which change their reports
+        upload1 = ExecLocker('UploadReportView', ['ReportRoot:1'], UploadReportView.shared_unparallel)
+        upload2 = ExecLocker('UploadReportView', ['ReportRoot:2'], UploadReportView.shared_unparallel)
+        self.assertEqual(upload1.names & (upload2.names | upload2.shared_names), set())
+        for groups in [[Job], [MarkSafe, MarkUnsafe, MarkUnknown],
+                       [MarkSafeReport, MarkUnsafeReport, MarkUnknownReport],
+                       [JobFile, ConvertedTraces, Computer, Component, UnknownProblem]]:
+            self.assertNotEqual(ExecLocker('view', groups).names & upload1.shared_names, set())
+
+
+class TestCallStatistic(CVTestCase):
+    def setUp(self):
+        super().setUp()
+        # The beginning of a minute
+        self.time = 1700000040.0
+        record_call('A', self.time, 0.003, 0, 0, False)
+        record_call('A', self.time + 1, 0.2, 1.5, 0.5, True)
+        record_call('A', self.time + 100, 500, 0, 0, False)
+        record_call('B', self.time, 0.02, 0, 0, False)
+
+    def test_statistic(self):
+        self.assertEqual(CallStatistic.objects.count(), 3)
+        statistic = get_call_statistic()
+        self.assertEqual(list(s['name'] for s in statistic), ['A', 'B'])
+        expected = {'calls': 3, 'failed': 1, 'max_exec': 500, 'waiting': 2, 'max_wait1': 1.5, 'max_wait2': 0.5}
+        self.assertEqual(dict((k, statistic[0][k]) for k in expected), expected)
+        self.assertAlmostEqual(statistic[0]['average_exec'], 500.203 / 3)
+
+        # Percentiles are upper bounds of histogram buckets, the last one is greater than all bounds
+        self.assertEqual(statistic[0]['exec_percentiles'], [(50, 0.25, False), (95, 300, True), (99, 300, True)])
+        self.assertEqual(statistic[0]['wait_percentiles'], [(50, 0.005, False), (95, 2.5, False), (99, 2.5, False)])
+
+        statistic = get_call_statistic(self.time - 10, self.time + 10, 'A')
+        self.assertEqual(len(statistic), 1)
+        self.assertEqual((statistic[0]['calls'], statistic[0]['max_exec']), (2, 0.2))
+
+    def test_clear(self):
+        clear_old_statistic(self.time + 60)
+        self.assertEqual(list(CallStatistic.objects.values_list('name', 'calls')), [('A', 1)])
+        self.assertEqual(CallHistogram.objects.count(), 2)
+
+    def test_views_calls(self):
+        locker = ExecLocker('view', [])
+        locker.lock()
+        locker.save_exec_time()
+        locker.unlock(False)
+        self.assertEqual(list((s['name'], s['calls'], s['failed']) for s in get_call_statistic(func_name='view')),
+                         [('view', 1, 0)])
+
+
+class TestFilesLedger(CVTestCase):
+    def __refs(self):
+        return dict(FileReference.objects.values_list('path', 'refs'))
+
+    def test_release(self):
+        job_file = JobFile(hash_sum='ledger')
+        job_file.file.save('ledger.txt', ContentFile(b'ledger'), save=True)
+        path = job_file.file.path
+        self.assertEqual(self.__refs(), {job_file.file.name: 1})
+
+        # The file is removed only after the delay since its release
+        job_file.delete()
+        self.assertEqual(self.__refs(), {job_file.file.name: 0})
+        self.assertTrue(os.path.isfile(path))
+        self.assertEqual(collect_released_files(3600), 0)
+        self.assertTrue(os.path.isfile(path))
+        call_command('CollectFiles', delay=-1, stdout=StringIO())
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(FileReference.objects.count(), 0)
+
+    def test_job_delete(self):
+        job, root, core = create_decided_job('ledger_job')
+        core.log.save('log.zip', ContentFile(b'log'), save=True)
+        safe = ReportSafe(root=root, parent=core, identifier='ledger_job/safe', cpu_time=1, wall_time=1, memory=1)
+        safe.proof.save('proof.zip', ContentFile(b'proof'), save=False)
+        safe.save()
+        paths = [core.log.path, safe.proof.path]
+        self.assertEqual(set(self.__refs().values()), {1})
+
+        # Files of the job are released by the root in bulk, the signals of reports do not release them twice
+        job.delete()
+        self.assertEqual(set(self.__refs().values()), {0})
+        self.assertTrue(all(os.path.isfile(path) for path in paths))
+        self.assertEqual(collect_released_files(-1), 2)
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+    def test_saved_files(self):
+        # References to files saved in the failed block are lost, so the files are released
+        with self.assertRaises(ValueError):
+            with SavedFiles():
+                job_file = JobFile(hash_sum='failed')
+                job_file.file.save('failed.txt', ContentFile(b'failed'), save=False)
+                FileReference.objects.filter(path=job_file.file.name).delete()
+                raise ValueError
+        self.assertEqual(self.__refs(), {job_file.file.name: 0})
+
+    def test_reconcile(self):
+        job, root, core = create_decided_job('reconcile_job')
+        core.log.save('log.zip', ContentFile(b'log'), save=True)
+        orphan = os.path.join(settings.MEDIA_ROOT, 'Unsafes', 'orphan.txt')
+        os.makedirs(os.path.dirname(orphan), exist_ok=True)
+        with open(orphan, mode='w'):
+            pass
+        FileReference.objects.filter(path=core.log.name).update(refs=5)
+        FileReference.objects.create(path='Unsafes/ghost.txt', refs=3)
+        paths = [core.log.name, 'Unsafes/ghost.txt', 'Unsafes/orphan.txt']
+
+        # Recently changed references and files are not fixed
+        ReconcileFiles()
+        self.assertEqual(list(self.__refs().get(path) for path in paths), [5, 3, None])
+
+        ReconcileFiles(-1)
+        self.assertEqual(list(self.__refs().get(path) for path in paths), [1, 0, 0])
+        collect_released_files(-1)
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.isfile(core.log.path))
+        self.assertEqual(list(self.__refs().get(path) for path in paths), [1, None, None])
+
+
+class TestBlobStorage(CVTestCase):
+    def __refs(self, name):
+        return FileReference.objects.get(path=name).refs
+
+    def test_blobs(self):
+        check_sum = hashlib.sha256(b'blob').hexdigest()
+        name = blob_storage.save('Reports/a/log.zip', ContentFile(b'blob'))
+        self.assertEqual(name, '/'.join([BLOBS_DIR, check_sum[:2], check_sum[2:4], check_sum + '.zip']))
+        # Equal files are stored once by their content
+        self.assertEqual(blob_storage.save('Unsafes/b/trace.zip', ContentFile(b'blob')), name)
+        self.assertEqual(self.__refs(name), 2)
+        self.assertNotEqual(blob_storage.save('Reports/a/log.zip', ContentFile(b'other')), name)
+
+        tmp_path = os.path.join(settings.MEDIA_ROOT, 'blob.txt')
+        with open(tmp_path, mode='wb') as fp:
+            fp.write(b'blob')
+        self.assertEqual(blob_storage.save_from_path('log.zip', tmp_path), name)
+        os.remove(tmp_path)
+        self.assertEqual(self.__refs(name), 3)
+
+        uploaded = TemporaryUploadedFile('log.zip', 'application/zip', 4, None)
+        uploaded.write(b'blob')
+        uploaded.seek(0)
+        self.assertEqual(blob_storage.save('log.zip', uploaded), name)
+        uploaded.close()
+        self.assertEqual(self.__refs(name), 4)
+        with blob_storage.open(name) as fp:
+            self.assertEqual(fp.read(), b'blob')
+        # Temporary files are not left in the blobs directory
+        self.assertEqual(list(f for f in os.listdir(blob_storage.path(BLOBS_DIR)) if f.startswith('tmp')), [])
+
+    def test_release(self):
+        name = blob_storage.save('log.zip', ContentFile(b'shared'))
+        blob_storage.save('log.zip', ContentFile(b'shared'))
+        path = blob_storage.path(name)
+
+        # The blob is removed when all its references are released
+        blob_storage.delete(path)
+        self.assertEqual(collect_released_files(-1), 0)
+        self.assertTrue(os.path.isfile(path))
+        release_files([name])
+        self.assertEqual(collect_released_files(-1), 1)
+        self.assertFalse(os.path.exists(path))
+
+        # The removed blob is stored again
+        self.assertEqual(blob_storage.save('log.zip', ContentFile(b'shared')), name)
+        self.assertTrue(os.path.isfile(path))
+        self.assertEqual(self.__refs(name), 1)
+
+    def test_reports(self):
+        job1, root1, core1 = create_decided_job('blob_job1')
+        job2, root2, core2 = create_decided_job('blob_job2')
+        core1.log.save('log.zip', ContentFile(b'equal log'), save=True)
+        core2.log.save('log.zip', ContentFile(b'equal log'), save=True)
+        self.assertEqual(core1.log.name, core2.log.name)
+        self.assertEqual(self.__refs(core1.log.name), 2)
+
+        job1.delete()
+        collect_released_files(-1)
+        self.assertEqual(self.__refs(core2.log.name), 1)
+        with core2.log.open() as fp:
+            self.assertEqual(fp.read(), b'equal log')
@@ -21,22 +21,71 @@
 
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Q, Min
 from django.utils.translation import gettext_lazy as _
 
 import marks.SafeUtils as SafeUtils
 import marks.UnknownUtils as UnknownUtils
 import marks.UnsafeUtils as UnsafeUtils
-from jobs.models import JOBFILE_DIR, JobFile
-from marks.models import CONVERTED_DIR, ConvertedTraces
+from jobs.models import JobFile
+from marks.models import ConvertedTraces, ReportUnsafeTag, ReportSafeTag
 from reports.coverage import FillCoverageCache
-from reports.models import ReportRoot, ReportComponent, ReportSafe, ReportUnsafe, ReportUnknown, ReportComponentLeaf, \
-    ComponentResource, ComponentInstances, CoverageFile, CoverageDataStatistics
-from service.models import FILE_DIR, Solution, Task
+from reports.models import ReportRoot, Report, ReportComponent, ReportSafe, ReportUnsafe, ReportUnknown, \
+    ReportComponentLeaf, ComponentResource, ComponentInstances, CoverageFile, CoverageDirectory, \
+    CoverageDataStatistics, DirtyReport, REPORT_PATH_SEP, mark_reports_dirty
+from tools.files import ReconcileFiles, collect_released_files
 from web.utils import BridgeException, logger
 from web.vars import JOB_WEIGHT
 
+# Stages of marks associations, which are recalculated for all roots at once. Marks are loaded once for them,
+# and unsafe marks comparison starts its own MARKS_COMPARISON_WORKERS processes, so only one such stage runs at a time.
+RECALCULATION_SHARED_STAGES = {'unsafe', 'safe', 'unknown'}
+
+# Stages of caches recalculation, which must be finished for the root before the stage is started
+RECALCULATION_DEPENDENCIES = {
+    'paths': [],
+    'leaves': ['paths'],
+    'unsafe': ['leaves'],
+    'safe': ['leaves'],
+    'unknown': ['leaves'],
+    'resources': [],
+    'compinst': [],
+    'coverage': [],
+    'tags': ['leaves']
+}
+
+# Stages of each recalculation type
+RECALCULATION_TYPES = {
+    'paths': ['paths'],
+    'leaves': ['paths', 'leaves'],
+    'unsafe': ['unsafe'],
+    'safe': ['safe'],
+    'unknown': ['unknown'],
+    'resources': ['resources'],
+    'compinst': ['compinst'],
+    'coverage': ['coverage'],
+    'all': ['paths', 'leaves', 'unsafe', 'safe', 'unknown', 'resources', 'compinst', 'coverage'],
+    'for_uploaded': ['paths', 'leaves', 'unsafe', 'safe', 'unknown', 'compinst', 'coverage'],
+    # Only subtrees of dirty reports are recalculated
+    'dirty': ['leaves', 'tags', 'resources', 'compinst', 'coverage']
+}
+
+
+def get_recalculation_tasks(stages, roots):
+    # Tasks of parallel recalculation: (stage, roots), shared stages are not split by roots
+    tasks = []
+    for stage in stages:
+        if stage in RECALCULATION_SHARED_STAGES:
+            tasks.append((stage, tuple(roots)))
+        else:
+            tasks.extend((stage, (root,)) for root in roots)
+    return tasks
+
 
 def objects_without_relations(table):
     filters = {}
@@ -49,77 +98,158 @@ def objects_without_relations(table):
     return table.objects.filter(**filters)
 
 
+class DirtySubtrees:
+    def __init__(self, reports):
+        reports_ids = set(report.id for report in reports)
+        # Dirty reports, which ancestors are not dirty (subtrees of other dirty reports are inside their subtrees)
+        self.tops = list(report for report in reports if not reports_ids & set(report.ancestors_ids))
+        self.tops_ids = set(report.id for report in self.tops)
+        self.ancestors_ids = set()
+        for report in self.tops:
+            self.ancestors_ids.update(report.ancestors_ids)
+
+    def filter(self, prefix=''):
+        # Filter of reports from subtrees including dirty reports
+        q = Q(**{prefix + 'id__in': self.tops_ids})
+        for report in self.tops:
+            q |= Q(**{prefix + 'path__startswith': report.children_path})
+        return q
+
+
 class ClearFiles:
     def __init__(self):
-        self.__clear_files_with_ref(JobFile, JOBFILE_DIR)
-        self.__clear_files_with_ref(ConvertedTraces, CONVERTED_DIR)
-        self.__clear_service_files()
+        self.__clear_files_with_ref(JobFile)
+        self.__clear_files_with_ref(ConvertedTraces)
+        # Files without references are removed, if they were released earlier than FILES_GC_DELAY seconds ago
+        ReconcileFiles()
+        collect_released_files()
 
-    def __clear_files_with_ref(self, table, files_dir):
+    def __clear_files_with_ref(self, table):
         self.__is_not_used()
         objects_without_relations(table).delete()
 
-        files_in_the_system = set()
         files_to_delete = set()
         for f in table.objects.all():
             file_path = os.path.abspath(os.path.join(settings.MEDIA_ROOT, f.file.name))
-            files_in_the_system.add(file_path)
             if not (os.path.exists(file_path) and os.path.isfile(file_path)):
                 logger.error('Deleted from DB (file not exists): %s' % f.file.name, stack_info=True)
                 files_to_delete.add(f.pk)
         table.objects.filter(id__in=files_to_delete).delete()
-        files_directory = os.path.join(settings.MEDIA_ROOT, files_dir)
-        if os.path.exists(files_directory):
-            files_on_disk = set(os.path.abspath(os.path.join(files_directory, x)) for x in os.listdir(files_directory))
-            for f in files_on_disk - files_in_the_system:
-                os.remove(f)
-
-    def __clear_service_files(self):
-        self.__is_not_used()
-        files_in_the_system = set()
-        for s in Solution.objects.values_list('archive'):
-            files_in_the_system.add(os.path.abspath(os.path.join(settings.MEDIA_ROOT, s[0])))
-        for s in Task.objects.values_list('archive'):
-            files_in_the_system.add(os.path.abspath(os.path.join(settings.MEDIA_ROOT, s[0])))
-        files_directory = os.path.join(settings.MEDIA_ROOT, FILE_DIR)
-        if os.path.exists(files_directory):
-            files_on_disk = set(os.path.abspath(os.path.join(files_directory, x)) for x in os.listdir(files_directory))
-            for f in files_on_disk - files_in_the_system:
-                os.remove(f)
 
     def __is_not_used(self):
         pass
 
 
-class RecalculateLeaves:
+class RecalculateReportsPaths:
     def __init__(self, roots):
         self._roots = roots
-        self._leaves = LeavesData()
         self.__recalc()
 
+    def __recalc(self):
+        reports = {}
+        for report in Report.objects.filter(root__in=self._roots).only('id', 'parent_id', 'path'):
+            reports[report.id] = report
+
+        paths = {}
+        for report in reports.values():
+            branch = []
+            parent_id = report.id
+            while parent_id is not None and parent_id not in paths:
+                branch.append(reports[parent_id])
+                parent_id = reports[parent_id].parent_id
+            for r in reversed(branch):
+                if r.parent_id is None:
+                    paths[r.id] = REPORT_PATH_SEP
+                else:
+                    paths[r.id] = '%s%s%s' % (paths[r.parent_id], r.parent_id, REPORT_PATH_SEP)
+
+        changed = list(r for r in reports.values() if r.path != paths[r.id])
+        for report in changed:
+            report.path = paths[report.id]
+        Report.objects.bulk_update(changed, ['path'], batch_size=1000)
+
+
+class RecalculateLeaves:
+    def __init__(self, roots, reports=None):
+        self._roots = roots
+        self._leaves = LeavesData()
+        if reports is None:
+            self.__recalc()
+        else:
+            self.__recalc_dirty(DirtySubtrees(reports))
+
     def __recalc(self):
         ReportComponentLeaf.objects.filter(report__root__in=self._roots).delete()
         for rc in ReportComponent.objects.filter(root__in=self._roots).order_by('id').only('id', 'parent_id'):
             self._leaves.add(rc)
-        for u in ReportUnsafe.objects.filter(root__in=self._roots).only('id', 'parent_id'):
+        for u in ReportUnsafe.objects.filter(root__in=self._roots).only('id', 'parent_id', 'path'):
             self._leaves.add(u)
-        for s in ReportSafe.objects.filter(root__in=self._roots).only('id', 'parent_id'):
+        for s in ReportSafe.objects.filter(root__in=self._roots).only('id', 'parent_id', 'path'):
             self._leaves.add(s)
-        for f in ReportUnknown.objects.filter(root__in=self._roots).only('id', 'parent_id'):
+        for f in ReportUnknown.objects.filter(root__in=self._roots).only('id', 'parent_id', 'path'):
             self._leaves.add(f)
         self._leaves.upload()
 
+    def __recalc_dirty(self, dirty):
+        # Only leaves from dirty subtrees are changed, they are leaves of reports from subtrees and their ancestors
+        ReportComponentLeaf.objects.filter(
+            dirty.filter('safe__') | dirty.filter('unsafe__') | dirty.filter('unknown__')
+        ).delete()
+        for rc in ReportComponent.objects.filter(Q(id__in=dirty.ancestors_ids) | dirty.filter())\
+                .order_by('id').only('id', 'parent_id'):
+            self._leaves.add(rc)
+        for model in [ReportUnsafe, ReportSafe, ReportUnknown]:
+            for leaf in model.objects.filter(dirty.filter()).only('id', 'parent_id', 'path'):
+                self._leaves.add(leaf)
+        self._leaves.upload()
+
 
 class RecalculateComponentInstances:
-    def __init__(self, roots):
+    def __init__(self, roots, reports=None):
         self.roots = roots
-        self.__recalc()
+        if reports is None:
+            self.__recalc()
+        else:
+            self.__recalc_dirty(DirtySubtrees(reports))
 
     def __recalc(self):
+        ComponentInstances.objects.filter(report__root__in=self.roots).delete()
+        ComponentInstances.objects.bulk_create(self.__collect(
+            ReportComponent.objects.filter(root__in=self.roots), set()
+        ))
+
+    def __recalc_dirty(self, dirty):
+        ComponentInstances.objects.filter(dirty.filter('report__')).delete()
+        ComponentInstances.objects.bulk_create(self.__collect(
+            ReportComponent.objects.filter(dirty.filter()), dirty.tops_ids
+        ))
+
+        # Instances of ancestors are summed from their children from the deepest ancestor to the top one
+        ancestors = ReportComponent.objects.filter(id__in=dirty.ancestors_ids).only('id', 'path', 'component_id')
+        for report in sorted(ancestors, key=lambda x: len(x.ancestors_ids), reverse=True):
+            totals = {report.component_id: 1}
+            for comp_inst in ComponentInstances.objects.filter(report__parent=report.id):
+                totals[comp_inst.component_id] = totals.get(comp_inst.component_id, 0) + comp_inst.total
+            to_update = []
+            for comp_inst in ComponentInstances.objects.filter(report_id=report.id):
+                if comp_inst.component_id not in totals:
+                    comp_inst.delete()
+                    continue
+                comp_inst.total = totals.pop(comp_inst.component_id)
+                to_update.append(comp_inst)
+            ComponentInstances.objects.bulk_update(to_update, ['total'])
+            ComponentInstances.objects.bulk_create(list(
+                ComponentInstances(report_id=report.id, component_id=component_id, total=total)
+                for component_id, total in totals.items()
+            ))
+
+    def __collect(self, reports, tops_ids):
+        # Instances are not counted for ancestors of tops
+        self.__is_not_used()
         report_parents = {}
         inst_cache = {}
-        for report in ReportComponent.objects.filter(root__in=self.roots).order_by('id'):
-            parent_id = report.parent_id
+        for report in reports.order_by('id'):
+            parent_id = report.parent_id if report.id not in tops_ids else None
             report_parents[report.id] = parent_id
             cache_id = (report.id, report.component_id)
             inst_cache[cache_id] = ComponentInstances(report=report, component=report.component, total=1)
@@ -131,26 +261,89 @@ class RecalculateComponentInstances:
                 if parent_id not in report_parents:
                     raise ValueError('Unknown parent found')
                 parent_id = report_parents[parent_id]
-        ComponentInstances.objects.bulk_create(list(inst_cache.values()))
+        return list(inst_cache.values())
 
+    def __is_not_used(self):
+        pass
 
-class RecalculateCoverageCache:
-    def __init__(self, roots):
+
+class RecalculateTagsCache:
+    # Tags of leaves and their numbers for component reports are recalculated without changing marks associations
+    def __init__(self, roots, reports=None):
         self.roots = roots
-        self.__recalc()
+        if reports is None:
+            self.__recalc(Q(root__in=self.roots), Q(report__root__in=self.roots), set())
+        else:
+            dirty = DirtySubtrees(reports)
+            self.__recalc(dirty.filter(), Q(report_id__in=dirty.ancestors_ids) | dirty.filter('report__'),
+                          dirty.ancestors_ids)
 
-    def __recalc(self):
-        CoverageFile.objects.filter(archive__report__root__in=self.roots).delete()
-        CoverageDataStatistics.objects.filter(archive__report__root__in=self.roots).delete()
-        for report in ReportComponent.objects.filter(root__in=self.roots, covnum__gt=0):
+    def __recalc(self, leaves_filter, reports_filter, ancestors_ids):
+        self.__is_not_used()
+        for leaf_lib, model, tags_model, leaf_field in [(UnsafeUtils, ReportUnsafe, ReportUnsafeTag, 'unsafe'),
+                                                        (SafeUtils, ReportSafe, ReportSafeTag, 'safe')]:
+            tags_model.objects.filter(reports_filter).delete()
+            leaves_ids = set(model.objects.filter(leaves_filter).values_list('id', flat=True))
+            # Numbers of tags for ancestors are summed by all their leaves, so it is enough to add one of them
+            leaves_ids.update(leaf_id for leaf_id, in ReportComponentLeaf.objects
+                              .filter(report_id__in=ancestors_ids).exclude(**{leaf_field: None})
+                              .values('report_id').annotate(leaf_id=Min(leaf_field + '_id')).values_list('leaf_id'))
+            leaf_lib.RecalculateTags(list(model.objects.filter(id__in=leaves_ids)))
+
+    def __is_not_used(self):
+        pass
+
+
+class RecalculateCoverageCache:
+    def __init__(self, roots, reports=None):
+        self.roots = roots
+        if reports is None:
+            self.__recalc(Q(root__in=self.roots))
+        else:
+            self.__recalc(DirtySubtrees(reports).filter())
+
+    def __recalc(self, reports_filter):
+        reports = ReportComponent.objects.filter(reports_filter)
+        CoverageFile.objects.filter(archive__report__in=reports).delete()
+        CoverageDirectory.objects.filter(archive__report__in=reports).delete()
+        CoverageDataStatistics.objects.filter(archive__report__in=reports).delete()
+        for report in reports.filter(covnum__gt=0):
             FillCoverageCache(report)
 
 
 class Recalculation:
     def __init__(self, rec_type, jobs=None):
+        if rec_type not in RECALCULATION_TYPES:
+            logger.error('Wrong type of recalculation')
+            raise BridgeException()
         self.type = rec_type
         self._roots = self.__get_roots(jobs)
-        self.__recalc()
+        self._stages = RECALCULATION_TYPES[self.type]
+        # Dirty component reports of each root, caches are recalculated only for their subtrees
+        self._dirty = None
+        if self.type == 'dirty':
+            self._dirty = self.__claim_dirty()
+            self._roots = self._roots.filter(id__in=list(self._dirty))
+        # Total time of each stage for all roots in seconds
+        self.timings = dict((stage, 0) for stage in self._stages)
+        try:
+            self.__recalc()
+        except Exception:
+            if self._dirty:
+                # Reports are recalculated by the next "dirty" recalculation
+                mark_reports_dirty(list(report for reports in self._dirty.values() for report in reports))
+            raise
+
+    def __claim_dirty(self):
+        # Dirty marks are removed before the recalculation, so reports marked during it stay dirty
+        dirty = {}
+        with transaction.atomic():
+            dirty_reports = list(DirtyReport.objects.select_for_update().filter(root__in=self._roots)
+                                 .select_related('report'))
+            DirtyReport.objects.filter(id__in=list(d.id for d in dirty_reports)).delete()
+        for d in dirty_reports:
+            dirty.setdefault(d.root_id, []).append(d.report)
+        return dirty
 
     def __get_roots(self, job_ids):
         self.__is_not_used()
@@ -165,47 +358,84 @@ class Recalculation:
         return roots
 
     def __recalc(self):
-        if self.type == 'leaves':
-            RecalculateLeaves(self._roots)
-        elif self.type == 'unsafe':
-            UnsafeUtils.RecalculateConnections(self._roots)
-        elif self.type == 'safe':
-            SafeUtils.RecalculateConnections(self._roots)
-        elif self.type == 'unknown':
-            UnknownUtils.RecalculateConnections(self._roots)
-        elif self.type == 'resources':
-            RecalculateResources(self._roots)
-        elif self.type == 'compinst':
-            RecalculateComponentInstances(self._roots)
-        elif self.type == 'coverage':
-            RecalculateCoverageCache(self._roots)
-        elif self.type == 'all':
-            RecalculateLeaves(self._roots)
-            UnsafeUtils.RecalculateConnections(self._roots)
-            SafeUtils.RecalculateConnections(self._roots)
-            UnknownUtils.RecalculateConnections(self._roots)
-            RecalculateResources(self._roots)
-            RecalculateComponentInstances(self._roots)
-            RecalculateCoverageCache(self._roots)
-        elif self.type == 'for_uploaded':
-            RecalculateLeaves(self._roots)
-            UnsafeUtils.RecalculateConnections(self._roots)
-            SafeUtils.RecalculateConnections(self._roots)
-            UnknownUtils.RecalculateConnections(self._roots)
-            RecalculateComponentInstances(self._roots)
-            RecalculateCoverageCache(self._roots)
+        start_time = time.time()
+        workers = self.__get_workers()
+        if workers > 1:
+            self.__recalc_parallel(workers)
         else:
-            logger.error('Wrong type of recalculation')
-            raise BridgeException()
+            for stage in self._stages:
+                self.timings[stage] += self.__recalc_stage(stage, self._roots)
+        logger.info('Recalculation "%s" took %0.3f s (%s)' % (self.type, time.time() - start_time, ', '.join(
+            '%s: %0.3f s' % (stage, self.timings[stage]) for stage in self._stages
+        )))
+
+    def __get_workers(self):
+        # Other connections are locked by SQLite and do not see changes of the current transaction
+        if connection.vendor == 'sqlite' or connection.in_atomic_block:
+            return 1
+        return min(getattr(settings, 'RECALCULATION_WORKERS', 1), len(self._roots) * len(self._stages))
+
+    def __recalc_parallel(self, workers):
+        # Stages of different roots and independent stages of the same root are recalculated concurrently
+        waiting = get_recalculation_tasks(self._stages, list(self._roots))
+        finished = set()
+        running = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while waiting or running:
+                for stage, roots in list(waiting):
+                    if all((dep, root.id) in finished for dep in RECALCULATION_DEPENDENCIES[stage]
+                           if dep in self._stages for root in roots):
+                        waiting.remove((stage, roots))
+                        running[executor.submit(self.__recalc_in_thread, stage, roots)] = (stage, roots)
+                for future in wait(running, return_when=FIRST_COMPLETED)[0]:
+                    stage, roots = running.pop(future)
+                    self.timings[stage] += future.result()
+                    finished.update((stage, root.id) for root in roots)
+
+    def __recalc_in_thread(self, stage, roots):
+        # Each thread uses its own database connection, which must be closed
+        try:
+            return self.__recalc_stage(stage, list(roots))
+        finally:
+            connections.close_all()
+
+    def __recalc_stage(self, stage, roots):
+        start_time = time.time()
+        reports = None
+        if self._dirty is not None:
+            reports = list(report for root in roots for report in self._dirty[root.id])
+        if stage == 'paths':
+            RecalculateReportsPaths(roots)
+        elif stage == 'leaves':
+            RecalculateLeaves(roots, reports)
+        elif stage == 'unsafe':
+            UnsafeUtils.RecalculateConnections(roots)
+        elif stage == 'safe':
+            SafeUtils.RecalculateConnections(roots)
+        elif stage == 'unknown':
+            UnknownUtils.RecalculateConnections(roots)
+        elif stage == 'resources':
+            RecalculateResources(roots, reports)
+        elif stage == 'compinst':
+            RecalculateComponentInstances(roots, reports)
+        elif stage == 'coverage':
+            RecalculateCoverageCache(roots, reports)
+        elif stage == 'tags':
+            RecalculateTagsCache(roots, reports)
+        return time.time() - start_time
 
     def __is_not_used(self):
         pass
 
 
 class RecalculateResources:
-    def __init__(self, roots):
+    def __init__(self, roots, reports=None):
         self._roots = list(root for root in roots if root.job.weight == JOB_WEIGHT[0][0])
-        self.__recalc()
+        if reports is None:
+            self.__recalc()
+        else:
+            roots_ids = set(root.id for root in self._roots)
+            self.__recalc_dirty(DirtySubtrees(list(report for report in reports if report.root_id in roots_ids)))
 
     def __recalc(self):
         ComponentResource.objects.filter(report__root__in=self._roots).delete()
@@ -214,10 +444,32 @@ class RecalculateResources:
             rd.add(rep)
         ComponentResource.objects.bulk_create(rd.cache_for_db())
 
+    def __recalc_dirty(self, dirty):
+        ComponentResource.objects.filter(dirty.filter('report__')).delete()
+        rd = ResourceData(dirty.tops_ids)
+        for rep in ReportComponent.objects.filter(dirty.filter()).order_by('id'):
+            rd.add(rep)
+        ComponentResource.objects.bulk_create(rd.cache_for_db())
+
+        # Resources of ancestors are merged from their children from the deepest ancestor to the top one
+        ancestors = ReportComponent.objects.filter(id__in=dirty.ancestors_ids)
+        for report in sorted(ancestors, key=lambda x: len(x.ancestors_ids), reverse=True):
+            ComponentResource.objects.filter(report_id=report.id).delete()
+            rd = ResourceData({report.id})
+            rd.add(report)
+            children_resources = {}
+            for compres in ComponentResource.objects.filter(report__parent=report.id):
+                children_resources.setdefault(compres.report_id, []).append(compres)
+            for resources in children_resources.values():
+                rd.merge(report.id, resources)
+            ComponentResource.objects.bulk_create(rd.cache_for_db())
+
 
 class ResourceData(object):
-    def __init__(self):
+    def __init__(self, tops_ids=None):
         self._data = {}
+        # Resources are not added to parents of these reports
+        self._tops_ids = tops_ids or set()
         self._resources = self.ResourceCache()
 
     class ResourceCache(object):
@@ -230,6 +482,22 @@ class ResourceData(object):
             self.__recalculate((report_id, data['component']), data)
             self.__recalculate((report_id, 't'), data)
 
+        def merge(self, report_id, resources):
+            # Cached resources of the child report are added to the report
+            total = None
+            for compres in resources:
+                data = {'ct': compres.cpu_time, 'wt': compres.wall_time, 'm': compres.memory}
+                if compres.component_id is None:
+                    total = data
+                else:
+                    self.__recalculate((report_id, compres.component_id), data)
+            if total is not None:
+                # Total resources of the child report were calculated for several reports
+                self.__recalculate((report_id, 't'), total)
+                self._data[(report_id, 't')][3] = False
+            elif len(resources) == 1:
+                self.__recalculate((report_id, 't'), data)
+
         def get_all(self):
             all_data = []
             for d in self._data:
@@ -266,10 +534,11 @@ class ResourceData(object):
     def add(self, report):
         if not isinstance(report, ReportComponent):
             raise ValueError('Value must be ReportComponent object')
-        self._data[report.pk] = {'id': report.pk, 'parent': report.parent_id}
+        parent_id = report.parent_id if report.pk not in self._tops_ids else None
+        self._data[report.pk] = {'id': report.pk, 'parent': parent_id}
         self.__update_resources({
             'id': report.pk,
-            'parent': report.parent_id,
+            'parent': parent_id,
             'component': report.component_id,
             'wt': report.wall_time,
             'ct': report.cpu_time,
@@ -288,6 +557,9 @@ class ResourceData(object):
             else:
                 d = None
 
+    def merge(self, report_id, resources):
+        self._resources.merge(report_id, resources)
+
     def cache_for_db(self):
         return list(ComponentResource(**d) for d in self._resources.get_all())
 
@@ -305,8 +577,7 @@ class LeavesData(object):
                 'unknowns': []
             }
         else:
-            parent_id = report.parent_id
-            while parent_id is not None:
+            for parent_id in report.ancestors_ids:
                 if parent_id in self._data:
                     if isinstance(report, ReportSafe):
                         self._data[parent_id]['safes'].append(report.id)
@@ -314,7 +585,6 @@ class LeavesData(object):
                         self._data[parent_id]['unsafes'].append(report.id)
                     elif isinstance(report, ReportUnknown):
                         self._data[parent_id]['unknowns'].append(report.id)
-                parent_id = self._data[parent_id]['parent']
 
     def upload(self):
         new_leaves = []
@@ -31,13 +31,14 @@ from django.utils.translation import gettext as _, activate
 
 from jobs.models import Job, JobFile
 from marks.UnsafeUtils import ConnectMarks, RecalculateTags
-from marks.models import ErrorTraceConvertionCache, MarkUnsafeReview
+from marks.models import ErrorTraceConvertionCache, ErrorTraceFingerprint, MarkUnsafeReview
 from marks.models import MarkUnsafe, MarkUnsafeHistory, UnknownProblem, ConvertedTraces
+from reports.mea.cache import clear_cached_traces
 from reports.mea.core import CACHED_CONVERSION_FUNCTIONS
-from reports.models import Component, Computer, JobViewAttrs
+from reports.models import Component, Computer, JobViewAttrs, mark_reports_dirty
 from service.models import Task
 from tools.models import LockTable
-from tools.profiling import unparallel_group, ProfileData, clear_old_logs, ExecLocker
+from tools.profiling import unparallel_group, ProfileData, clear_old_logs, TableLock
 from tools.utils import objects_without_relations, ClearFiles, Recalculation
 from web.utils import BridgeException, logger
 from web.vars import USER_ROLES, JOB_STATUS, UNKNOWN_ERROR
@@ -130,6 +131,7 @@ def resolve_marks(request):
             last_v = MarkUnsafeHistory.objects.get(mark=mark, version=F('mark__version'))
             changes = ConnectMarks([mark], last_v.similarity, json.loads(last_v.args)).changes.get(mark.id, [])
             RecalculateTags(list(changes))
+            mark_reports_dirty(list(changes))
             mark.optimizations = 0
             mark.save()
         except Exception as e:
@@ -250,6 +252,9 @@ def clear_cet(request):
             if not (cet_f in CACHED_CONVERSION_FUNCTIONS and cet_args == "{}"):
                 removed_records += num
                 ErrorTraceConvertionCache.objects.filter(function=cet_f, args=cet_args).delete()
+                ErrorTraceFingerprint.objects.filter(function=cet_f, args=cet_args).delete()
+    if removed_records:
+        clear_cached_traces()
 
     return JsonResponse({'message': str(removed_records) + _(' unused converted error traces of ') +
                                     str(all_records) + _(' have been deleted')})
@@ -262,6 +267,8 @@ def clear_all_cet(request):
 
     all_records = ErrorTraceConvertionCache.objects.count()
     ErrorTraceConvertionCache.objects.all().delete()
+    ErrorTraceFingerprint.objects.all().delete()
+    clear_cached_traces()
 
     return JsonResponse({'message': str(all_records) + _(' converted error traces have been deleted')})
 
@@ -302,7 +309,7 @@ def manual_unlock(request):
         raise PermissionDenied()
     LockTable.objects.all().delete()
     try:
-        os.remove(ExecLocker.lockfile)
+        os.remove(TableLock.lockfile)
     except FileNotFoundError:
         pass
     return HttpResponse('<h1>Success!</h1>')
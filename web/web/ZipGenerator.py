@@ -23,10 +23,26 @@ import os
 import struct
 import time
 import zlib
-from zipfile import ZipInfo, ZIP_DEFLATED, ZIP64_LIMIT, ZIP_FILECOUNT_LIMIT
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipInfo, ZIP_DEFLATED, ZIP_STORED, ZIP64_LIMIT, ZIP_FILECOUNT_LIMIT
+
+from django.conf import settings
 
 CHUNK_SIZE = 1024 * 64
 
+# Files with such extensions are already compressed, so they are stored without compression
+STORED_EXTENSIONS = {'.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.zst', '.png', '.jpg', '.jpeg', '.gif'}
+
+# Signatures of already compressed data (zip, gzip, bzip2, xz, 7z, zstd, png, jpeg)
+COMPRESSED_SIGNATURES = (
+    b'PK\x03\x04', b'PK\x05\x06', b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00', b'7z\xbc\xaf\x27\x1c', b'\x28\xb5\x2f\xfd',
+    b'\x89PNG', b'\xff\xd8\xff'
+)
+
+# Files, which are larger, are compressed by chunks in the main thread instead of workers
+PARALLEL_MAX_FILE_SIZE = 1024 * 1024 * 16
+
 
 class LargeZipFile(Exception):
     pass
@@ -46,40 +62,67 @@ stringEndArchive64 = b"PK\x06\x06"
 stringDataDescriptor = b"PK\x07\x08"  # magic number for data descriptor
 
 
+def is_compressed(arcname, head=b''):
+    return os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS or head.startswith(COMPRESSED_SIGNATURES)
+
+
+def join_chunks(datagen, size=CHUNK_SIZE):
+    # Small pieces of data are joined into chunks of at least the given size, each piece is copied only once
+    chunk = []
+    chunk_size = 0
+    for data in datagen:
+        chunk.append(data)
+        chunk_size += len(data)
+        if chunk_size > size:
+            yield b''.join(chunk)
+            chunk = []
+            chunk_size = 0
+    if chunk_size > 0:
+        yield b''.join(chunk)
+
+
 class ZipStream:
-    def __init__(self):
+    def __init__(self, compress_level=None, workers=None):
         self._filelist = []
         self._data_p = 0
+        self._compress_level = compress_level if compress_level is not None else \
+            getattr(settings, 'ZIP_COMPRESSION_LEVEL', zlib.Z_DEFAULT_COMPRESSION)
+        self._workers = workers if workers is not None else getattr(settings, 'ZIP_COMPRESSION_WORKERS', 1)
 
     def __get_data(self, data):
         self._data_p += len(data)
         return data
 
+    def __get_compressor(self, zinfo, arcname, head):
+        if is_compressed(arcname, head):
+            zinfo.compress_type = ZIP_STORED
+            return None
+        zinfo.compress_type = ZIP_DEFLATED
+        return zlib.compressobj(self._compress_level, zlib.DEFLATED, -15)
+
     def compress_file(self, filename, arcname):
         st = os.stat(filename)
         zinfo = ZipInfo(arcname, time.localtime(time.time())[:6])
         zinfo.external_attr = (st[0] & 0xFFFF) << 16
-        zinfo.compress_type = ZIP_DEFLATED
         zinfo.flag_bits = 0x08
         zinfo.header_offset = self._data_p
 
-        cmpr = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
         with open(filename, "rb") as fp:
+            buf = fp.read(CHUNK_SIZE)
+            cmpr = self.__get_compressor(zinfo, arcname, buf)
             zinfo.CRC = crc = 0
             zinfo.compress_size = 0
             zinfo.file_size = 0
             yield self.__get_data(zinfo.FileHeader())
 
-            while 1:
-                buf = fp.read(CHUNK_SIZE)
-                if not buf:
-                    break
+            while buf:
                 zinfo.file_size += len(buf)
                 crc = zlib.crc32(buf, crc) & 0xffffffff
                 if cmpr:
                     buf = cmpr.compress(buf)
                     zinfo.compress_size += len(buf)
                 yield self.__get_data(buf)
+                buf = fp.read(CHUNK_SIZE)
         if cmpr:
             buf = cmpr.flush()
             zinfo.compress_size += len(buf)
@@ -94,30 +137,75 @@ class ZipStream:
         yield self.__get_data(data_descriptor)
         self._filelist.append(zinfo)
 
+    def __deflate_file(self, filename, arcname):
+        # Executed in worker threads (zlib releases GIL), so the stream is not changed here
+        st = os.stat(filename)
+        if st.st_size > PARALLEL_MAX_FILE_SIZE:
+            return None
+        with open(filename, "rb") as fp:
+            data = fp.read()
+        if is_compressed(arcname, data[:CHUNK_SIZE]):
+            return None
+        cmpr = zlib.compressobj(self._compress_level, zlib.DEFLATED, -15)
+        return st[0], len(data), zlib.crc32(data) & 0xffffffff, cmpr.compress(data) + cmpr.flush()
+
+    def __write_deflated(self, filename, arcname, future):
+        deflated = future.result()
+        if deflated is None:
+            yield from self.compress_file(filename, arcname)
+            return
+        mode, file_size, crc, data = deflated
+        zinfo = ZipInfo(arcname, time.localtime(time.time())[:6])
+        zinfo.external_attr = (mode & 0xFFFF) << 16
+        zinfo.compress_type = ZIP_DEFLATED
+        zinfo.file_size = file_size
+        zinfo.compress_size = len(data)
+        zinfo.header_offset = self._data_p
+        zinfo.CRC = crc
+        zip64 = zinfo.file_size > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT
+
+        yield self.__get_data(zinfo.FileHeader(zip64))
+        yield self.__get_data(data)
+        self._filelist.append(zinfo)
+
+    def compress_files(self, files):
+        # Files [(<filename>, <arcname>)] are deflated in parallel, but they are written in the given order
+        if self._workers <= 1:
+            for filename, arcname in files:
+                yield from self.compress_file(filename, arcname)
+            return
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            futures = deque()
+            for filename, arcname in files:
+                futures.append((filename, arcname, executor.submit(self.__deflate_file, filename, arcname)))
+                if len(futures) >= self._workers * 2:
+                    yield from self.__write_deflated(*futures.popleft())
+            while futures:
+                yield from self.__write_deflated(*futures.popleft())
+
     def compress_buffer(self, arcname, buffer):
         zinfo = ZipInfo(filename=arcname, date_time=time.localtime(time.time())[:6])
-        zinfo.compress_type = ZIP_DEFLATED
         zinfo.compress_size = 0
         zinfo.flag_bits = 0x08
         zinfo.external_attr = 0o600 << 16
         zinfo.file_size = 0
         zinfo.header_offset = self._data_p
         zinfo.CRC = crc = 0
-        cmpr = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+
+        buffer.seek(0)
+        buf = buffer.read(CHUNK_SIZE)
+        cmpr = self.__get_compressor(zinfo, arcname, buf)
 
         yield self.__get_data(zinfo.FileHeader())
 
-        buffer.seek(0)
-        while 1:
-            buf = buffer.read(CHUNK_SIZE)
-            if not buf:
-                break
+        while buf:
             zinfo.file_size += len(buf)
             crc = zlib.crc32(buf, crc) & 0xffffffff
             if cmpr:
                 buf = cmpr.compress(buf)
                 zinfo.compress_size += len(buf)
             yield self.__get_data(buf)
+            buf = buffer.read(CHUNK_SIZE)
 
         if cmpr:
             buf = cmpr.flush()
@@ -139,12 +227,11 @@ class ZipStream:
         if isinstance(data, str):
             data = data.encode("utf-8")
         zinfo = ZipInfo(filename=arcname, date_time=time.localtime(time.time())[:6])
-        zinfo.compress_type = ZIP_DEFLATED
         zinfo.external_attr = 0o600 << 16
         zinfo.file_size = len(data)
         zinfo.header_offset = self._data_p
         zinfo.CRC = zlib.crc32(data) & 0xffffffff
-        cmpr = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        cmpr = self.__get_compressor(zinfo, arcname, data[:CHUNK_SIZE])
         if cmpr:
             data = cmpr.compress(data) + cmpr.flush()
             zinfo.compress_size = len(data)
@@ -159,22 +246,23 @@ class ZipStream:
     def compress_stream(self, arcname, datagen):
         zinfo = ZipInfo(arcname, time.localtime(time.time())[:6])
         zinfo.external_attr = 0o600 << 16
-        zinfo.compress_type = ZIP_DEFLATED
         zinfo.flag_bits = 0x08
         zinfo.header_offset = self._data_p
 
-        cmpr = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        cmpr = None
         zinfo.CRC = crc = 0
         zinfo.compress_size = 0
         zinfo.file_size = 0
 
-        yield self.__get_data(zinfo.FileHeader())
-
         counter = 0
         for buf in datagen:
             counter += 1
             if not buf:
                 continue
+            if not zinfo.file_size:
+                # Compression is selected by the first data of the stream
+                cmpr = self.__get_compressor(zinfo, arcname, buf)
+                yield self.__get_data(zinfo.FileHeader())
             zinfo.file_size += len(buf)
             crc = zlib.crc32(buf, crc) & 0xffffffff
             if cmpr:
@@ -183,6 +271,9 @@ class ZipStream:
             yield self.__get_data(buf)
         if not counter:
             return
+        if not zinfo.file_size:
+            cmpr = self.__get_compressor(zinfo, arcname, b'')
+            yield self.__get_data(zinfo.FileHeader())
 
         if cmpr:
             buf = cmpr.flush()
@@ -176,3 +176,60 @@ LOGGING = {
 }
 
 MAX_FILE_SIZE = 104857600  # 100MB
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Converted error traces, which are shared between processes.
+    'converted_traces': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(MEDIA_ROOT, 'ConvertedTracesCache'),
+        'TIMEOUT': 604800,  # 1 week
+        'OPTIONS': {'MAX_ENTRIES': 100000}
+    },
+    # Rendered error traces and processed correctness witnesses.
+    'rendered_traces': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(MEDIA_ROOT, 'RenderedTracesCache'),
+        'TIMEOUT': 604800,  # 1 week
+        'OPTIONS': {'MAX_ENTRIES': 100000}
+    }
+}
+
+# Maximum total size of converted error traces, which are cached in each process.
+CONVERTED_TRACES_CACHE_SIZE = 268435456  # 256MB
+
+# Number of processes for comparison of error traces during unsafe marks association (1 - do not use processes).
+# Each process loads Django and edited error traces, so the number is limited on machines with many CPUs.
+MARKS_COMPARISON_WORKERS = min(os.cpu_count() or 1, 4)
+
+# Compression level of generated zip archives (from 0 to 9, -1 - default zlib level).
+ZIP_COMPRESSION_LEVEL = -1
+
+# Number of threads for compression of files in generated zip archives (1 - do not use threads).
+ZIP_COMPRESSION_WORKERS = os.cpu_count() or 1
+
+# Locks of views execution: 'auto' - advisory locks of PostgreSQL or MySQL database (lock file and table are used
+# for other databases), 'table' - always use lock file and table.
+EXEC_LOCK_BACKEND = 'auto'
+
+# Part of views calls, which are logged with all details (from 0 to 1). Statistic is collected for all calls.
+CALL_LOGS_SAMPLE_RATE = 0.05
+
+# Number of threads for caches recalculation of different jobs (1 - do not use threads).
+# Marks associations are recalculated for all jobs in one thread, it can start MARKS_COMPARISON_WORKERS processes.
+RECALCULATION_WORKERS = min(os.cpu_count() or 1, 4)
+
+# Files are counted in the ledger of references (tools.files), deleted files are removed later
+STORAGES = {
+    'default': {'BACKEND': 'tools.files.LedgerStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}
+}
+
+# Files without references are removed not earlier than in this number of seconds after they were released.
+FILES_GC_DELAY = 3600
+
+# Maximum number of seconds of the launcher execution by queue workers (see LaunchWorkers command). Launches, which
+# are processed longer, are failed since their workers were stopped.
+LAUNCH_TIMEOUT = 3600
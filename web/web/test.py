@@ -21,6 +21,10 @@
 
 import json
 import os
+import random
+import tempfile
+import zipfile
+from io import BytesIO
 
 from django.conf import settings
 from django.urls import reverse
@@ -29,6 +33,7 @@ from marks.models import MarkUnknown, SafeTag, UnsafeTag
 from users.models import User, Extended
 from web.populate import populate_users
 from web.utils import CVTestCase
+from web.ZipGenerator import ZipStream, is_compressed
 from web.vars import USER_ROLES
 
 
@@ -147,3 +152,65 @@ class TestPopulation(CVTestCase):
         # Population after service and manager were created by function call
         response = self.client.post(reverse('population'))
         self.assertEqual(response.status_code, 200)
+
+
+class TestZipStream(CVTestCase):
+    def setUp(self):
+        super(TestZipStream, self).setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        rnd = random.Random(13)
+        self.contents = {
+            'dir/text.txt': b''.join(b'line %d\n' % i for i in range(5000)),
+            'dir/empty.txt': b'',
+            'dir/archive.zip': self.__zip_data('a.txt', b'hello' * 1000),
+            'dir/random.bin': bytes(rnd.getrandbits(8) for _ in range(100000)),
+            'dir/gzipped.dat': b'\x1f\x8b' + b'\x00' * 1000
+        }
+        self.files = []
+        for arcname, data in self.contents.items():
+            path = os.path.join(self.tmp_dir.name, os.path.basename(arcname))
+            with open(path, mode='wb') as fp:
+                fp.write(data)
+            self.files.append((path, arcname))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        super(TestZipStream, self).tearDown()
+
+    def __zip_data(self, arcname, data):
+        stream = ZipStream()
+        return b''.join(list(stream.compress_string(arcname, data)) + [stream.close_stream()])
+
+    def test_compress(self):
+        for workers in (1, 4):
+            for level in (-1, 0, 9):
+                stream = ZipStream(compress_level=level, workers=workers)
+                data = b''.join(stream.compress_files(self.files))
+                data += b''.join(stream.compress_string('data.json', '{"a": 1}'))
+                data += b''.join(stream.compress_stream('inner.zip', iter([self.__zip_data('x.txt', 'abc' * 100)])))
+                data += b''.join(stream.compress_stream('no_data.txt', iter([])))
+                data += b''.join(stream.compress_buffer('buffer.txt', BytesIO(b'buffer' * 100)))
+                data += stream.close_stream()
+
+                with zipfile.ZipFile(BytesIO(data)) as zfp:
+                    self.assertIsNone(zfp.testzip())
+                    for arcname, content in self.contents.items():
+                        self.assertEqual(zfp.read(arcname), content)
+                    self.assertEqual(zfp.read('data.json'), b'{"a": 1}')
+                    self.assertEqual(zfp.read('buffer.txt'), b'buffer' * 100)
+                    with zipfile.ZipFile(BytesIO(zfp.read('inner.zip'))) as inner_zfp:
+                        self.assertEqual(inner_zfp.read('x.txt'), b'abc' * 100)
+                    types = dict((zinfo.filename, zinfo.compress_type) for zinfo in zfp.infolist())
+
+                # Empty streams are not added and already compressed data is stored
+                self.assertNotIn('no_data.txt', types)
+                self.assertEqual(types['dir/archive.zip'], zipfile.ZIP_STORED)
+                self.assertEqual(types['dir/gzipped.dat'], zipfile.ZIP_STORED)
+                self.assertEqual(types['inner.zip'], zipfile.ZIP_STORED)
+                self.assertEqual(types['dir/text.txt'], zipfile.ZIP_DEFLATED)
+                self.assertEqual(types['dir/random.bin'], zipfile.ZIP_DEFLATED)
+
+    def test_is_compressed(self):
+        self.assertTrue(is_compressed('archive.ZIP'))
+        self.assertTrue(is_compressed('data', b'\x89PNG\r\n'))
+        self.assertFalse(is_compressed('data.txt', b'text'))
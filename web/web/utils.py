@@ -20,8 +20,10 @@
 #
 
 import hashlib
+import json
 import logging
 import os
+import re
 import shutil
 import tempfile
 import time
@@ -30,6 +32,7 @@ import zipfile
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.files import File
+from django.core.files.storage import FileSystemStorage
 from django.db.models import Q
 from django.http import HttpResponseBadRequest, JsonResponse, Http404
 from django.template import Template, Context
@@ -46,6 +49,10 @@ GROUP_BLOCKER = {}
 CALL_STATISTIC = {}
 TESTS_DIR = 'Tests'
 
+# Size of text, which is read at once while JSON list is decoded incrementally
+JSON_READ_SIZE = 1024 * 1024
+JSON_WHITESPACE = re.compile(r'\s*')
+
 logger = logging.getLogger('web')
 
 
@@ -103,6 +110,108 @@ def file_get_or_create(fp, filename, table, check_size=False):
         return db_file, check_sum
 
 
+def save_file_from_path(field_file, filename, path):
+    # The file is hard linked into the local storage if it is possible or copied without reading it
+    # into memory (with sendfile() if the platform supports it), so the model must be saved after that
+    storage = field_file.storage
+    save_from_path = getattr(storage, 'save_from_path', None)
+    if callable(save_from_path):
+        # Storage chooses the name by the file content
+        setattr(field_file.instance, field_file.field.attname, save_from_path(filename, path))
+        return
+    if not isinstance(storage, FileSystemStorage):
+        with open(path, mode='rb') as fp:
+            field_file.save(filename, File(fp), save=False)
+        return
+    name = field_file.field.generate_filename(field_file.instance, filename)
+    while True:
+        name = storage.get_available_name(name, max_length=field_file.field.max_length)
+        full_path = storage.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        try:
+            os.link(path, full_path)
+        except FileExistsError:
+            continue
+        except OSError:
+            # Storage and the file are on different file systems
+            try:
+                __copy_file(path, full_path)
+            except FileExistsError:
+                continue
+        break
+    add_references = getattr(storage, 'add_references', None)
+    if callable(add_references):
+        add_references([name])
+    setattr(field_file.instance, field_file.field.attname, name)
+
+
+def __copy_file(src_path, dst_path):
+    with open(src_path, mode='rb') as src, open(dst_path, mode='xb') as dst:
+        size = os.fstat(src.fileno()).st_size
+        offset = 0
+        try:
+            while offset < size:
+                sent = os.sendfile(dst.fileno(), src.fileno(), offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+        except (AttributeError, OSError):
+            src.seek(offset)
+            dst.seek(offset)
+            shutil.copyfileobj(src, dst)
+
+
+def iter_json_list(fp, read_size=JSON_READ_SIZE):
+    # Items of JSON list are decoded one by one from the text file object, so the whole file is never
+    # loaded into memory. Only the text of the current item and the next read block is kept.
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    # None - the list is not started, True - an item is expected, False - a separator is expected
+    expect_item = None
+    is_first = True
+
+    while True:
+        pos = JSON_WHITESPACE.match(buf, pos).end()
+        if pos == len(buf):
+            data = fp.read(max(read_size, len(buf) - pos))
+            if not data:
+                raise ValueError('Unexpected end of JSON list')
+            buf = buf[pos:] + data
+            pos = 0
+            continue
+        if expect_item is None:
+            if buf[pos] != '[':
+                raise ValueError('JSON list was expected')
+            pos += 1
+            expect_item = True
+        elif buf[pos] == ']' and (not expect_item or is_first):
+            return
+        elif not expect_item:
+            if buf[pos] != ',':
+                raise ValueError('Wrong separator of JSON list items')
+            pos += 1
+            expect_item = True
+        else:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                item, end = None, len(buf)
+            next_pos = JSON_WHITESPACE.match(buf, end).end()
+            if next_pos == len(buf) or buf[next_pos] not in ',]':
+                # The item can be incomplete (e.g. it is a number that can be continued)
+                data = fp.read(max(read_size, len(buf) - pos))
+                if data:
+                    buf = buf[pos:] + data
+                    pos = 0
+                    continue
+                item, end = decoder.raw_decode(buf, pos)
+            pos = end
+            expect_item = False
+            is_first = False
+            yield item
+
+
 # archive - django.core.files.File object
 # Example: archive = File(open(<path>, mode='rb'))
 # Note: files from requests are already File objects
@@ -231,46 +340,40 @@ class RemoveFilesBeforeDelete:
 
     def __remove_progress_files(self, progress):
         from service.models import Solution, Task
-        for files in Solution.objects.filter(task__progress=progress).values_list('archive'):
-            self.__remove(files)
-        for files in Task.objects.filter(progress=progress).values_list('archive'):
-            self.__remove(files)
+        self.__remove(Solution.objects.filter(task__progress=progress).values_list('archive', flat=True))
+        self.__remove(Task.objects.filter(progress=progress).values_list('archive', flat=True))
 
     def __remove_reports_files(self, root):
-        from reports.models import ReportSafe, ReportUnsafe, ReportUnknown, ReportComponent, CoverageArchive
-        for files in ReportSafe.objects.filter(Q(root=root) & ~Q(proof=None)).values_list('proof'):
-            self.__remove(files)
-        for files in ReportUnsafe.objects.filter(root=root).values_list('error_trace'):
-            self.__remove(files)
-        for files in ReportUnknown.objects.filter(root=root).values_list('problem_description'):
-            self.__remove(files)
-        for files in ReportComponent.objects.filter(root=root).exclude(log='', data='', verifier_input='') \
-                .values_list('log', 'verifier_input', 'data'):
-            self.__remove(files)
-        for files in CoverageArchive.objects.filter(report__root=root).values_list('archive'):
-            self.__remove(files)
+        from reports.models import ReportSafe, ReportUnsafe, ReportUnknown, ReportComponent, CoverageArchive, \
+            ErrorTraceSource, AttrFile, CoverageFile, CoverageDataStatistics
+        self.__remove(ReportSafe.objects.filter(Q(root=root) & ~Q(proof=None)).values_list('proof', flat=True))
+        self.__remove(ReportUnsafe.objects.filter(root=root).values_list('error_trace', flat=True))
+        self.__remove(ReportUnknown.objects.filter(root=root).values_list('problem_description', flat=True))
+        self.__remove(f for files in ReportComponent.objects.filter(root=root)
+                      .exclude(log='', data='', verifier_input='').values_list('log', 'verifier_input', 'data')
+                      for f in files)
+        self.__remove(CoverageArchive.objects.filter(report__root=root).values_list('archive', flat=True))
+        self.__remove(ErrorTraceSource.objects.filter(root=root).values_list('archive', flat=True))
+        self.__remove(AttrFile.objects.filter(root=root).values_list('file', flat=True))
+        self.__remove(CoverageFile.objects.filter(archive__report__root=root).values_list('file', flat=True))
+        self.__remove(CoverageDataStatistics.objects.filter(archive__report__root=root)
+                      .values_list('data', flat=True))
 
     def __remove_task_files(self, task):
         from service.models import Solution
         files = set()
         try:
-            files.add(Solution.objects.get(task=task).archive.path)
+            files.add(Solution.objects.get(task=task).archive.name)
         except ObjectDoesNotExist:
             pass
-        files.add(task.archive.path)
+        files.add(task.archive.name)
         self.__remove(files)
 
     def __remove(self, files):
+        # Files are released in the ledger and removed later (see tools.files)
+        from tools.files import release_files
         self.__is_not_used()
-        for f in files:
-            if f:
-                path = os.path.join(settings.MEDIA_ROOT, f)
-                try:
-                    os.remove(path)
-                except OSError:
-                    pass
-                except Exception as e:
-                    logger.exception(e)
+        release_files(f for f in files if f)
 
     def __is_not_used(self):
         pass
@@ -196,6 +196,13 @@ ASSOCIATION_TYPE = (
     ('2', _('Unconfirmed'))
 )
 
+# Clusters of error traces in jobs comparison
+COMPARISON_CATEGORY = (
+    ('0', _('Common')),
+    ('1', _('Only in the first job')),
+    ('2', _('Only in the second job'))
+)
+
 ATTRIBUTES_OPERATOR_EQ = 'eq'
 ATTRIBUTES_OPERATOR_RE = 're'
 ATTRIBUTES_OPERATOR_NE = 'ne'